@@ -202,4 +202,52 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-
+# Liczba usług na jednej stronie listy na stronie głównej
+HOME_PAGE_SIZE = 12
+
+# Cache wersji katalogu i dostępności oraz wpisów katalogu. Cache w pamięci działa tylko przy jednym
+# procesie aplikacji: unieważnienie z jednego procesu nie dociera do pozostałych, więc przy kilku
+# procesach (np. gunicorn --workers 4) trzeba użyć wspólnego backendu, np.
+# {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}
+# (wymaga pakietu redis). Cache w bazie danych nie nadaje się: odczyty z cache stają się zapytaniami
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# Cache katalogu usług (fasety, opcje typów); unieważniany sygnałami przy zmianach katalogu
+CATALOG_CACHE_TIMEOUT = 15 * 60
+CATALOG_PRICE_BUCKETS = (100, 250, 500, 1000)
+
+# Maksymalna liczba opcji zwracana przez api/get_service_options/
+SERVICE_OPTIONS_MAX_LIMIT = 500
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AVAILABILITY_HORIZON_DAYS = 365
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+# Godziny otwarcia i długość terminu (w minutach) dla usług rezerwowanych na godzinę
+SLOT_SCHEDULE = {
+    'Restauracja': ('12:00', '22:00', 120),
+    'SPA&WELLNESS': ('09:00', '20:00', 60),
+}
+SLOT_HORIZON_DAYS = 60
+
+
+# Czas (w minutach), na jaki wybrany termin jest blokowany przed wysłaniem formularza rezerwacji
+HOLD_MINUTES = 10
+# Maksymalna liczba pozycji w jednej rezerwacji grupowej (api/reservations/group/)
+BOOKING_GROUP_MAX_LINES = 50
+# Rozstrzyganie zaległych rezerwacji (komenda expire_reservations)
+RESERVATION_PENDING_HOURS = 48
+RESERVATION_PENDING_ACTION = 'confirm'
+RESERVATION_CANCELLATION_HOURS = 7 * 24
+RESERVATION_CANCELLATION_REFUND = 0.5
+# Ilu pierwszych oczekujących sprawdzać przy zwolnieniu miejsca
+WAITLIST_PROMOTION_BATCH = 10
+# Rozmiar paczki przy wysyłaniu wiadomości do wielu użytkowników
+MESSAGE_BROADCAST_BATCH = 1000
+# Maksymalna liczba terminów w jednej rezerwacji cyklicznej
+RESERVATION_SERIES_MAX_OCCURRENCES = 26
+# Liczba zgłoszeń z kolejki wyprzedaży rozstrzyganych w jednej transakcji (komenda drain_admission_queue)
+FLASH_SALE_BATCH = 25
@@ -10,9 +10,9 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.http import HttpResponseRedirect
 from reportlab.lib.pagesizes import letter
 from . import models
-from .forms import ReservationAdminForm
+from .forms import BroadcastMessageForm, ReservationAdminForm
 from .models import User, Review, ServiceOption, ServiceStatus, DataSummaryLink
-from django.utils.timezone import now
+from django.utils.timezone import now, localtime
 from django import forms
 from django.contrib import admin
 from django.db import models
@@ -30,6 +30,13 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import ttfonts
 import os
 from django.conf import settings
+from .caching import get_cache_stats
+from .models import AdmissionRequest, PointsTransaction, ReservationSeries, WaitlistEntry
+from .points import apply_points
+from .transitions import CONFIRMED, PENDING, PENDING_CANCELLATION, cancel, transition_many
+from .transitions import approve_modifications, reject_modifications
+from .broadcast import broadcast_to, create_messages
+from .holds import hold_metrics
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
@@ -55,6 +62,22 @@ class CustomUserAdmin(BaseUserAdmin):
         (None, {'classes': ('wide',), 'fields': ('email', 'password1', 'password2', 'first_name', 'last_name', 'balance', 'is_active', 'is_staff')}),
     )
 
+    def save_model(self, request, obj, form, change):
+        # Zmiana salda trafia do księgi punktów jako przyznanie przez administratora
+        if change:
+            old_balance = form.initial.get('balance') or 0
+            delta = obj.balance - old_balance
+            fields = [field.name for field in obj._meta.concrete_fields if not field.primary_key and field.name != 'balance']
+            obj.save(update_fields=fields)
+            obj.balance = old_balance
+        else:
+            delta = obj.balance
+            obj.balance = 0
+            obj.save()
+
+        if delta:
+            apply_points(obj, delta, PointsTransaction.ADMIN_GRANT, description=f"Korekta salda: {request.user}")
+
 admin.site.register(User, CustomUserAdmin)
 
 
@@ -72,28 +95,21 @@ class ServiceAdmin(admin.ModelAdmin):
     inlines = [ServiceOptionInline]
 
     def get_min_price(self, obj):
-        options = obj.service_options.all()
-        min_price = options.aggregate(Min('price'))['price__min']
-        if min_price is not None:
-            return f"{min_price:.2f} punktów"
+        # Statystyki opcji są zapisane w wierszu usługi, bez dodatkowych zapytań
+        if obj.min_price is not None:
+            return f"{obj.min_price:.2f} punktów"
         return "Brak cen"
 
     get_min_price.short_description = "Najniższa cena"
+    get_min_price.admin_order_field = 'min_price'
 
     def get_capacity(self, obj):
-        # Pobierz maksymalną pojemność z powiązanych opcji
-        options = obj.service_options.all()
-
-        # Obsługa queryset i listy
-        if hasattr(options, 'exists') and not options.exists():
+        if obj.max_capacity is None:
             return "Brak danych"
-
-        if not options:  # Dla listy, sprawdzamy, czy jest pusta
-            return "Brak danych"
-
-        return max(option.capacity for option in options)
+        return obj.max_capacity
 
     get_capacity.short_description = "Maks. pojemność"
+    get_capacity.admin_order_field = 'max_capacity'
 
 admin.site.register(Service, ServiceAdmin)
 
@@ -104,8 +120,10 @@ class ReservationAdmin(admin.ModelAdmin):
     )
     list_filter = ('status', 'option', 'user')
     search_fields = ('user__email', 'option__name', 'service_name')
+    # Użytkownik i opcja z listy w tym samym zapytaniu; nazwa usługi jest zapisana w rezerwacji
+    list_select_related = ('user', 'option')
 
-    readonly_fields = ('new_start_datetime', 'new_end_datetime')
+    readonly_fields = ('new_start_datetime', 'new_end_datetime', 'status_changed_at')
 
     actions = ['cancel_reservation', 'approve_cancellation', 'approve_modification', 'reject_modification','confirm_reservations']
 
@@ -117,29 +135,27 @@ class ReservationAdmin(admin.ModelAdmin):
 
         content = form.cleaned_data.get('message_content', None)
         if content:
-            # Tworzenie wiadomości od administratora
-            message = Message.objects.create(
+            # Tworzenie wiadomości od administratora (bez Message.save, które powiązałoby ją z pierwszą rezerwacją)
+            message, = create_messages([Message(
                 user=obj.user,
                 subject="Wiadomość od administratora",
                 content=content,
                 sender='admin'
-            )
+            )])
             # Automatyczne powiązanie z bieżącą rezerwacją
             message.reservations.add(obj)
             self.message_user(request, f"Wiadomość została wysłana do {obj.user.email}.")
 
     def service_name(self, obj):
-        return obj.option.service.name if obj.option and obj.option.service else "Brak danych"
+        # Nazwa zapisana w rezerwacji (Reservation.sync_service), bez zapytania o opcję i usługę
+        return obj.service_name or "Brak danych"
 
     service_name.short_description = "Nazwa usługi"
+    service_name.admin_order_field = 'service_name'
 
     def confirm_reservations(self, request, queryset):
-        updated = 0
-        for reservation in queryset:
-            if reservation.status == 'pending':
-                reservation.status = 'confirmed'
-                reservation.save()
-                updated += 1
+        # Jeden UPDATE dla wszystkich oczekujących (zob. transitions.py)
+        updated = transition_many(queryset, CONFIRMED, expected=[PENDING])
         self.message_user(
             request,
             f"{updated} rezerwacja(-e) zostały potwierdzone.",
@@ -148,36 +164,58 @@ class ReservationAdmin(admin.ModelAdmin):
 
     confirm_reservations.short_description = "Potwierdź wybrane rezerwacje"
 
-    def approve_cancellation(self, request, queryset):
-        for reservation in queryset:
-            if reservation.status == 'pending cancellation':
-                try:
-                    with transaction.atomic():
-                        reservation.status = 'cancelled'
-                        reservation.save()
-
-                        refund_points = reservation.price
-                        reservation.user.balance += refund_points
-                        reservation.user.save()
-
-                        self.message_user(
-                            request,
-                            f"Rezerwacja {reservation.id} została anulowana. Zwrocono {refund_points:.2f} punktów (50%)."
-                        )
-                except Exception as e:
-                    self.message_user(
-                        request,
-                        f"Błąd podczas anulowania rezerwacji {reservation.id}: {str(e)}",
-                        level='error'
-                    )
+    def cancel_with_refund(self, request, queryset, expected, warning):
+        """Anuluje rezerwacje z pełnym zwrotem; zwrot tylko dla rezerwacji, których status zmieniła ta akcja."""
+        for reservation in queryset.select_related('user'):
+            try:
+                refund = cancel(reservation, reservation.price, expected=expected)
+            except Exception as e:
+                self.message_user(
+                    request,
+                    f"Błąd podczas anulowania rezerwacji {reservation.id}: {str(e)}",
+                    level='error'
+                )
+                continue
+
+            if refund is None:
+                self.message_user(request, warning.format(id=reservation.id), level='warning')
             else:
                 self.message_user(
                     request,
-                    f"Rezerwacja {reservation.id} nie jest w stanie oczekującym na anulowanie.",
-                    level='warning'
+                    f"Rezerwacja {reservation.id} została anulowana. Zwrocono {refund.amount:.2f} punktów."
                 )
+
+    def approve_cancellation(self, request, queryset):
+        self.cancel_with_refund(
+            request, queryset, [PENDING_CANCELLATION],
+            "Rezerwacja {id} nie jest w stanie oczekującym na anulowanie.",
+        )
     approve_cancellation.short_description = "Zatwierdź anulowanie rezerwacji i zwróć pieniądze"
 
+    def approve_modification(self, request, queryset):
+        # Kolizje sprawdzane jednym zapytaniem, zatwierdzenie jednym UPDATE (zob. transitions.py)
+        approved, conflicts = approve_modifications(queryset)
+        self.message_user(request, f"Zatwierdzono zmianę terminu: {approved} rezerwacja(-e).", level='success')
+        if conflicts:
+            self.message_user(
+                request,
+                "Nowy termin jest zajęty lub niedostępny, nie zatwierdzono: " + ", ".join(
+                    f"{reservation.id} ({reservation.option.name}, {localtime(reservation.new_start_datetime):%d.%m.%Y %H:%M})"
+                    for reservation in conflicts
+                ),
+                level='warning'
+            )
+    approve_modification.short_description = "Zatwierdź zmianę terminu"
+
+    def reject_modification(self, request, queryset):
+        rejected = reject_modifications(queryset)
+        self.message_user(request, f"Odrzucono zmianę terminu: {rejected} rezerwacja(-e).", level='success')
+    reject_modification.short_description = "Odrzuć zmianę terminu"
+
+    def cancel_reservation(self, request, queryset):
+        self.cancel_with_refund(request, queryset, None, "Rezerwacja {id} jest już anulowana.")
+    cancel_reservation.short_description = "Anuluj rezerwacje i zwróć pieniądze"
+
 
 admin.site.register(Reservation, ReservationAdmin)
 
@@ -187,9 +225,58 @@ class ReviewAdmin(admin.ModelAdmin):
     list_filter = ('rating',)
     search_fields = ('user__email', 'service__name', 'comment')
     ordering = ('service',)
+    list_select_related = ('user', 'service')
 
 admin.site.register(Review, ReviewAdmin)
 
+
+# Księga punktów jest tylko do odczytu; saldo zmienia się przez apply_points
+class PointsTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'amount', 'reason', 'reservation', 'description', 'created_at')
+    list_filter = ('reason', 'created_at')
+    search_fields = ('user__email', 'description')
+    # Opis rezerwacji (Reservation.__str__) zawiera jej użytkownika
+    list_select_related = ('user', 'reservation__user')
+    raw_id_fields = ('user', 'reservation')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+admin.site.register(PointsTransaction, PointsTransactionAdmin)
+
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'option', 'start_datetime', 'end_datetime', 'status', 'created_at', 'promoted_at')
+    list_filter = ('status',)
+    search_fields = ('user__email', 'option__name')
+    list_select_related = ('user', 'option')
+    raw_id_fields = ('user', 'option', 'reservation')
+
+admin.site.register(WaitlistEntry, WaitlistEntryAdmin)
+
+class ReservationSeriesAdmin(admin.ModelAdmin):
+    list_display = ('user', 'option', 'frequency', 'interval', 'start_datetime', 'until', 'created_at')
+    list_filter = ('frequency',)
+    search_fields = ('user__email', 'option__name')
+    list_select_related = ('user', 'option')
+    raw_id_fields = ('user', 'option')
+
+admin.site.register(ReservationSeries, ReservationSeriesAdmin)
+
+class AdmissionRequestAdmin(admin.ModelAdmin):
+    list_display = ('user', 'option', 'start_datetime', 'status', 'result', 'created_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('user__email', 'option__name')
+    list_select_related = ('user', 'option')
+    raw_id_fields = ('user', 'option', 'slot')
+
+admin.site.register(AdmissionRequest, AdmissionRequestAdmin)
+
 # Konfiguracja dla modelu wiadomości
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('user', 'subject', 'created_at', 'is_read', 'response_date')
@@ -197,6 +284,7 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'subject', 'content', 'response')
     fields = ('user', 'subject', 'content', 'created_at', 'is_read', 'response', 'response_date')
     readonly_fields = ('user', 'subject', 'content', 'created_at', 'response_date')
+    list_select_related = ('user',)
 
     actions = ['mark_as_read', 'mark_as_unread']
 
@@ -219,6 +307,32 @@ class MessageAdmin(admin.ModelAdmin):
             obj.response_date = now()
         super().save_model(request, obj, form, change)
 
+    change_list_template = 'admin/message_change_list.html'
+
+    def get_urls(self):
+        custom_urls = [
+            path('broadcast/', self.admin_site.admin_view(self.broadcast_view), name='message-broadcast'),
+        ]
+        return custom_urls + super().get_urls()
+
+    def broadcast_view(self, request):
+        """Wiadomość do wielu użytkowników (zob. broadcast.py)."""
+        form = BroadcastMessageForm(request.POST or None)
+        if request.method == 'POST' and form.is_valid():
+            sent = broadcast_to(
+                form.cleaned_data['subject'], form.cleaned_data['content'],
+                service=form.cleaned_data['service'], city=form.cleaned_data['city'],
+            )
+            self.message_user(request, f"Wiadomość wysłano do {sent} użytkowników.")
+            return HttpResponseRedirect(reverse('admin:main_message_changelist'))
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Wiadomość do wielu użytkowników",
+            'opts': self.model._meta,
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/broadcast_message.html', context)
+
 admin.site.register(Message, MessageAdmin)
 
 @admin.register(ServiceStatus)
@@ -226,6 +340,17 @@ class ServiceStatusAdmin(admin.ModelAdmin):
     list_display = ('status', 'message', 'next_available')
     search_fields = ('status',)
 
+def get_most_popular_service():
+    """Usługa z największą liczbą rezerwacji: grupowanie po Reservation.service_id, bez złączenia przez opcje."""
+    return (
+        Reservation.objects.filter(service__isnull=False)
+        .values('service_id', 'service__name')
+        .annotate(reservation_count=Count('pk'))
+        .order_by('-reservation_count')
+        .first()
+    )
+
+
 class DataSummaryAdminView:
 
     def get_urls(self):
@@ -244,13 +369,7 @@ class DataSummaryAdminView:
         total_reviews = Review.objects.count()
         total_revenue = Reservation.objects.aggregate(total=Sum('price'))['total'] or 0
         total_users = User.objects.count()
-        most_popular_service = (
-            Service.objects.annotate(
-                reservation_count=Count('service_options__reservation')
-            )
-            .order_by('-reservation_count')
-            .first()
-        )
+        most_popular_service = get_most_popular_service()
 
         # Przygotowanie danych do szablonu
         context = {
@@ -258,8 +377,10 @@ class DataSummaryAdminView:
             'total_reviews': total_reviews,
             'total_revenue': total_revenue,
             'total_users': total_users,
-            'most_popular_service': most_popular_service.name if most_popular_service else "Brak danych",
-            'most_popular_service_count': most_popular_service.reservation_count if most_popular_service else 0,
+            'most_popular_service': most_popular_service['service__name'] if most_popular_service else "Brak danych",
+            'most_popular_service_count': most_popular_service['reservation_count'] if most_popular_service else 0,
+            'cache_stats': get_cache_stats(),
+            'hold_stats': hold_metrics(),
         }
 
         # Renderowanie szablonu
@@ -286,14 +407,10 @@ class DataSummaryAdminView:
         total_reviews = Review.objects.count()
         total_revenue = Reservation.objects.aggregate(total=Sum('price'))['total'] or 0
         total_users = User.objects.count()
-        most_popular_service = (
-            Service.objects.annotate(reservation_count=Count('service_options__reservation'))
-            .order_by('-reservation_count')
-            .first()
-        )
+        most_popular_service = get_most_popular_service()
 
-        most_popular_service_name = most_popular_service.name if most_popular_service else "Brak danych"
-        most_popular_service_count = most_popular_service.reservation_count if most_popular_service else 0
+        most_popular_service_name = most_popular_service['service__name'] if most_popular_service else "Brak danych"
+        most_popular_service_count = most_popular_service['reservation_count'] if most_popular_service else 0
 
         # Dane wierszy
         writer.writerow(['Liczba rezerwacji', total_reservations])
@@ -337,13 +454,9 @@ class DataSummaryAdminView:
         total_reviews = Review.objects.count()
         total_revenue = Reservation.objects.aggregate(total=Sum('price'))['total'] or 0
         total_users = User.objects.count()
-        most_popular_service = (
-            Service.objects.annotate(reservation_count=Count('service_options__reservation'))
-            .order_by('-reservation_count')
-            .first()
-        )
-        most_popular_service_name = most_popular_service.name if most_popular_service else "Brak danych"
-        most_popular_service_count = most_popular_service.reservation_count if most_popular_service else 0
+        most_popular_service = get_most_popular_service()
+        most_popular_service_name = most_popular_service['service__name'] if most_popular_service else "Brak danych"
+        most_popular_service_count = most_popular_service['reservation_count'] if most_popular_service else 0
 
         # Tabela danych
         data = [
@@ -0,0 +1,173 @@
+"""Kolejka rezerwacji opcji w trybie wyprzedaży (``ServiceOption.flash_sale``).
+
+Gdy setki użytkowników rezerwują tę samą opcję w ciągu kilku sekund, zwykła
+ścieżka (booking.py) ustawia ich w kolejce na blokadzie wiersza opcji, a każdy
+czekający trzyma połączenie z bazą. W trybie wyprzedaży żądanie tylko dopisuje
+zgłoszenie (jeden INSERT, bez blokad) i od razu zwraca odpowiedź; wynik klient
+odpytuje w ``admission_status``.
+
+Zgłoszenia przetwarza komenda ``drain_admission_queue``: ``drain`` pobiera
+partię zgłoszeń opcji w kolejności przyjęcia i rozstrzyga je w jednej
+transakcji, z jedną blokadą opcji, jednym odczytem zajętości i sald, jednym
+``bulk_create`` rezerwacji i jednym zbiorczym obciążeniem sald; każdy wpis
+obciążenia w księdze i każde zgłoszenie wskazują utworzoną rezerwację.
+"""
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .availability import bump_availability_version
+from .booking import BookingError, create_reservations, overlaps, validate_line
+from .holds import active_holds
+from .models import AdmissionRequest, PointsTransaction, Reservation, ServiceOption, TimeSlot, User, overlap_condition
+from .points import apply_points_many, to_points
+
+NO_FUNDS = "Nie masz wystarczających środków na koncie."
+NO_PLACES = "Brak wolnych miejsc w wybranym terminie."
+BOOKED = "Rezerwacja została pomyślnie utworzona!"
+
+
+def get_batch_size():
+    return getattr(settings, 'FLASH_SALE_BATCH', 25)
+
+
+def enqueue(user, option, start, end=None, slot=None, price=0):
+    """Dopisuje zgłoszenie do kolejki opcji; zwraca (zgłoszenie, czy nowe).
+
+    Użytkownik ma w kolejce opcji najwyżej jedno zgłoszenie naraz.
+    """
+    request = AdmissionRequest.objects.filter(user=user, option=option, status=AdmissionRequest.QUEUED).first()
+    if request is not None:
+        return request, False
+    return AdmissionRequest.objects.create(
+        user=user, option=option, slot=slot, start_datetime=start, end_datetime=end, price=price,
+    ), True
+
+
+def position(request):
+    """Miejsce zgłoszenia w kolejce (1 = następne do przetworzenia); None po przetworzeniu."""
+    if request.status != AdmissionRequest.QUEUED:
+        return None
+    return AdmissionRequest.objects.filter(
+        Q(created_at__lt=request.created_at) | Q(created_at=request.created_at, pk__lt=request.pk),
+        option_id=request.option_id, status=AdmissionRequest.QUEUED,
+    ).count() + 1
+
+
+def queued_option_ids():
+    return list(
+        AdmissionRequest.objects.filter(status=AdmissionRequest.QUEUED)
+        .order_by().values_list('option_id', flat=True).distinct()
+    )
+
+
+def taken_intervals(option_id, queued):
+    """Zajęte przedziały opcji nachodzące na zgłoszenia: (start, koniec, id właściciela blokady lub None)."""
+    window = reduce(or_, (overlap_condition(request.start_datetime, request.end_datetime) for request in queued))
+    taken = [
+        (start, end, None)
+        for start, end in Reservation.objects.active().filter(window, option_id=option_id)
+        .values_list('start_datetime', 'end_datetime')
+    ]
+    taken += active_holds().filter(window, option_id=option_id).values_list('start_datetime', 'end_datetime', 'user_id')
+    return taken
+
+
+def drain(option_id, batch_size=None):
+    """Rozstrzyga pierwszą partię kolejki opcji w jednej transakcji; zwraca (zarezerwowane, odrzucone).
+
+    Zgłoszenia blokowane są z ``skip_locked``, więc kilka procesów komendy może
+    pracować równolegle bez przetworzenia zgłoszenia dwa razy.
+    """
+    with transaction.atomic():
+        queued = list(
+            AdmissionRequest.objects.select_for_update(skip_locked=True)
+            .filter(option_id=option_id, status=AdmissionRequest.QUEUED)
+            .order_by('created_at', 'pk')[:batch_size or get_batch_size()]
+        )
+        if not queued:
+            return 0, 0
+
+        option = ServiceOption.objects.select_for_update().select_related('service').get(pk=option_id)
+        # Pod blokadą wierszy użytkowników odczytane saldo jest aktualne do końca transakcji
+        balances = dict(
+            User.objects.select_for_update().filter(pk__in={request.user_id for request in queued})
+            .order_by('pk').values_list('pk', 'balance')
+        )
+        slot_ids = {request.slot_id for request in queued if request.slot_id is not None}
+        remaining = dict(
+            TimeSlot.objects.select_for_update().filter(pk__in=slot_ids).values_list('pk', 'remaining')
+        ) if slot_ids else {}
+        unslotted = [request for request in queued if request.slot_id is None]
+        taken = taken_intervals(option_id, unslotted) if unslotted else []
+
+        outcomes = {}
+        booked, used_slots = {}, Counter()
+        for request in queued:
+            start, end = request.start_datetime, request.end_datetime
+            price = to_points(request.price)
+            try:
+                validate_line(option, start, end)
+            except BookingError as error:
+                outcomes[request.pk] = (AdmissionRequest.REJECTED, str(error))
+                continue
+            if balances[request.user_id] < price:
+                outcomes[request.pk] = (AdmissionRequest.REJECTED, NO_FUNDS)
+                continue
+
+            if request.slot_id is not None:
+                free = remaining.get(request.slot_id, 0) > 0
+            else:
+                # Własna blokada użytkownika nie zabiera mu miejsca (jak w booking.reserve_inventory)
+                free = sum(
+                    overlaps((start, end), (other_start, other_end))
+                    for other_start, other_end, holder in taken if holder != request.user_id
+                ) < option.units
+            if not free:
+                outcomes[request.pk] = (AdmissionRequest.REJECTED, NO_PLACES)
+                continue
+
+            if request.slot_id is not None:
+                remaining[request.slot_id] -= 1
+                used_slots[request.slot_id] += 1
+            else:
+                taken.append((start, end, None))
+            balances[request.user_id] -= price
+            booked[request.pk] = Reservation(
+                user_id=request.user_id, service=option.service, service_name=option.service.name, option=option,
+                slot_id=request.slot_id, start_datetime=start, end_datetime=end, price=request.price, status='pending',
+            )
+            outcomes[request.pk] = (AdmissionRequest.BOOKED, BOOKED)
+
+        reservations = create_reservations(list(booked.values()))
+        apply_points_many(
+            [(reservation.user_id, -to_points(reservation.price), reservation.pk) for reservation in reservations],
+            PointsTransaction.RESERVATION, description=f"Rezerwacja: {option.service.name}",
+        )
+        for slot_id, count in used_slots.items():
+            TimeSlot.objects.filter(pk=slot_id).update(remaining=F('remaining') - count)
+
+        # Jeden UPDATE na wynik (rezerwacja, brak środków, brak miejsc...), a nie na zgłoszenie
+        grouped = defaultdict(list)
+        for pk, outcome in outcomes.items():
+            grouped[outcome].append(pk)
+        processed_at = timezone.now()
+        for (status, result), ids in grouped.items():
+            changes = {}
+            if status == AdmissionRequest.BOOKED:
+                changes['reservation_id'] = Case(
+                    *(When(pk=pk, then=Value(booked[pk].pk)) for pk in ids), default=None,
+                )
+            AdmissionRequest.objects.filter(pk__in=ids).update(
+                status=status, result=result, processed_at=processed_at, **changes,
+            )
+
+    if reservations:
+        # bulk_create nie wysyła sygnałów, więc silnik dostępności przebuduje się od nowa
+        bump_availability_version()
+    return len(reservations), len(queued) - len(reservations)
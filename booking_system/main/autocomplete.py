@@ -0,0 +1,110 @@
+"""Podpowiedzi lokalizacji i nazw usług (autouzupełnianie).
+
+Indeks to posortowana lista kluczy bez polskich znaków ("krakow", "lodz") i
+wyszukiwanie prefiksu przez bisect, więc "Krakow" lub "lodz" znajduje "Kraków"
+i "Łódź". Kluczem jest cała etykieta oraz każdy jej sufiks od początku słowa, więc
+"wawel" podpowiada również "Hotel Wawel".
+
+Indeks jest budowany w pamięci procesu raz na wersję katalogu (zob. catalog.py);
+lista etykiet pochodzi z cache katalogu, dlatego zapytanie o podpowiedzi nie
+odwołuje się do bazy danych.
+"""
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .catalog import get_catalog_entry, get_catalog_version
+from .models import Service
+from .text import TOKEN_RE, fold
+
+LOCATION = 'location'
+SERVICE = 'service'
+
+
+def normalize(text):
+    return ' '.join(TOKEN_RE.findall(fold(text)))
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        rows = set()
+        for label, kind in entries:
+            words = normalize(label).split()
+            for start in range(len(words)):
+                # Dopasowanie od początku etykiety ma pierwszeństwo przed dopasowaniem słowa
+                rows.add((' '.join(words[start:]), start > 0, kind, label))
+        rows = sorted(rows)
+        self.keys = [row[0] for row in rows]
+        self.entries = [(row[1], row[2], row[3]) for row in rows]
+
+    def lookup(self, prefix, limit=10, kind=None):
+        """Etykiety pasujące do prefiksu: najpierw od początku etykiety, potem od słowa."""
+        prefix = normalize(prefix)
+        if not prefix or limit <= 0:
+            return []
+
+        full, partial, seen = [], [], set()
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            is_partial, entry_kind, label = self.entries[position]
+            position += 1
+            if (kind and entry_kind != kind) or (entry_kind, label) in seen:
+                continue
+            seen.add((entry_kind, label))
+            (partial if is_partial else full).append({'label': label, 'kind': entry_kind})
+            if len(full) >= limit:
+                break
+        return (full + partial)[:limit]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def compute_entries():
+    rows = Service.objects.order_by().values_list('location', 'name').distinct()
+    entries = set()
+    for location, name in rows:
+        entries.add((location, LOCATION))
+        entries.add((name, SERVICE))
+    return sorted(entries)
+
+
+_index = (None, PrefixIndex([]))
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Indeks dla bieżącej wersji katalogu; po zmianie katalogu budowany od nowa."""
+    global _index
+    version = get_catalog_version()
+    if _index[0] == version:
+        return _index[1]
+
+    with _index_lock:
+        if _index[0] != version:
+            _index = (version, PrefixIndex(get_catalog_entry('autocomplete', compute_entries)))
+        return _index[1]
+
+
+def get_limit(value):
+    default = getattr(settings, 'AUTOCOMPLETE_LIMIT', 10)
+    try:
+        return max(1, min(int(value), getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 50)))
+    except (TypeError, ValueError):
+        return default
+
+
+def suggest(prefix, limit=None, kind=None):
+    return get_index().lookup(prefix, get_limit(limit), kind)
+
+
+def canonical_location(value, cities):
+    """Zamienia wpisaną lokalizację ("krakow") na nazwę z katalogu ("Kraków"), jeśli pasuje."""
+    if not value or value in cities:
+        return value
+    folded = normalize(value)
+    for city in cities:
+        if normalize(city) == folded:
+            return city
+    return value
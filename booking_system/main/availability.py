@@ -0,0 +1,313 @@
+"""Dostępność opcji usług w pamięci procesu (bitmapy opcji na każdą noc).
+
+Każda opcja ma numer bitu. Dla każdej nocy od dzisiaj silnik trzyma bitmapę opcji
+wolnych tej nocy: w oknie ``available_from``–``available_to`` (obie daty włącznie)
+i bez kompletu aktywnych rezerwacji. Miasto i pojemność też są bitmapami opcji,
+więc zapytanie o zakres [d1, d2) to AND bitmap miasta i pojemności z bitmapami
+kolejnych nocy, bez pętli po opcjach. Bitmapy są liczbami całkowitymi Pythona.
+Liczniki rezerwacji opcji na noc (``array('H')``) pozwalają zdjąć jedną z
+nakładających się rezerwacji bez przeliczania opcji. Aktywne blokady terminów
+(zob. holds.py) są nanoszone tak samo jak rezerwacje. Opcje z siatką terminów
+(slots.py) mają w każdym terminie ``units`` miejsc, więc ich dzień jest zajęty
+dopiero po zajęciu ``units`` miejsc w każdym terminie dnia.
+
+Silnik jest budowany raz na wersję katalogu i wersję dostępności (licznik w cache
+podbijany przy każdej zmianie rezerwacji). Zmiany zapisane w tym procesie są
+nanoszone przyrostowo (zob. signals.py) po zatwierdzeniu transakcji; jeśli wersję
+podbił inny proces, silnik jest budowany od nowa przy następnym zapytaniu.
+Operacje masowe na rezerwacjach (``QuerySet.update``) muszą wywołać
+``bump_on_commit`` (albo ``bump_availability_version`` już po transakcji).
+"""
+import threading
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .catalog import get_catalog_version
+from .models import BookingHold, Reservation, ServiceOption
+from .slots import slots_per_day
+
+AVAILABILITY_VERSION_KEY = 'availability:version'
+
+ACTIVE_STATUSES = Reservation.ACTIVE_STATUSES
+
+
+def get_horizon():
+    return getattr(settings, 'AVAILABILITY_HORIZON_DAYS', 365)
+
+
+def get_availability_version():
+    version = cache.get(AVAILABILITY_VERSION_KEY)
+    if version is None:
+        cache.add(AVAILABILITY_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(AVAILABILITY_VERSION_KEY)
+    return version
+
+
+def bump_availability_version():
+    try:
+        return cache.incr(AVAILABILITY_VERSION_KEY)
+    except ValueError:
+        get_availability_version()
+        return cache.incr(AVAILABILITY_VERSION_KEY)
+
+
+def to_day(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def night_range(start, end):
+    """Noce zajmowane przez pobyt: [start, end), co najmniej jedna."""
+    start_day = to_day(start)
+    end_day = to_day(end) if end else None
+    if end_day is None or end_day <= start_day:
+        end_day = start_day + timedelta(days=1)
+    return start_day, end_day
+
+
+class OptionDays:
+    __slots__ = ('bit', 'first', 'last', 'units', 'counts')
+
+    def __init__(self, bit, first, last, units=1):
+        self.bit = bit
+        # Noce okna dostępności [first, last) liczone od początku silnika
+        self.first = first
+        self.last = last
+        self.units = units
+        self.counts = None
+
+    def is_open(self, night):
+        return self.first <= night < self.last
+
+
+class AvailabilityEngine:
+    def __init__(self, origin, horizon):
+        self.origin = origin
+        self.horizon = horizon
+        self.options = {}
+        # Numer bitu -> id opcji
+        self.ids = []
+        # Miasto / pojemność -> bitmapa opcji
+        self.city_bits = defaultdict(int)
+        self.capacity_bits = defaultdict(int)
+        # Noc -> bitmapa opcji otwartych i niezajętych tej nocy
+        self.free_by_night = [0] * horizon
+        # Noc -> bitmapa opcji, których okno dostępności zaczyna się / kończy tej nocy
+        self.opening = defaultdict(int)
+        self.closing = defaultdict(int)
+        # Id rezerwacji lub hold_key blokady -> (id opcji, pierwsza noc, noc po ostatniej) naniesione na bitmapy
+        self.reservations = {}
+        self.key = None
+
+    @classmethod
+    def build(cls, origin=None, horizon=None):
+        engine = cls(origin or timezone.localdate(), horizon or get_horizon())
+        options = ServiceOption.objects.values_list(
+            'pk', 'capacity', 'units', 'available_from', 'available_to', 'service__location', 'service__type'
+        )
+        for option_id, capacity, units, available_from, available_to, location, service_type in options:
+            engine.add_option(
+                option_id, capacity, location, available_from, available_to,
+                units * (slots_per_day(service_type) or 1),
+            )
+        engine.index_options()
+
+        # Tylko rezerwacje, które zajmują noce od dzisiaj
+        reservations = Reservation.objects.filter(
+            Q(end_datetime__date__gt=engine.origin) | Q(end_datetime__isnull=True, start_datetime__date__gte=engine.origin),
+            status__in=ACTIVE_STATUSES, option__isnull=False,
+        )
+        for reservation_id, option_id, start, end in reservations.values_list(
+            'pk', 'option_id', 'start_datetime', 'end_datetime'
+        ):
+            engine.add_reservation(reservation_id, option_id, start, end)
+
+        # Aktywne blokady terminów zajmują opcję tak jak rezerwacje
+        holds = BookingHold.objects.filter(status=BookingHold.ACTIVE, expires_at__gt=timezone.now())
+        for hold_id, option_id, start, end in holds.values_list('pk', 'option_id', 'start_datetime', 'end_datetime'):
+            engine.add_reservation(hold_key(hold_id), option_id, start, end)
+        return engine
+
+    def day_index(self, day):
+        return (day - self.origin).days
+
+    def add_option(self, option_id, capacity, location, available_from, available_to, units=1):
+        """Dodaje opcję; bitmapy nocy powstają w ``index_options`` po dodaniu wszystkich opcji."""
+        bit = 1 << len(self.ids)
+        self.ids.append(option_id)
+        first = last = 0
+        # Opcja bez pełnego okna dostępności nie jest dostępna w żadnym terminie
+        if available_from and available_to:
+            first = max(self.day_index(available_from), 0)
+            last = min(self.day_index(available_to) + 1, self.horizon)
+        if first < last:
+            self.opening[first] |= bit
+            self.closing[last] |= bit
+        self.options[option_id] = OptionDays(bit, first, last, units)
+        self.city_bits[location] |= bit
+        self.capacity_bits[capacity] |= bit
+
+    def index_options(self):
+        """Bitmapy wolnych opcji na każdą noc z okien dostępności (jeden przebieg po horyzoncie)."""
+        current = 0
+        for night in range(self.horizon):
+            current = (current | self.opening.get(night, 0)) & ~self.closing.get(night, 0)
+            self.free_by_night[night] = current
+        self.opening.clear()
+        self.closing.clear()
+
+    def add_reservation(self, reservation_id, option_id, start, end):
+        days = self.options.get(option_id)
+        if days is None:
+            return
+        start_day, end_day = night_range(start, end)
+        first = max(self.day_index(start_day), 0)
+        last = min(self.day_index(end_day), self.horizon)
+        if first >= last:
+            return
+        if days.counts is None:
+            days.counts = array('H', bytes(2 * self.horizon))
+        counts = days.counts
+        for night in range(first, last):
+            counts[night] += 1
+            if counts[night] == days.units:
+                self.free_by_night[night] &= ~days.bit
+        self.reservations[reservation_id] = (option_id, first, last)
+
+    def remove_reservation(self, reservation_id):
+        applied = self.reservations.pop(reservation_id, None)
+        if applied is None:
+            return
+        option_id, first, last = applied
+        days = self.options.get(option_id)
+        if days is None:
+            return
+        counts = days.counts
+        for night in range(first, last):
+            counts[night] -= 1
+            if counts[night] == days.units - 1 and days.is_open(night):
+                self.free_by_night[night] |= days.bit
+
+    def apply(self, reservation_id, option_id, status, start, end):
+        """Nanosi zapis rezerwacji (również zmianę terminu, opcji lub statusu)."""
+        self.remove_reservation(reservation_id)
+        if status in ACTIVE_STATUSES and option_id is not None:
+            self.add_reservation(reservation_id, option_id, start, end)
+
+    def covers(self, check_in, check_out):
+        first, last = self.day_index(check_in), self.day_index(check_out)
+        return 0 <= first and last <= self.horizon
+
+    def free_options(self, check_in, check_out, city=None, min_capacity=None):
+        """Id opcji wolnych we wszystkie noce [check_in, check_out) albo None poza horyzontem."""
+        if check_out <= check_in:
+            check_out = check_in + timedelta(days=1)
+        if not self.covers(check_in, check_out):
+            return None
+
+        free = self.city_bits.get(city, 0) if city else (1 << len(self.ids)) - 1
+        if min_capacity is not None:
+            free &= reduce(or_, (bits for capacity, bits in self.capacity_bits.items() if capacity >= min_capacity), 0)
+        for night in range(self.day_index(check_in), self.day_index(check_out)):
+            if not free:
+                break
+            free &= self.free_by_night[night]
+
+        # Numery ustawionych bitów (bin() od najmłodszego bitu)
+        bits = bin(free)[:1:-1]
+        found, position = [], bits.find('1')
+        while position != -1:
+            found.append(self.ids[position])
+            position = bits.find('1', position + 1)
+        return sorted(found)
+
+
+_engine = None
+_engine_lock = threading.RLock()
+
+
+def current_key():
+    return get_catalog_version(), get_availability_version(), timezone.localdate()
+
+
+def get_engine():
+    global _engine
+    key = current_key()
+    engine = _engine
+    if engine is not None and engine.key == key:
+        return engine
+    with _engine_lock:
+        if _engine is None or _engine.key != key:
+            engine = AvailabilityEngine.build()
+            engine.key = key
+            _engine = engine
+        return _engine
+
+
+def free_options(check_in, check_out, city=None, min_capacity=None):
+    return get_engine().free_options(check_in, check_out, city, min_capacity)
+
+
+def hold_key(hold_id):
+    """Klucz blokady w silniku (rezerwacje są kluczowane samym id)."""
+    return 'hold', hold_id
+
+
+def bump_on_commit():
+    """Podbija wersję dostępności po zatwierdzeniu bieżącej transakcji (poza transakcją od razu)."""
+    transaction.on_commit(bump_availability_version)
+
+
+def apply_change(change):
+    """Po zatwierdzeniu transakcji podbija wersję dostępności i nanosi zmianę na silnik tego procesu.
+
+    Zmiana wycofanej transakcji nie trafia na silnik, a inne procesy nie przebudowują
+    silnika z danych sprzed zatwierdzenia pod nową wersją.
+    """
+    def apply():
+        version = bump_availability_version()
+        with _engine_lock:
+            engine = _engine
+            if engine is None:
+                return
+            catalog_version, previous, day = engine.key
+            if previous != version - 1 or day != timezone.localdate():
+                return
+            change(engine)
+            engine.key = (catalog_version, version, day)
+    transaction.on_commit(apply)
+
+
+def reservation_changed(reservation, deleted=False):
+    # Stan z chwili zapisu: po usunięciu obiekt nie ma już klucza głównego
+    pk, option_id, status = reservation.pk, reservation.option_id, reservation.status
+    start, end = reservation.start_datetime, reservation.end_datetime
+
+    def change(engine):
+        if deleted:
+            engine.remove_reservation(pk)
+        else:
+            engine.apply(pk, option_id, status, start, end)
+    apply_change(change)
+
+
+def hold_changed(hold, deleted=False):
+    key, option_id, active = hold_key(hold.pk), hold.option_id, hold.status == BookingHold.ACTIVE
+    start, end = hold.start_datetime, hold.end_datetime
+
+    def change(engine):
+        engine.remove_reservation(key)
+        if not deleted and active:
+            engine.add_reservation(key, option_id, start, end)
+    apply_change(change)
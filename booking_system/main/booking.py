@@ -0,0 +1,325 @@
+"""Tworzenie rezerwacji bez nadrezerwowania.
+
+Rezerwacja powstaje w jednej transakcji: wiersz opcji jest blokowany
+(``select_for_update``), więc równoległe rezerwacje tej samej opcji wykonują się
+po kolei. Pod blokadą liczymy aktywne rezerwacje i cudze blokady terminów
+nachodzące na termin (``ReservationQuerySet.overlapping``, holds.py) i
+porównujemy z liczbą jednostek opcji.
+Usługi z siatką terminów (restauracja, SPA) zamiast tego zajmują miejsce w
+terminie warunkowym UPDATE (zob. slots.py).
+Saldo jest obciążane w tej samej transakcji przez księgę punktów (zob. points.py)
+warunkowym UPDATE, więc nie spadnie poniżej zera.
+
+Rezerwacja z ważną blokadą użytkownika nie sprawdza dostępności ponownie: termin
+jest już zajęty przez blokadę, która zostaje zamieniona na rezerwację.
+
+Rezerwacja grupowa (``book_group``) i cykliczna (series.py) sprawdzają wszystkie
+pozycje jednym przebiegiem i zapisują je jednym ``bulk_create`` w jednej
+transakcji: powstają wszystkie rezerwacje albo żadna, a saldo jest obciążane raz.
+Liczba zapytań nie zależy od liczby pozycji, poza jednym UPDATE na termin z siatki.
+"""
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.timezone import is_naive, make_aware
+
+from .availability import bump_on_commit, hold_changed
+from .holds import active_holds, get_hold_ttl, overlapping_holds, release_user_holds
+from .models import (
+    POINT_RESERVATION_DURATION, BookingHold, PointsTransaction, Reservation, ServiceOption, TimeSlot,
+    overlap_condition,
+)
+from .points import InsufficientPoints, apply_points
+from .slots import find_slot, take_slot, uses_slots
+
+
+class BookingError(Exception):
+    """Rezerwacja odrzucona; komunikat jest przeznaczony dla użytkownika."""
+
+
+def aware(value):
+    if value is not None and is_naive(value):
+        return make_aware(value)
+    return value
+
+
+def reserve_inventory(user, option, start, end, slot):
+    """Zajmuje termin (wywoływać w transakcji); zwraca (opcję z usługą, start, koniec)."""
+    if slot is not None:
+        if not take_slot(slot.pk):
+            raise BookingError("Brak wolnych miejsc w wybranym terminie.")
+        option = ServiceOption.objects.select_related('service').get(pk=option.pk)
+        validate_line(option, slot.start, slot.end)
+        return option, slot.start, slot.end
+
+    option = ServiceOption.objects.select_for_update().select_related('service').get(pk=option.pk)
+    validate_line(option, start, end)
+    taken = Reservation.objects.overlapping(option.pk, start, end).count()
+    taken += overlapping_holds(option.pk, start, end).exclude(user=user).count()
+    if taken >= option.units:
+        raise BookingError("Wybrana opcja jest już zarezerwowana w tym terminie.")
+    return option, start, end
+
+
+def place_hold(user, option, start, end=None, slot=None):
+    """Blokuje termin dla użytkownika na HOLD_MINUTES minut albo zgłasza BookingError.
+
+    Poprzednia aktywna blokada użytkownika dla tej opcji jest zwalniana.
+    """
+    start, end = aware(start), aware(end)
+    release_user_holds(user, option)
+
+    with transaction.atomic():
+        option, start, end = reserve_inventory(user, option, start, end, slot)
+        return BookingHold.objects.create(
+            user=user, option=option, slot=slot, start_datetime=start, end_datetime=end,
+            expires_at=timezone.now() + get_hold_ttl(),
+        )
+
+
+def claim_hold(user, hold):
+    """Zamienia ważną blokadę użytkownika na rezerwację; False, gdy wygasła lub została zwolniona."""
+    claimed = BookingHold.objects.filter(
+        pk=hold.pk, user=user, status=BookingHold.ACTIVE, expires_at__gt=timezone.now(),
+    ).update(status=BookingHold.CONVERTED)
+    if not claimed:
+        return False
+    hold.status = BookingHold.CONVERTED
+    hold_changed(hold)
+    return True
+
+
+def book_option(user, option, start, end=None, price=0, slot=None, hold=None):
+    """Tworzy oczekującą rezerwację i obciąża saldo albo zgłasza BookingError.
+
+    Z ważną blokadą (``hold``) rezerwowany jest jej termin, a cena jest liczona
+    od nowa dla tego terminu; z nieważną rezerwacja przebiega tak, jak bez blokady.
+    """
+    start, end = aware(start), aware(end)
+
+    with transaction.atomic():
+        if hold is not None and claim_hold(user, hold):
+            option = ServiceOption.objects.select_related('service').get(pk=hold.option_id)
+            slot, start, end = hold.slot, hold.start_datetime, hold.end_datetime
+            price = line_price(option, start, end)
+        else:
+            hold = None
+            option, start, end = reserve_inventory(user, option, start, end, slot)
+
+        # Najpierw obciążenie salda: odrzucenie nie może nastąpić po zapisie rezerwacji
+        try:
+            entry = apply_points(
+                user, -price, PointsTransaction.RESERVATION,
+                description=f"Rezerwacja: {option.service.name}", require_funds=True,
+            )
+        except InsufficientPoints as error:
+            raise BookingError(str(error))
+
+        reservation = Reservation.objects.create(
+            user=user,
+            service=option.service,
+            option=option,
+            slot=slot,
+            start_datetime=start,
+            end_datetime=end,
+            price=price,
+            status='pending',
+        )
+        PointsTransaction.objects.filter(pk=entry.pk).update(reservation=reservation)
+        if hold is not None:
+            BookingHold.objects.filter(pk=hold.pk).update(reservation=reservation)
+
+    return reservation
+
+
+def get_group_limit():
+    return getattr(settings, 'BOOKING_GROUP_MAX_LINES', 50)
+
+
+def nights(start, end):
+    return max((end.date() - start.date()).days, 1)
+
+
+def line_price(option, start, end):
+    """Cena pozycji: hotel za każdą noc, pozostałe usługi za rezerwację."""
+    if option.service.type == 'Hotel' and end is not None:
+        return option.price * nights(start, end)
+    return option.price
+
+
+def effective_end(start, end):
+    return end or start + POINT_RESERVATION_DURATION
+
+
+def overlaps(first, second):
+    """Czy przedziały (start, koniec) się nakładają; jak ``overlap_condition``."""
+    return first[0] < effective_end(*second) and second[0] < effective_end(*first)
+
+
+def validate_line(option, start, end):
+    """Wspólne reguły terminu dla każdej ścieżki rezerwacji; zgłasza BookingError."""
+    if timezone.localtime(start).date() < timezone.localdate():
+        raise BookingError("Nie można zarezerwować usługi w przeszłości.")
+    if option.service.type == 'Hotel' and (end is None or end <= start):
+        raise BookingError("Data zakończenia musi być późniejsza niż data rozpoczęcia.")
+    if not within_window(option, start, end):
+        raise BookingError(f"Opcja {option.name} nie jest dostępna w wybranym terminie.")
+
+
+def within_window(option, start, end):
+    """Czy termin mieści się w oknie ``available_from``–``available_to`` opcji (obie daty włącznie)."""
+    first = timezone.localtime(start).date()
+    last = timezone.localtime(end).date() if end else first
+    if option.service.type == 'Hotel' and last > first:
+        last -= timedelta(days=1)  # dzień wyjazdu nie jest nocą pobytu
+    return not (
+        (option.available_from and first < option.available_from)
+        or (option.available_to and last > option.available_to)
+    )
+
+
+def lock_group_slots(options, lines):
+    """Zajmuje miejsca w terminach z siatki (jeden UPDATE na termin); zwraca termin każdej pozycji."""
+    wanted = [(option_id, start) for option_id, start, end in lines if uses_slots(options[option_id].service.type)]
+    if not wanted:
+        return {}
+    slots = {
+        (slot.option_id, slot.start): slot
+        for slot in TimeSlot.objects.filter(
+            option_id__in={option_id for option_id, start in wanted}, start__in={start for option_id, start in wanted},
+        )
+    }
+    for key in wanted:
+        if key not in slots:
+            slot = find_slot(options[key[0]], key[1])
+            if slot is None:
+                raise BookingError("Wybierz godzinę z listy wolnych terminów.")
+            slots[key] = slot
+
+    for slot, count in Counter(slots[key] for key in wanted).items():
+        taken = TimeSlot.objects.filter(pk=slot.pk, remaining__gte=count).update(remaining=F('remaining') - count)
+        if not taken:
+            raise BookingError(f"Brak wolnych miejsc w terminie {timezone.localtime(slot.start):%d.%m.%Y %H:%M}.")
+    return slots
+
+
+def check_group_intervals(user, options, lines):
+    """Sprawdza jednostki opcji dla pozycji bez siatki terminów, łącznie z pozycjami tej samej grupy."""
+    lines = [line for line in lines if not uses_slots(options[line[0]].service.type)]
+    if not lines:
+        return
+    option_ids = {option_id for option_id, start, end in lines}
+
+    # Jedno zapytanie o rezerwacje i jedno o cudze blokady nachodzące na którąkolwiek pozycję
+    # (suma przedziałów, a nie cały zakres: seria na kwartał nie czyta wszystkich rezerwacji opcji)
+    taken = {option_id: [] for option_id in option_ids}
+    window = reduce(or_, (overlap_condition(start, end) for option_id, start, end in lines))
+    for rows in (
+        Reservation.objects.active().filter(window, option_id__in=option_ids),
+        active_holds().filter(window, option_id__in=option_ids).exclude(user=user),
+    ):
+        for option_id, start, end in rows.values_list('option_id', 'start_datetime', 'end_datetime'):
+            taken[option_id].append((start, end))
+
+    for option_id, start, end in lines:
+        option = options[option_id]
+        if sum(overlaps((start, end), other) for other in taken[option_id]) >= option.units:
+            raise BookingError(f"Opcja {option.name} jest już zarezerwowana w terminie od {timezone.localtime(start):%d.%m.%Y}.")
+        taken[option_id].append((start, end))
+
+
+def create_reservations(reservations):
+    """bulk_create, po którym rezerwacje mają klucze główne (w kolejności listy).
+
+    MySQL nie zwraca kluczy z wielowierszowego INSERT; wtedy odczytuje je jednym
+    zapytaniem po znaczniku ``batch`` zapisanym tylko w wierszach tego INSERT-u.
+    Jednakowe pozycje (ta sama opcja i termin) dostają klucze w kolejności id.
+    """
+    batch = uuid.uuid4().hex
+    for reservation in reservations:
+        reservation.batch = batch
+    reservations = Reservation.objects.bulk_create(reservations)
+    if reservations and reservations[0].pk is None:
+        ids = defaultdict(list)
+        rows = Reservation.objects.filter(batch=batch).order_by('pk').values_list(
+            'pk', 'user_id', 'option_id', 'start_datetime', 'end_datetime',
+        )
+        for pk, *key in rows:
+            ids[tuple(key)].append(pk)
+        for reservation in reservations:
+            key = (reservation.user_id, reservation.option_id, reservation.start_datetime, reservation.end_datetime)
+            reservation.pk = ids[key].pop(0)
+    return reservations
+
+
+def book_group(user, lines):
+    """Rezerwuje wszystkie pozycje (id opcji, start, koniec) albo żadną; zgłasza BookingError.
+
+    Zwraca listę utworzonych rezerwacji w kolejności pozycji.
+    """
+    limit = get_group_limit()
+    if not lines:
+        raise BookingError("Brak pozycji do zarezerwowania.")
+    if len(lines) > limit:
+        raise BookingError(f"Rezerwacja grupowa może mieć najwyżej {limit} pozycji.")
+    return book_lines(user, lines, f"Rezerwacja grupowa: {len(lines)} pozycji")
+
+
+def book_lines(user, lines, description, series=None):
+    """Wspólna część ``book_group`` i rezerwacji cyklicznych (series.py): sprawdzenie
+    wszystkich pozycji, jedno obciążenie salda i jeden ``bulk_create``.
+
+    Seria (``series``) jest zapisywana w tej samej transakcji co jej wystąpienia.
+    """
+    lines = [(option_id, aware(start), aware(end)) for option_id, start, end in lines]
+
+    with transaction.atomic():
+        # Blokady wierszy opcji w stałej kolejności, żeby równoległe grupy się nie zakleszczyły
+        options = {
+            option.pk: option
+            for option in ServiceOption.objects.select_for_update().select_related('service')
+            .filter(pk__in={option_id for option_id, start, end in lines}).order_by('pk')
+        }
+        if len(options) != len({option_id for option_id, start, end in lines}):
+            raise BookingError("Wybrana opcja nie istnieje.")
+        for option_id, start, end in lines:
+            validate_line(options[option_id], start, end)
+
+        slots = lock_group_slots(options, lines)
+        check_group_intervals(user, options, lines)
+
+        reservations = []
+        for option_id, start, end in lines:
+            option = options[option_id]
+            slot = slots.get((option_id, start))
+            if slot is not None:
+                start, end = slot.start, slot.end
+            reservations.append(Reservation(
+                user=user, service=option.service, service_name=option.service.name, option=option, slot=slot,
+                start_datetime=start, end_datetime=end, price=line_price(option, start, end), status='pending',
+            ))
+
+        try:
+            apply_points(
+                user, -sum(reservation.price for reservation in reservations), PointsTransaction.RESERVATION,
+                description=description, require_funds=True,
+            )
+        except InsufficientPoints as error:
+            raise BookingError(str(error))
+
+        if series is not None:
+            series.save()
+            for reservation in reservations:
+                reservation.series = series
+        reservations = create_reservations(reservations)
+
+    # bulk_create nie wysyła sygnałów, więc silnik dostępności przebuduje się od nowa
+    bump_on_commit()
+    return reservations
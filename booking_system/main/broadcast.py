@@ -0,0 +1,82 @@
+"""Wiadomości administratora wysyłane do wielu użytkowników naraz.
+
+Adresaci są wybierani jednym zapytaniem (podzapytania po rezerwacjach), a
+wiadomości i ich powiązania z rezerwacjami (tabela pośrednia Reservation.messages)
+trafiają do bazy przez bulk_create w paczkach po ``MESSAGE_BROADCAST_BATCH``.
+Powiązanie z pierwszą rezerwacją użytkownika wyznacza ``link_first_reservations``
+raz na paczkę zamiast Message.save dla każdej wiadomości.
+"""
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Message, Reservation, User, link_first_reservations
+
+
+def get_batch_size():
+    return getattr(settings, 'MESSAGE_BROADCAST_BATCH', 1000)
+
+
+def target_reservations(service=None, city=None):
+    """Rezerwacje wyznaczające adresatów: nadchodzące w usłudze ``service``
+    i/lub w usługach w mieście ``city`` (Service.location)."""
+    reservations = Reservation.objects.all()
+    if service is not None:
+        reservations = reservations.active().filter(service=service, start_datetime__gte=timezone.now())
+    if city:
+        reservations = reservations.filter(service__location__iexact=city)
+    return reservations
+
+
+def recipients(reservations):
+    return User.objects.filter(is_active=True, pk__in=reservations.values('user_id'))
+
+
+def create_messages(messages):
+    """bulk_create, po którym wiadomości mają klucze główne (potrzebne w tabeli pośredniej).
+
+    MySQL nie zwraca kluczy z wielowierszowego INSERT; wtedy odczytuje je jednym
+    zapytaniem po znaczniku ``batch`` zapisanym tylko w wierszach tego INSERT-u
+    (w paczce jest jedna wiadomość na użytkownika).
+    """
+    batch = uuid.uuid4().hex
+    for message in messages:
+        message.batch = batch
+    messages = Message.objects.bulk_create(messages)
+    if messages and messages[0].pk is None:
+        ids = dict(Message.objects.filter(batch=batch).values_list('user_id', 'pk'))
+        for message in messages:
+            message.pk = ids[message.user_id]
+    return messages
+
+
+def broadcast(users, subject, content, reservations=None, batch_size=None):
+    """Wysyła wiadomość do każdego użytkownika z ``users``; zwraca liczbę wysłanych.
+
+    Wiadomość jest wiązana z pierwszą rezerwacją adresata spośród ``reservations``
+    (domyślnie wszystkich jego rezerwacji, jak przy pojedynczej wiadomości).
+
+    Każda paczka to osobna transakcja: odczyt identyfikatorów, INSERT wiadomości,
+    zapytanie o pierwsze rezerwacje i INSERT powiązań, niezależnie od jej rozmiaru.
+    """
+    batch_size = batch_size or get_batch_size()
+    user_ids = users.order_by('pk').values_list('pk', flat=True)
+    sent, last_id = 0, 0
+    while True:
+        chunk = list(user_ids.filter(pk__gt=last_id)[:batch_size])
+        if not chunk:
+            return sent
+        with transaction.atomic():
+            messages = create_messages([
+                Message(user_id=user_id, subject=subject, content=content, sender='admin') for user_id in chunk
+            ])
+            link_first_reservations(messages, reservations)
+        sent += len(messages)
+        last_id = chunk[-1]
+
+
+def broadcast_to(subject, content, service=None, city=None, batch_size=None):
+    reservations = target_reservations(service, city)
+    return broadcast(recipients(reservations), subject, content, reservations, batch_size)
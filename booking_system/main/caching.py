@@ -0,0 +1,120 @@
+"""Odczyt z cache odporny na lawinę przeliczeń (cache stampede).
+
+``get_or_compute`` przechowuje wartość razem z miękkim czasem wygaśnięcia i czasem
+ostatniego przeliczenia. Wpis żyje w cache dłużej niż miękki termin, dzięki czemu:
+
+* tylko jeden proces przelicza dany klucz (blokada przez ``cache.add``, atomowe na
+  współdzielonym backendzie, np. memcached/redis/baza danych),
+* pozostałe procesy w tym czasie dostają poprzednią wartość albo czekają na wynik,
+* wpis bywa odświeżany przed terminem z prawdopodobieństwem rosnącym wraz z jego
+  wiekiem i kosztem przeliczenia (probabilistic early expiration).
+"""
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+
+STATS_KEY = 'cache-stats:{}'
+STATS = ('hits', 'misses', 'stale_served', 'refreshes')
+
+LOCK_POLL_INTERVAL = 0.05
+
+
+def incr_stat(name):
+    key = STATS_KEY.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_cache_stats():
+    values = cache.get_many([STATS_KEY.format(name) for name in STATS])
+    return {name: values.get(STATS_KEY.format(name), 0) for name in STATS}
+
+
+def reset_cache_stats():
+    cache.delete_many([STATS_KEY.format(name) for name in STATS])
+
+
+def acquire_lock(key, timeout):
+    token = uuid.uuid4().hex
+    if cache.add(f'lock:{key}', token, timeout):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    if cache.get(f'lock:{key}') == token:
+        cache.delete(f'lock:{key}')
+
+
+def should_refresh(entry, now, beta):
+    """Czy odświeżyć wpis przed terminem (im bliżej terminu i droższe przeliczenie, tym częściej)."""
+    jitter = entry['delta'] * beta * -math.log(1.0 - random.random())
+    return now + jitter >= entry['expires_at']
+
+
+def store(key, compute, timeout, stale_timeout):
+    started = time.time()
+    value = compute()
+    finished = time.time()
+    entry = {'value': value, 'expires_at': finished + timeout, 'delta': finished - started}
+    cache.set(key, entry, timeout + stale_timeout)
+    return value
+
+
+def wait_for_entry(key, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(f'lock:{key}') is None:
+            break
+    return None
+
+
+def get_or_compute(key, compute, timeout, stale_timeout=None, lock_timeout=10, beta=1.0):
+    """Zwraca wartość spod klucza, przeliczając ją co najwyżej w jednym procesie naraz."""
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    entry = cache.get(key)
+    if entry is not None:
+        now = time.time()
+        if not should_refresh(entry, now, beta):
+            incr_stat('hits')
+            return entry['value']
+
+        token = acquire_lock(key, lock_timeout)
+        if token is None:
+            # Inny proces już przelicza ten klucz, podajemy dotychczasową wartość
+            incr_stat('stale_served' if now >= entry['expires_at'] else 'hits')
+            return entry['value']
+        try:
+            incr_stat('refreshes')
+            return store(key, compute, timeout, stale_timeout)
+        finally:
+            release_lock(key, token)
+
+    incr_stat('misses')
+    token = acquire_lock(key, lock_timeout)
+    if token is None:
+        # Brak wartości do podania: czekamy na proces, który ją właśnie liczy
+        entry = wait_for_entry(key, lock_timeout)
+        if entry is not None:
+            return entry['value']
+        return store(key, compute, timeout, stale_timeout)
+    try:
+        # Wartość mogła zostać zapisana tuż przed przejęciem blokady
+        entry = cache.get(key)
+        if entry is not None and time.time() < entry['expires_at']:
+            return entry['value']
+        return store(key, compute, timeout, stale_timeout)
+    finally:
+        release_lock(key, token)
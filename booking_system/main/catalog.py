@@ -0,0 +1,154 @@
+"""Katalog usług w cache: fasety strony głównej i wersjonowane klucze.
+
+Wszystkie wpisy katalogu mają w kluczu numer wersji katalogu. Zapis lub usunięcie
+usługi, opcji albo statusu serwisu podbija wersję po zatwierdzeniu transakcji
+(zob. signals.py), więc stare wpisy przestają być czytane i same wygasają, a
+równoległe żądanie nie zapisze pod nową wersją katalogu sprzed zmiany.
+
+Wersja jest w cache, więc wszystkie procesy muszą używać wspólnego backendu
+(``CACHES`` w settings.py); przy domyślnym cache w pamięci procesu zmiana
+katalogu unieważnia wpisy tylko w procesie, który ją zapisał.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .caching import get_or_compute
+from .models import Service, ServiceOption, ServiceStatus
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_MODIFIED_KEY = 'catalog:modified'
+
+# Górne granice przedziałów cenowych (najniższa cena usługi), ostatni przedział jest otwarty
+DEFAULT_PRICE_BUCKETS = (100, 250, 500, 1000)
+
+
+def get_catalog_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 15 * 60)
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Wersja startowa z zegara, aby po utracie klucza nie wrócić do starych wpisów
+        if cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None):
+            cache.set(CATALOG_MODIFIED_KEY, int(time.time()), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+        version = cache.incr(CATALOG_VERSION_KEY)
+    cache.set(CATALOG_MODIFIED_KEY, int(time.time()), None)
+    return version
+
+
+def bump_catalog_on_commit():
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_catalog_last_modified():
+    """Czas ostatniej zmiany katalogu (z dokładnością do sekundy) albo None."""
+    get_catalog_version()  # po utracie kluczy zakłada wersję i czas zmiany
+    timestamp = cache.get(CATALOG_MODIFIED_KEY)
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def catalog_key(name, version=None):
+    return f'catalog:{version or get_catalog_version()}:{name}'
+
+
+def price_buckets():
+    bounds = getattr(settings, 'CATALOG_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)
+    buckets, lower = [], None
+    for upper in bounds:
+        buckets.append((lower, upper))
+        lower = upper
+    buckets.append((lower, None))
+    return buckets
+
+
+def bucket_label(lower, upper):
+    if lower is None:
+        return f"do {upper} punktów"
+    if upper is None:
+        return f"powyżej {lower} punktów"
+    return f"{lower}–{upper} punktów"
+
+
+def compute_facets():
+    """Liczy miasta, liczności typów i przedziałów cenowych w jednym zapytaniu agregującym."""
+    buckets = price_buckets()
+    aggregates = {}
+    for index, (lower, upper) in enumerate(buckets):
+        condition = Q()
+        if lower is not None:
+            condition &= Q(min_price__gt=lower)
+        if upper is not None:
+            condition &= Q(min_price__lte=upper)
+        aggregates[f'bucket_{index}'] = Count('pk', filter=condition & Q(min_price__isnull=False))
+
+    rows = Service.objects.order_by().values('location', 'type').annotate(total=Count('pk'), **aggregates)
+
+    cities = set()
+    type_counts = {value: 0 for value, label in Service.TYPE_CHOICES}
+    bucket_counts = [0] * len(buckets)
+    for row in rows:
+        cities.add(row['location'])
+        type_counts[row['type']] = type_counts.get(row['type'], 0) + row['total']
+        for index in range(len(buckets)):
+            bucket_counts[index] += row[f'bucket_{index}']
+
+    return {
+        'cities': sorted(cities),
+        'types': [
+            {'value': value, 'label': label, 'count': type_counts.get(value, 0)}
+            for value, label in Service.TYPE_CHOICES
+        ],
+        'price_buckets': [
+            {'min': lower, 'max': upper, 'label': bucket_label(lower, upper), 'count': count}
+            for (lower, upper), count in zip(buckets, bucket_counts)
+        ],
+        # Status serwisu jest przechowywany razem z fasetami, bo zmienia się rzadko
+        'service_status': ServiceStatus.objects.first(),
+    }
+
+
+def get_catalog_entry(name, compute):
+    """Wpis katalogu z cache, przeliczany przez jeden proces naraz (zob. caching.py)."""
+    return get_or_compute(catalog_key(name), compute, get_catalog_timeout())
+
+
+def get_facets():
+    return get_catalog_entry('facets', compute_facets)
+
+
+def get_type_options(service_type):
+    """Opcje (id, nazwa) wszystkich usług danego typu, z cache."""
+    return get_catalog_entry(
+        f'type-options:{service_type}',
+        lambda: list(
+            ServiceOption.objects.filter(service__type=service_type).order_by('pk').values('id', 'name', 'service_id')
+        ),
+    )
+
+
+def get_service_detail(service_id):
+    """Usługa wraz z listą opcji albo None, jeśli usługa nie istnieje."""
+    def compute():
+        service = Service.objects.filter(pk=service_id).first()
+        if service is None:
+            return None
+        return {'service': service, 'options': list(service.service_options.order_by('pk'))}
+
+    return get_catalog_entry(f'service:{service_id}', compute)
@@ -251,4 +251,22 @@ class ReservationAdminForm(forms.ModelForm):
 
     class Meta:
         model = Reservation
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class BroadcastMessageForm(forms.Form):
+    subject = forms.CharField(max_length=255, label="Temat")
+    content = forms.CharField(widget=forms.Textarea(attrs={'rows': 6}), label="Treść wiadomości")
+    service = forms.ModelChoiceField(
+        queryset=Service.objects.order_by('name'), required=False,
+        label="Usługa", help_text="Użytkownicy z nadchodzącą rezerwacją w tej usłudze.",
+    )
+    city = forms.CharField(
+        max_length=255, required=False,
+        label="Miasto", help_text="Użytkownicy z rezerwacją w usłudze w tym mieście.",
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('service') and not cleaned_data.get('city'):
+            raise forms.ValidationError("Wybierz usługę lub podaj miasto.")
+        return cleaned_data
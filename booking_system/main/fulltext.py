@@ -0,0 +1,97 @@
+"""Indeks pełnotekstowy usług.
+
+Przeszukiwana jest kolumna ``Service.search_document`` zawierająca znormalizowane
+rdzenie słów nazwy, lokalizacji i opisu (zob. text.py). Zapytanie użytkownika jest
+normalizowane tak samo, więc "zakopane spa" znajduje "Zakopane SPA&WELLNESS".
+
+* MySQL: indeks FULLTEXT na ``search_document`` i ``MATCH ... AGAINST`` w trybie BOOLEAN.
+* SQLite (testy, środowisko lokalne): tabela FTS5 z zewnętrzną treścią, synchronizowana
+  wyzwalaczami, z rankingiem bm25.
+
+Indeks jest zakładany po migracjach (sygnał post_migrate), bo Django nie opisuje
+takich indeksów w modelach.
+"""
+from django.db import connections
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Service
+from .text import search_terms
+
+MYSQL_INDEX_NAME = 'service_search_fulltext'
+SQLITE_FTS_TABLE = 'main_service_fts'
+
+
+def sqlite_statements(table):
+    fts = SQLITE_FTS_TABLE
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"search_document, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_document ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+        f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    ]
+
+
+def ensure_search_index(using='default', **kwargs):
+    """Zakłada indeks pełnotekstowy, jeśli go brakuje (bezpieczne przy wielokrotnym wywołaniu)."""
+    connection = connections[using]
+    table = Service._meta.db_table
+    if table not in connection.introspection.table_names():
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                [table, MYSQL_INDEX_NAME],
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {MYSQL_INDEX_NAME} (search_document)")
+        elif connection.vendor == 'sqlite':
+            for statement in sqlite_statements(table):
+                cursor.execute(statement)
+
+
+def rebuild_search_index(using='default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search(services, text):
+    """Zawęża usługi do pasujących do tekstu i dodaje adnotację ``relevance`` (większa = lepsza)."""
+    terms = search_terms(text)
+    if not terms:
+        return services.annotate(relevance=Value(0.0, output_field=FloatField()))
+
+    table = Service._meta.db_table
+    vendor = connections[services.db].vendor
+
+    if vendor == 'mysql':
+        query = ' '.join(f'+{term}*' for term in terms)
+        relevance = RawSQL(
+            f"MATCH ({table}.search_document) AGAINST (%s IN BOOLEAN MODE)", [query], output_field=FloatField()
+        )
+        return services.annotate(relevance=relevance).filter(relevance__gt=0)
+
+    if vendor == 'sqlite':
+        query = ' '.join(f'{term}*' for term in terms)
+        relevance = RawSQL(
+            f"SELECT -bm25({SQLITE_FTS_TABLE}) FROM {SQLITE_FTS_TABLE} "
+            f"WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = {table}.id",
+            [query], output_field=FloatField(),
+        )
+        matching = RawSQL(f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s", [query])
+        return services.filter(pk__in=matching).annotate(relevance=relevance)
+
+    # Inne bazy: dopasowanie podciągów w znormalizowanym dokumencie, bez rankingu
+    for term in terms:
+        services = services.filter(search_document__contains=term)
+    return services.annotate(relevance=Value(1.0, output_field=FloatField()))
@@ -0,0 +1,86 @@
+"""Tymczasowe blokady terminów (``BookingHold``).
+
+Blokada zajmuje termin opcji na ``HOLD_MINUTES`` minut, zanim użytkownik wyśle
+formularz rezerwacji: przy terminach z siatki zajmuje miejsce w ``TimeSlot``, a
+przy pobytach liczy się do nakładających się rezerwacji (zob. booking.py).
+Wygasłe blokady zamyka komenda ``expire_holds`` partiami po indeksie
+(status, expires_at); zamknięcie zwalnia miejsca w terminach i podbija wersję
+dostępności.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .availability import bump_on_commit
+from .models import BookingHold, overlap_condition
+from .slots import release_slots
+
+
+def get_hold_ttl():
+    return timedelta(minutes=getattr(settings, 'HOLD_MINUTES', 10))
+
+
+def active_holds():
+    return BookingHold.objects.filter(status=BookingHold.ACTIVE, expires_at__gt=timezone.now())
+
+
+def overlapping_holds(option_id, start, end=None):
+    return active_holds().filter(overlap_condition(start, end), option_id=option_id)
+
+
+def close_holds(hold_ids, status):
+    """Zamyka aktywne blokady spośród ``hold_ids`` i zwalnia zajęte przez nie miejsca.
+
+    Zwraca liczbę zamkniętych blokad; blokady zamienione w międzyczasie na
+    rezerwację są pomijane.
+    """
+    with transaction.atomic():
+        rows = list(
+            BookingHold.objects.select_for_update()
+            .filter(pk__in=list(hold_ids), status=BookingHold.ACTIVE)
+            .values_list('pk', 'slot_id')
+        )
+        if not rows:
+            return 0
+        closed = BookingHold.objects.filter(pk__in=[pk for pk, slot_id in rows]).update(status=status)
+
+        # Jedno zapytanie na termin, niezależnie od liczby blokad w nim
+        release_slots(Counter(slot_id for pk, slot_id in rows))
+
+    # Masowy UPDATE omija sygnały, więc silnik dostępności przebuduje się od nowa
+    bump_on_commit()
+    return closed
+
+
+def release_user_holds(user, option):
+    """Zwalnia poprzednie blokady użytkownika dla opcji (jedna aktywna blokada na opcję)."""
+    ids = BookingHold.objects.filter(user=user, option=option, status=BookingHold.ACTIVE).values_list('pk', flat=True)
+    return close_holds(ids, BookingHold.RELEASED)
+
+
+def expired_hold_ids(now, batch_size):
+    return list(
+        BookingHold.objects.filter(status=BookingHold.ACTIVE, expires_at__lte=now)
+        .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+    )
+
+
+def hold_metrics(since=None):
+    """Liczba blokad według statusu (jedno zapytanie) i odsetek zamienionych na rezerwacje."""
+    holds = BookingHold.objects.all()
+    if since is not None:
+        holds = holds.filter(created_at__gte=since)
+    counts = holds.aggregate(
+        placed=Count('pk'),
+        active=Count('pk', filter=Q(status=BookingHold.ACTIVE)),
+        converted=Count('pk', filter=Q(status=BookingHold.CONVERTED)),
+        expired=Count('pk', filter=Q(status=BookingHold.EXPIRED)),
+        released=Count('pk', filter=Q(status=BookingHold.RELEASED)),
+    )
+    finished = counts['placed'] - counts['active']
+    counts['conversion_rate'] = round(100 * counts['converted'] / finished, 1) if finished else None
+    return counts
@@ -0,0 +1,115 @@
+"""Jednokrotne wykonanie żądań POST oznaczonych kluczem idempotencji.
+
+Formularz niesie losowy klucz (ukryte pole ``idempotency_key`` albo nagłówek
+``Idempotency-Key``). Pierwsze żądanie zakłada wiersz ``IdempotencyKey`` ze
+statusem "processing" (unikalny indeks na użytkownika i klucz rozstrzyga wyścig),
+wykonuje akcję i w tej samej transakcji zapisuje jej wynik (komunikat i, dla
+odpowiedzi JSON, dane odpowiedzi, np. id utworzonych rezerwacji). Powtórzenie
+zwraca zapisany wynik bez ponownego wykonania, a powtórzenie równoległe czeka,
+aż pierwsze żądanie się zakończy.
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+# Pola formularza, które nie wpływają na treść żądania
+IGNORED_FIELDS = ('csrfmiddlewaretoken', 'idempotency_key')
+POLL_INTERVAL = 0.1
+# Ile razy ponowić założenie klucza, gdy wiersz, który je zablokował, zniknął przed odczytem
+CLAIM_ATTEMPTS = 3
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def get_wait_timeout():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10)
+
+
+def get_key(request):
+    return (request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key', '')).strip()[:64]
+
+
+def request_fingerprint(request):
+    if request.content_type == 'application/json':
+        return hashlib.sha256(repr((request.path, request.body)).encode()).hexdigest()
+    fields = sorted((name, value) for name, value in request.POST.lists() if name not in IGNORED_FIELDS)
+    return hashlib.sha256(repr((request.path, fields)).encode()).hexdigest()
+
+
+def claim(user, key, fingerprint):
+    """Zakłada klucz i zwraca (wiersz, True) albo istniejący wiersz i False.
+
+    Wiersz, z którym zderzył się INSERT, mógł zostać usunięty przed odczytem (wygasł,
+    pierwsze żądanie zakończyło się błędem albo usunęło go ``purge_idempotency_keys``);
+    wtedy zakładanie jest ponawiane. Gdy wszystkie próby przegrają, zwraca (None, False).
+    """
+    for _ in range(CLAIM_ATTEMPTS):
+        IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=timezone.now()).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint, expires_at=timezone.now() + get_ttl(),
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is not None:
+                return record, False
+    return None, False
+
+
+def wait_for_completion(record):
+    deadline = time.monotonic() + get_wait_timeout()
+    while record.status != IdempotencyKey.COMPLETED:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            # Pierwsze żądanie zakończyło się błędem i zwolniło klucz
+            return None
+    return record
+
+
+def run_once(user, key, fingerprint, action):
+    """Wykonuje ``action`` (zwraca poziom i treść komunikatu) co najwyżej raz dla klucza."""
+    level, text, data = run_once_with_data(user, key, fingerprint, lambda: (*action(), None))
+    return level, text
+
+
+def run_once_with_data(user, key, fingerprint, action):
+    """Jak ``run_once``, ale ``action`` zwraca też dane odpowiedzi (JSON), zapisywane razem z komunikatem."""
+    record, created = claim(user, key, fingerprint)
+    if not created:
+        if record is not None and record.fingerprint != fingerprint:
+            return (
+                messages.ERROR, "Ten formularz został już wysłany z innymi danymi. Odśwież stronę i spróbuj ponownie.",
+                None,
+            )
+        record = wait_for_completion(record) if record is not None else None
+        if record is None:
+            return (
+                messages.ERROR, "Poprzednie wysłanie formularza jest wciąż przetwarzane. Spróbuj ponownie za chwilę.",
+                None,
+            )
+        return record.response_level, record.response_message, record.response_data
+
+    try:
+        with transaction.atomic():
+            level, text, data = action()
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status=IdempotencyKey.COMPLETED, response_level=level, response_message=text, response_data=data,
+            )
+    except Exception:
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+        raise
+    return level, text, data
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from main.models import Reservation, ServiceOption
+
+
+class Command(BaseCommand):
+    help = "Uzupełnia service i service_name w rezerwacjach utworzonych bez nich (partiami, można wznowić)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Liczba rezerwacji w jednej transakcji.")
+        parser.add_argument('--after-id', type=int, default=0, help="Wznowienie od rezerwacji o id większym niż podane.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['after_id']
+        started = time.monotonic()
+        total = 0
+
+        option = ServiceOption.objects.filter(pk=OuterRef('option_id'))
+        missing = Reservation.objects.filter(
+            Q(service__isnull=True) | Q(service_name=''), option__isnull=False,
+        ).order_by('pk')
+
+        # Partie po kluczu głównym; każda to osobna transakcja, więc przerwaną komendę
+        # można uruchomić ponownie (uzupełnione wiersze nie spełniają już warunku)
+        while True:
+            ids = list(missing.filter(pk__gt=last_id).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                total += Reservation.objects.filter(pk__in=ids).update(
+                    service_id=Subquery(option.values('service_id')[:1]),
+                    service_name=Subquery(option.values('service__name')[:1]),
+                )
+            last_id = ids[-1]
+            self.stdout.write(f"  uzupełniono {total}, ostatnie id {last_id}")
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Uzupełniono {total} rezerwacji w {elapsed:.2f} s ({rate:.0f} rezerwacji/s)."
+        ))
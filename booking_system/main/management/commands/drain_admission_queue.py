@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.admission import drain, get_batch_size, queued_option_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Przetwarza kolejki rezerwacji opcji w trybie wyprzedaży: partiami, wiele rezerwacji w jednej transakcji. "
+        "Bez --once działa w pętli jako proces roboczy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Liczba zgłoszeń rozstrzyganych w jednej transakcji.")
+        parser.add_argument('--once', action='store_true', help="Opróżnia kolejki i kończy działanie.")
+        parser.add_argument('--interval', type=float, default=0.5, help="Przerwa (w sekundach), gdy kolejki są puste.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or get_batch_size()
+
+        while True:
+            started = time.monotonic()
+            booked = rejected = 0
+            for option_id in queued_option_ids():
+                while True:
+                    option_booked, option_rejected = drain(option_id, batch_size)
+                    if not option_booked + option_rejected:
+                        break
+                    booked += option_booked
+                    rejected += option_rejected
+
+            total = booked + rejected
+            if total or options['once']:
+                elapsed = time.monotonic() - started
+                rate = total / elapsed if elapsed else 0
+                self.stdout.write(self.style.SUCCESS(
+                    f"Przetworzono {total} zgłoszeń ({booked} rezerwacji, {rejected} odrzuconych) "
+                    f"w {elapsed:.2f} s ({rate:.0f} zgłoszeń/s)."
+                ))
+            if options['once']:
+                break
+            if not total:
+                time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.holds import close_holds, expired_hold_ids
+from main.models import BookingHold
+
+
+class Command(BaseCommand):
+    help = "Zamyka wygasłe blokady terminów i zwalnia zajęte przez nie miejsca."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Liczba blokad zamykanych w jednej transakcji.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cutoff = timezone.now()
+        started = time.monotonic()
+        total = 0
+
+        # Partiami po indeksie (status, expires_at); każda partia to osobna, krótka transakcja
+        while True:
+            ids = expired_hold_ids(cutoff, batch_size)
+            if not ids:
+                break
+            total += close_holds(ids, BookingHold.EXPIRED)
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Zamknięto {total} wygasłych blokad w {elapsed:.2f} s ({rate:.0f} blokad/s)."
+        ))
@@ -0,0 +1,66 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.transitions import CANCELLED, CONFIRMED, PENDING, PENDING_CANCELLATION, expire_stale
+from main.waitlist import expire_past
+
+
+class Command(BaseCommand):
+    help = (
+        "Automatycznie potwierdza lub anuluje rezerwacje zbyt długo oczekujące na decyzję administratora "
+        "i zamyka zgłoszenia z listy oczekujących, których termin minął."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Liczba rezerwacji w jednej transakcji.")
+        parser.add_argument(
+            '--pending-hours', type=int, default=getattr(settings, 'RESERVATION_PENDING_HOURS', 48),
+            help="Po ilu godzinach oczekująca rezerwacja jest rozstrzygana.",
+        )
+        parser.add_argument(
+            '--pending-action', choices=('confirm', 'cancel'),
+            default=getattr(settings, 'RESERVATION_PENDING_ACTION', 'confirm'),
+            help="Czy zaległe oczekujące rezerwacje potwierdzać, czy anulować z pełnym zwrotem.",
+        )
+        parser.add_argument(
+            '--cancellation-hours', type=int, default=getattr(settings, 'RESERVATION_CANCELLATION_HOURS', 7 * 24),
+            help="Po ilu godzinach prośba o anulowanie jest zatwierdzana.",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        refund = getattr(settings, 'RESERVATION_CANCELLATION_REFUND', 0.5)
+        if options['pending_action'] == 'confirm':
+            pending = (PENDING, CONFIRMED, 0)
+        else:
+            pending = (PENDING, CANCELLED, 1)
+
+        self.expire(*pending, now - timedelta(hours=options['pending_hours']), options['batch_size'])
+        self.expire(
+            PENDING_CANCELLATION, CANCELLED, refund,
+            now - timedelta(hours=options['cancellation_hours']), options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Zamknięto {expire_past()} zgłoszeń z listy oczekujących po terminie."))
+
+    def expire(self, status, target, refund_ratio, cutoff, batch_size):
+        started = time.monotonic()
+        total = batches = 0
+
+        # Partie po indeksie (status, status_changed_at); każda to osobna, krótka transakcja
+        while True:
+            changed = expire_stale(status, target, cutoff, batch_size, refund_ratio)
+            if not changed:
+                break
+            total += changed
+            batches += 1
+            self.stdout.write(f"  {status} -> {target}: partia {batches}, razem {total}")
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{status} -> {target}: {total} rezerwacji w {elapsed:.2f} s ({rate:.0f} rezerwacji/s)."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.slots import ensure_service_slots, get_horizon
+
+
+class Command(BaseCommand):
+    help = "Tworzy brakujące terminy restauracji i SPA na najbliższe dni (do uruchamiania codziennie)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Liczba dni do przodu (domyślnie SLOT_HORIZON_DAYS).")
+
+    def handle(self, *args, **options):
+        days = options['days'] or get_horizon()
+        total = ensure_service_slots(days=days)
+        self.stdout.write(self.style.SUCCESS(f"Przygotowano {total} terminów na {days} dni."))
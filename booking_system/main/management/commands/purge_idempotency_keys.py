@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Usuwa wygasłe klucze idempotencji."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Liczba kluczy usuwanych w jednym zapytaniu.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cutoff = timezone.now()
+        total = 0
+
+        # Usuwanie partiami po indeksie expires_at, bez długich blokad tabeli
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(expires_at__lte=cutoff).order_by('expires_at')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            IdempotencyKey.objects.filter(pk__in=ids).delete()
+            total += len(ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Usunięto {total} wygasłych kluczy idempotencji."))
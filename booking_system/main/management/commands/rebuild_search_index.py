@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from main.catalog import bump_catalog_version
+from main.fulltext import ensure_search_index, rebuild_search_index
+from main.models import Service
+
+
+class Command(BaseCommand):
+    help = "Przelicza dokumenty wyszukiwania usług i odbudowuje indeks pełnotekstowy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Liczba usług zapisywanych w jednym zapytaniu.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ensure_search_index()
+        last_id = 0
+        total = 0
+
+        while True:
+            batch = list(
+                Service.objects.filter(pk__gt=last_id).order_by('pk')
+                .only('pk', 'name', 'location', 'type', 'description', 'search_document')[:batch_size]
+            )
+            if not batch:
+                break
+            for service in batch:
+                service.search_document = service.build_search_document()
+            Service.objects.bulk_update(batch, ['search_document'])
+            total += len(batch)
+            last_id = batch[-1].pk
+
+        rebuild_search_index()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Odbudowano dokumenty wyszukiwania {total} usług."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from main.catalog import bump_catalog_version
+from main.models import Service
+
+
+class Command(BaseCommand):
+    help = "Przelicza zdenormalizowane statystyki opcji (ceny, pojemność, liczba opcji) dla wszystkich usług."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Liczba usług przeliczanych w jednym zapytaniu.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+
+        # Przechodzimy po kluczu głównym, aby każda partia była tanim zakresem indeksu
+        while True:
+            ids = list(
+                Service.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += Service.objects.filter(pk__in=ids).refresh_option_stats()
+            last_id = ids[-1]
+
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Przeliczono statystyki {total} usług."))
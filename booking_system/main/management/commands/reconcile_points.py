@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db.models import IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from main.models import PointsTransaction, User
+
+
+class Command(BaseCommand):
+    help = "Sprawdza, czy saldo każdego użytkownika jest równe sumie jego transakcji punktowych."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Liczba użytkowników sprawdzanych w jednym zapytaniu.")
+        parser.add_argument(
+            '--fix', action='store_true',
+            help="Dopisuje do księgi transakcje wyrównujące (np. bilans otwarcia dla starszych kont).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ledger = (
+            PointsTransaction.objects.filter(user=OuterRef('pk')).order_by().values('user')
+            .annotate(total=Sum('amount')).values('total')
+        )
+        last_id = 0
+        checked = 0
+        mismatched = 0
+
+        # Saldo i suma księgi są czytane jednym zapytaniem na partię, więc są spójne ze sobą
+        while True:
+            rows = list(
+                User.objects.filter(pk__gt=last_id).order_by('pk')
+                .annotate(ledger=Coalesce(Subquery(ledger, output_field=IntegerField()), 0))
+                .values_list('pk', 'email', 'balance', 'ledger')[:batch_size]
+            )
+            if not rows:
+                break
+
+            corrections = []
+            for user_id, email, balance, total in rows:
+                if balance == total:
+                    continue
+                mismatched += 1
+                self.stdout.write(f"{email}: saldo {balance}, księga {total} (różnica {balance - total:+d})")
+                corrections.append(PointsTransaction(
+                    user_id=user_id, amount=balance - total, reason=PointsTransaction.ADMIN_GRANT,
+                    description="Wyrównanie salda z księgą",
+                ))
+            if options['fix'] and corrections:
+                PointsTransaction.objects.bulk_create(corrections)
+
+            checked += len(rows)
+            last_id = rows[-1][0]
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS(f"Sprawdzono {checked} kont, wszystkie salda zgadzają się z księgą."))
+        elif options['fix']:
+            self.stdout.write(self.style.WARNING(f"Sprawdzono {checked} kont, wyrównano {mismatched}."))
+        else:
+            self.stdout.write(self.style.ERROR(f"Sprawdzono {checked} kont, niezgodnych: {mismatched}."))
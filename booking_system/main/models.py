@@ -1,11 +1,14 @@
-from datetime import date
+from datetime import date, datetime, timedelta
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.utils.timezone import now, make_aware, is_naive
-from django.db.models import Min
+from django.utils.timezone import now, make_aware, is_naive, localtime
+from django.db.models import Min, Max, Count, OuterRef, Subquery, Q
+from django.db.models.functions import Coalesce
+
+from .text import search_terms
 
 # Manager użytkowników
 class UserManager(BaseUserManager):
@@ -47,6 +50,17 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+class ServiceQuerySet(models.QuerySet):
+    def refresh_option_stats(self):
+        """Przelicza zdenormalizowane statystyki opcji jednym zapytaniem UPDATE."""
+        options = ServiceOption.objects.filter(service=OuterRef('pk')).order_by().values('service')
+        return self.update(
+            min_price=Subquery(options.annotate(value=Min('price')).values('value')),
+            max_price=Subquery(options.annotate(value=Max('price')).values('value')),
+            max_capacity=Subquery(options.annotate(value=Max('capacity')).values('value')),
+            option_count=Coalesce(Subquery(options.annotate(value=Count('pk')).values('value')), 0),
+        )
+
 # Model usługi
 class Service(models.Model):
     TYPE_CHOICES = [
@@ -62,30 +76,129 @@ class Service(models.Model):
     available_from = models.DateField(null=True, blank=True, verbose_name="Dostępne od")
     available_to = models.DateField(null=True, blank=True, verbose_name="Dostępne do")
 
+    # Statystyki opcji utrzymywane przez ServiceOption (zob. rebuild_service_stats)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False, verbose_name="Najniższa cena")
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False, verbose_name="Najwyższa cena")
+    max_capacity = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Maks. pojemność")
+    option_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Liczba opcji")
+
+    # Znormalizowane rdzenie słów do wyszukiwania pełnotekstowego (zob. fulltext.py)
+    search_document = models.TextField(blank=True, default='', editable=False, verbose_name="Dokument wyszukiwania")
+
+    objects = ServiceQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Usługa"
         verbose_name_plural = "Usługi"
+        indexes = [
+            # Klucze stronicowania listy usług (zob. search.paginate_services)
+            models.Index(fields=['min_price', 'id'], name='service_price_keyset_idx'),
+            models.Index(fields=['name', 'id'], name='service_name_keyset_idx'),
+        ]
 
     def get_min_price(self):
-        min_price = self.service_options.aggregate(Min('price'))['price__min']
-        return min_price if min_price is not None else 0
+        return self.min_price if self.min_price is not None else 0
+
+    def build_search_document(self):
+        return ' '.join(search_terms(' '.join(filter(None, [self.name, self.location, self.type, self.description]))))
+
+    def save(self, *args, **kwargs):
+        self.search_document = self.build_search_document()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+# Odświeżenie statystyk opcji dla wskazanych usług
+def refresh_service_stats(service_ids):
+    service_ids = {service_id for service_id in service_ids if service_id is not None}
+    if service_ids:
+        Service.objects.filter(pk__in=service_ids).refresh_option_stats()
+
+
+class ServiceOptionQuerySet(models.QuerySet):
+    """Operacje zbiorcze, które omijają save()/delete(), też odświeżają statystyki usług."""
+    STAT_FIELDS = {'service', 'service_id', 'price', 'capacity'}
+
+    def _bulk_changed(self, service_ids=()):
+        refresh_service_stats(service_ids)
+        # Operacje zbiorcze nie wysyłają sygnałów, więc sami unieważniamy cache katalogu
+        from .catalog import bump_catalog_on_commit
+        bump_catalog_on_commit()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._bulk_changed(obj.service_id for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        service_ids = {obj.service_id for obj in objs}
+        if 'service' in fields or 'service_id' in fields:
+            # Opcje przeniesione do innej usługi zmieniają też statystyki starej usługi
+            service_ids.update(
+                self.model.objects.filter(pk__in=[obj.pk for obj in objs]).values_list('service_id', flat=True)
+            )
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        self._bulk_changed(service_ids if self.STAT_FIELDS.intersection(fields) else ())
+        return rows
+
+    def update(self, **kwargs):
+        if not self.STAT_FIELDS.intersection(kwargs):
+            rows = super().update(**kwargs)
+            self._bulk_changed()
+            return rows
+        service_ids = set(self.values_list('service_id', flat=True))
+        rows = super().update(**kwargs)
+        new_service = kwargs.get('service', kwargs.get('service_id'))
+        if new_service is not None:
+            service_ids.add(getattr(new_service, 'pk', new_service))
+        self._bulk_changed(service_ids)
+        return rows
+
+    def delete(self):
+        service_ids = set(self.values_list('service_id', flat=True))
+        result = super().delete()
+        self._bulk_changed(service_ids)
+        return result
+
 # Model opcji usługi
 class ServiceOption(models.Model):
     service = models.ForeignKey(Service, related_name='service_options', on_delete=models.CASCADE, verbose_name="Usługa")
     name = models.CharField(max_length=255, verbose_name="Nazwa")
     capacity = models.PositiveIntegerField(verbose_name="Ilość osób")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Cena")
+    # Liczba identycznych jednostek (pokoi, stolików), które można zarezerwować na ten sam termin
+    units = models.PositiveIntegerField(default=1, verbose_name="Liczba jednostek")
     available_from = models.DateField(null=True, blank=True, verbose_name="Dostępne od")
     available_to = models.DateField(null=True, blank=True, verbose_name="Dostępne do")
+    # Rezerwacje opcji trafiają do kolejki przetwarzanej partiami (zob. admission.py)
+    flash_sale = models.BooleanField(default=False, verbose_name="Tryb wyprzedaży")
+
+    objects = ServiceOptionQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Opcja usługi"
         verbose_name_plural = "Opcje usługi"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Zapamiętujemy usługę, aby po przeniesieniu opcji odświeżyć obie
+        instance._loaded_service_id = instance.__dict__.get('service_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        service_ids = {self.service_id, getattr(self, '_loaded_service_id', None)}
+        refresh_service_stats(service_ids)
+        self._loaded_service_id = self.service_id
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        refresh_service_stats({self.service_id})
+        return result
+
     def clean(self):
         if self.available_from and self.available_to and self.available_from > self.available_to:
             raise ValidationError("Data rozpoczęcia nie może być późniejsza niż data zakończenia.")
@@ -93,6 +206,55 @@ class ServiceOption(models.Model):
     def __str__(self):
         return f"{self.name} - {self.capacity} osób - {self.price} punktów"
 
+# Terminy (sloty) restauracji i SPA: siatka godzin z liczbą wolnych miejsc
+class TimeSlot(models.Model):
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='time_slots', verbose_name="Usługa")
+    option = models.ForeignKey(ServiceOption, on_delete=models.CASCADE, related_name='time_slots', verbose_name="Opcja")
+    start = models.DateTimeField(verbose_name="Początek")
+    end = models.DateTimeField(verbose_name="Koniec")
+    # Jedna rezerwacja zajmuje jedno miejsce; miejsc jest tyle, ile wynosi pojemność opcji
+    capacity = models.PositiveIntegerField(verbose_name="Liczba miejsc")
+    remaining = models.PositiveIntegerField(verbose_name="Wolne miejsca")
+
+    class Meta:
+        verbose_name = "Termin"
+        verbose_name_plural = "Terminy"
+        constraints = [
+            models.UniqueConstraint(fields=['option', 'start'], name='timeslot_option_start_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['service', 'start'], name='timeslot_service_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.option.name} {self.start:%Y-%m-%d %H:%M} ({self.remaining}/{self.capacity})"
+
+
+# Rezerwacje bez daty zakończenia (restauracja, SPA) zajmują opcję przez tyle czasu
+POINT_RESERVATION_DURATION = timedelta(hours=2)
+
+
+def overlap_condition(start, end=None):
+    """Warunek nakładania się [start_datetime, end_datetime) na przedział [start, end)."""
+    end = end or start + POINT_RESERVATION_DURATION
+    return Q(start_datetime__lt=end) & (
+        Q(end_datetime__gt=start) | Q(end_datetime__isnull=True, start_datetime__gt=start - POINT_RESERVATION_DURATION)
+    )
+
+
+class ReservationQuerySet(models.QuerySet):
+    def active(self):
+        """Rezerwacje zajmujące termin (anulowana go zwalnia)."""
+        return self.filter(status__in=Reservation.ACTIVE_STATUSES)
+
+    def overlapping(self, option_id, start, end=None):
+        """Aktywne rezerwacje opcji nachodzące na przedział [start, end).
+
+        Warunek jest zakresem na indeksie (option, start_datetime, end_datetime).
+        """
+        return self.active().filter(overlap_condition(start, end), option_id=option_id)
+
+
 # Model rezerwacji
 class Reservation(models.Model):
     STATUS_CHOICES = [
@@ -102,6 +264,7 @@ class Reservation(models.Model):
         ('pending cancellation', 'Oczekuje na anulowanie'),
         ('pending modification', 'Oczekuje na zmianę terminu'),
     ]
+    ACTIVE_STATUSES = ('pending', 'confirmed', 'pending cancellation', 'pending modification')
 
     messages = models.ManyToManyField(
         'Message',
@@ -114,16 +277,50 @@ class Reservation(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE, verbose_name="Usługa", null=True, blank=True)
     service_name = models.CharField(max_length=255, verbose_name="Nazwa usługi", blank=True, editable=False)
     option = models.ForeignKey(ServiceOption, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Opcja")
+    slot = models.ForeignKey(
+        TimeSlot, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations', verbose_name="Termin"
+    )
+    series = models.ForeignKey(
+        'ReservationSeries', on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations',
+        verbose_name="Seria",
+    )
     start_datetime = models.DateTimeField(verbose_name="Data rozpoczęcia")
     end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Data zakończenia")
     new_start_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Nowa data rozpoczęcia")
     new_end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Nowa data zakończenia")
+    previous_status = models.CharField(
+        max_length=20, blank=True, editable=False, verbose_name="Status przed prośbą o zmianę terminu",
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Cena")
+    status_changed_at = models.DateTimeField(default=now, editable=False, verbose_name="Ostatnia zmiana statusu")
+    # Znacznik jednego INSERT-u wielu rezerwacji (zob. booking.create_reservations)
+    batch = models.CharField(max_length=32, blank=True, db_index=True, editable=False, verbose_name="Paczka rezerwacji")
+
+    objects = ReservationQuerySet.as_manager()
+
+    def sync_service(self):
+        """Ustawia ``service`` i ``service_name`` zgodnie z opcją.
+
+        Bez zapytań, gdy opcja z usługą jest już wczytana albo usługa jest zgodna z
+        wczytaną opcją; w pozostałych przypadkach jedno zapytanie o nazwę usługi.
+        """
+        if self.option_id is None:
+            return
+        option = self.option if Reservation.option.is_cached(self) else None
+        if option is not None and ServiceOption.service.is_cached(option):
+            service = option.service
+        elif self.service_name and self.service_id is not None and (option is None or option.service_id == self.service_id):
+            return
+        else:
+            service = Service.objects.only('name').filter(service_options=self.option_id).first()
+            if service is None:
+                return
+        self.service = service
+        self.service_name = service.name
 
     def save(self, *args, **kwargs):
-        if self.option and self.option.service:
-            self.service_name = self.option.service.name  # <- tutaj uzupełniasz nazwę usługi
+        self.sync_service()
 
         if is_naive(self.start_datetime):
             self.start_datetime = make_aware(self.start_datetime)
@@ -135,6 +332,10 @@ class Reservation(models.Model):
     class Meta:
         verbose_name = "Rezerwacja"
         verbose_name_plural = "Rezerwacje"
+        indexes = [
+            models.Index(fields=['option', 'start_datetime', 'end_datetime'], name='reservation_interval_idx'),
+            models.Index(fields=['status', 'status_changed_at'], name='reservation_status_age_idx'),
+        ]
 
     def clean(self):
         if self.start_datetime and self.start_datetime.date() < date.today():
@@ -148,6 +349,227 @@ class Reservation(models.Model):
         return f"Rezerwacja przez {self.user} na {self.service_name}"
 
 
+# Zgłoszenie rezerwacji opcji w trybie wyprzedaży, czekające na przetworzenie (zob. admission.py)
+class AdmissionRequest(models.Model):
+    QUEUED = 'queued'
+    BOOKED = 'booked'
+    REJECTED = 'rejected'
+    STATUS_CHOICES = [
+        (QUEUED, 'W kolejce'),
+        (BOOKED, 'Zarezerwowane'),
+        (REJECTED, 'Odrzucone'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='admission_requests', verbose_name="Użytkownik")
+    option = models.ForeignKey(ServiceOption, on_delete=models.CASCADE, related_name='admission_requests', verbose_name="Opcja")
+    slot = models.ForeignKey(TimeSlot, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Termin")
+    start_datetime = models.DateTimeField(verbose_name="Data rozpoczęcia")
+    end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Data zakończenia")
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Cena")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name="Status")
+    result = models.CharField(max_length=255, blank=True, verbose_name="Wynik")
+    reservation = models.ForeignKey(
+        'Reservation', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Rezerwacja",
+    )
+    created_at = models.DateTimeField(default=now, verbose_name="Data zgłoszenia")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Data przetworzenia")
+
+    class Meta:
+        verbose_name = "Zgłoszenie w kolejce"
+        verbose_name_plural = "Kolejka wyprzedaży"
+        indexes = [
+            models.Index(fields=['option', 'status', 'created_at'], name='admission_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.option.name} ({self.get_status_display()})"
+
+
+# Rezerwacja cykliczna; wystąpienia to zwykłe rezerwacje z ustawionym ``series`` (zob. series.py)
+class ReservationSeries(models.Model):
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    FREQUENCY_CHOICES = [
+        (DAILY, 'Codziennie'),
+        (WEEKLY, 'Co tydzień'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservation_series', verbose_name="Użytkownik")
+    option = models.ForeignKey(ServiceOption, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Opcja")
+    start_datetime = models.DateTimeField(verbose_name="Pierwszy termin")
+    end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Koniec pierwszego terminu")
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default=WEEKLY, verbose_name="Powtarzanie")
+    interval = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)], verbose_name="Co ile")
+    until = models.DateField(verbose_name="Powtarzaj do")
+    created_at = models.DateTimeField(default=now, verbose_name="Data utworzenia")
+
+    class Meta:
+        verbose_name = "Rezerwacja cykliczna"
+        verbose_name_plural = "Rezerwacje cykliczne"
+
+    def __str__(self):
+        return f"{self.get_frequency_display()} od {localtime(self.start_datetime):%d.%m.%Y %H:%M} do {self.until:%d.%m.%Y}"
+
+    @property
+    def step(self):
+        return timedelta(days=self.interval * (7 if self.frequency == self.WEEKLY else 1))
+
+    def occurrences(self):
+        """Kolejne terminy (start, koniec) wyliczane na bieżąco z reguły, do ``until`` włącznie.
+
+        Godzina jest zachowywana w czasie lokalnym, także po zmianie czasu.
+        """
+        first = localtime(self.start_datetime)
+        last = localtime(self.end_datetime) if self.end_datetime else None
+        day = first.date()
+        while day <= self.until:
+            start = make_aware(datetime.combine(day, first.time()))
+            end = make_aware(datetime.combine(day + (last.date() - first.date()), last.time())) if last else None
+            yield start, end
+            day += self.step
+
+
+# Tymczasowa blokada terminu na czas wypełniania formularza rezerwacji
+class BookingHold(models.Model):
+    ACTIVE = 'active'
+    CONVERTED = 'converted'
+    EXPIRED = 'expired'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Aktywna'),
+        (CONVERTED, 'Zamieniona na rezerwację'),
+        (EXPIRED, 'Wygasła'),
+        (RELEASED, 'Zwolniona'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='booking_holds', verbose_name="Użytkownik")
+    option = models.ForeignKey(ServiceOption, on_delete=models.CASCADE, related_name='holds', verbose_name="Opcja")
+    slot = models.ForeignKey(
+        TimeSlot, on_delete=models.CASCADE, null=True, blank=True, related_name='holds', verbose_name="Termin"
+    )
+    start_datetime = models.DateTimeField(verbose_name="Data rozpoczęcia")
+    end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Data zakończenia")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ACTIVE, verbose_name="Status")
+    reservation = models.OneToOneField(
+        Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='hold', verbose_name="Rezerwacja"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data utworzenia")
+    expires_at = models.DateTimeField(verbose_name="Wygasa")
+
+    class Meta:
+        verbose_name = "Blokada terminu"
+        verbose_name_plural = "Blokady terminów"
+        indexes = [
+            # Przegląd wygasłych blokad (status, expires_at) oraz nakładanie się blokad na termin opcji
+            models.Index(fields=['status', 'expires_at'], name='hold_status_expires_idx'),
+            models.Index(fields=['option', 'status', 'start_datetime'], name='hold_option_interval_idx'),
+        ]
+
+    def __str__(self):
+        return f"Blokada {self.option} dla {self.user} do {self.expires_at:%H:%M}"
+
+
+# Lista oczekujących na zajętą opcję; kolejność zgłoszeń decyduje o przydziale zwolnionego miejsca
+class WaitlistEntry(models.Model):
+    WAITING = 'waiting'
+    PROMOTED = 'promoted'
+    LEFT = 'left'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (WAITING, 'Oczekuje'),
+        (PROMOTED, 'Zarezerwowano'),
+        (LEFT, 'Wypisano'),
+        (EXPIRED, 'Termin minął'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries', verbose_name="Użytkownik")
+    option = models.ForeignKey(ServiceOption, on_delete=models.CASCADE, related_name='waitlist', verbose_name="Opcja")
+    start_datetime = models.DateTimeField(verbose_name="Data rozpoczęcia")
+    end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="Data zakończenia")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=WAITING, verbose_name="Status")
+    reservation = models.OneToOneField(
+        Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry',
+        verbose_name="Rezerwacja",
+    )
+    created_at = models.DateTimeField(default=now, verbose_name="Data zgłoszenia")
+    promoted_at = models.DateTimeField(null=True, blank=True, verbose_name="Data przydziału")
+
+    class Meta:
+        verbose_name = "Zgłoszenie na liście oczekujących"
+        verbose_name_plural = "Lista oczekujących"
+        indexes = [
+            # Następny oczekujący na opcję: zakres po (option, status) w kolejności zgłoszeń
+            models.Index(fields=['option', 'status', 'created_at'], name='waitlist_fifo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} czeka na {self.option}"
+
+
+# Księga punktów: każda zmiana salda to jeden wiersz (tylko dopisywanie)
+class PointsTransaction(models.Model):
+    RESERVATION = 'reservation'
+    REVIEW_REWARD = 'review_reward'
+    REFUND = 'refund'
+    ADMIN_GRANT = 'admin_grant'
+    REASON_CHOICES = [
+        (RESERVATION, 'Rezerwacja'),
+        (REVIEW_REWARD, 'Nagroda za opinię'),
+        (REFUND, 'Zwrot'),
+        (ADMIN_GRANT, 'Przyznanie przez administratora'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='points_transactions', verbose_name="Użytkownik")
+    amount = models.IntegerField(verbose_name="Kwota")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name="Powód")
+    reservation = models.ForeignKey(
+        Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='points_transactions',
+        verbose_name="Rezerwacja"
+    )
+    description = models.CharField(max_length=255, blank=True, verbose_name="Opis")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data")
+
+    class Meta:
+        verbose_name = "Transakcja punktowa"
+        verbose_name_plural = "Transakcje punktowe"
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='points_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.amount:+d} punktów dla {self.user} ({self.get_reason_display()})"
+
+
+# Klucze idempotencji formularzy (ponowne wysłanie nie tworzy drugiej rezerwacji)
+class IdempotencyKey(models.Model):
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (PROCESSING, 'W trakcie'),
+        (COMPLETED, 'Zakończone'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys', verbose_name="Użytkownik")
+    key = models.CharField(max_length=64, verbose_name="Klucz")
+    fingerprint = models.CharField(max_length=64, verbose_name="Odcisk żądania")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PROCESSING, verbose_name="Status")
+    response_level = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Poziom komunikatu")
+    response_message = models.TextField(blank=True, verbose_name="Komunikat")
+    response_data = models.JSONField(null=True, blank=True, verbose_name="Dane odpowiedzi")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data utworzenia")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="Wygasa")
+
+    class Meta:
+        verbose_name = "Klucz idempotencji"
+        verbose_name_plural = "Klucze idempotencji"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.get_status_display()})"
+
+
 # Model opinii
 class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Użytkownik")
@@ -181,6 +603,8 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False, verbose_name="Przeczytane")
     response = models.TextField(null=True, blank=True, verbose_name="Odpowiedź")
     response_date = models.DateTimeField(null=True, blank=True, verbose_name="Data odpowiedzi")
+    # Znacznik jednego INSERT-u wysyłki do wielu użytkowników (zob. broadcast.create_messages)
+    batch = models.CharField(max_length=32, blank=True, db_index=True, editable=False, verbose_name="Paczka wysyłki")
 
     class Meta:
         verbose_name = "Wiadomość"
@@ -190,12 +614,31 @@ class Message(models.Model):
         return f"Wiadomość od {self.user}"
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        if self.sender == 'admin' and not self.reservations.exists():
+        if adding and self.sender == 'admin':
             # Automatyczne powiązanie z pierwszą rezerwacją użytkownika
-            reservation = Reservation.objects.filter(user=self.user).first()
-            if reservation:
-                self.reservations.add(reservation)
+            link_first_reservations([self])
+
+
+def link_first_reservations(messages, reservations=None):
+    """Wiąże każdą wiadomość z pierwszą (najstarszą) rezerwacją jej adresata.
+
+    Zbiorowy odpowiednik dawnego powiązania w Message.save: jedno zapytanie
+    grupujące po użytkowniku i jeden INSERT do tabeli pośredniej dla całej paczki.
+    ``reservations`` zawęża rezerwacje brane pod uwagę (np. do jednej usługi).
+    """
+    reservations = Reservation.objects.all() if reservations is None else reservations
+    first = dict(
+        reservations.filter(user_id__in={message.user_id for message in messages})
+        .order_by().values('user_id').annotate(first_id=Min('pk')).values_list('user_id', 'first_id')
+    )
+    links = [
+        Reservation.messages.through(reservation_id=first[message.user_id], message_id=message.pk)
+        for message in messages if message.user_id in first
+    ]
+    Reservation.messages.through.objects.bulk_create(links)
+    return len(links)
 
 class ServiceStatus(models.Model):
     status_choices = [
@@ -0,0 +1,74 @@
+"""Księga punktów użytkowników.
+
+Saldo (``User.balance``) zmienia się wyłącznie przez ``apply_points``: w jednej
+transakcji saldo jest aktualizowane wyrażeniem ``F()`` (bez odczytu i zapisu
+całego obiektu, więc równoległe zmiany się nie gubią) i dopisywany jest wiersz
+``PointsTransaction``. Suma księgi użytkownika jest zawsze równa jego saldu, co
+sprawdza komenda ``reconcile_points``.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import PointsTransaction, User
+
+
+class InsufficientPoints(Exception):
+    pass
+
+
+def to_points(value):
+    """Kwota w punktach (liczba całkowita); ceny są w Decimal, saldo w IntegerField."""
+    return int(Decimal(value).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def apply_points(user, amount, reason, reservation=None, description='', require_funds=False):
+    """Zmienia saldo o ``amount`` i zapisuje transakcję w księdze.
+
+    Przy ``require_funds`` obciążenie wykonuje się tylko, gdy saldo wystarcza
+    (warunkowy UPDATE); w przeciwnym razie zgłaszany jest InsufficientPoints.
+    """
+    amount = to_points(amount)
+    with transaction.atomic():
+        users = User.objects.filter(pk=user.pk)
+        if require_funds and amount < 0:
+            users = users.filter(balance__gte=-amount)
+        if not users.update(balance=F('balance') + amount):
+            raise InsufficientPoints("Nie masz wystarczających środków na koncie.")
+
+        entry = PointsTransaction.objects.create(
+            user_id=user.pk, amount=amount, reason=reason, reservation=reservation, description=description,
+        )
+
+    user.balance = (user.balance or 0) + amount
+    return entry
+
+
+def apply_points_many(changes, reason, description=''):
+    """Zmienia salda wielu użytkowników jednym UPDATE i zapisuje wpisy jednym INSERT.
+
+    ``changes`` to lista (id użytkownika, kwota, id rezerwacji lub None). Saldo nie
+    jest sprawdzane, więc funkcja służy do zwrotów i przyznawania punktów albo do
+    obciążeń sprawdzonych pod blokadą wierszy użytkowników (admission.py).
+    """
+    changes = [(user_id, to_points(amount), reservation_id) for user_id, amount, reservation_id in changes]
+    changes = [change for change in changes if change[1]]
+    if not changes:
+        return []
+
+    totals = {}
+    for user_id, amount, reservation_id in changes:
+        totals[user_id] = totals.get(user_id, 0) + amount
+
+    with transaction.atomic():
+        User.objects.filter(pk__in=totals).update(balance=F('balance') + Case(
+            *[When(pk=user_id, then=Value(total)) for user_id, total in totals.items()],
+            default=Value(0), output_field=IntegerField(),
+        ))
+        return PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                user_id=user_id, amount=amount, reason=reason, reservation_id=reservation_id, description=description,
+            )
+            for user_id, amount, reservation_id in changes
+        ])
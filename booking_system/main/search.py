@@ -0,0 +1,245 @@
+"""Wyszukiwanie usług na stronie głównej.
+
+Filtry z formularza są normalizowane do ``HomeFilters`` i kompilowane do jednego
+zapytania o usługi. Warunki dotyczące opcji (cena, daty, konkretna opcja) trafiają
+do podzapytań EXISTS, więc wynik nie zawiera duplikatów i nie wymaga GROUP BY ani
+DISTINCT. Każdy filtr ma własne EXISTS: jak w dawnym widoku z osobnymi złączeniami
+cenę i daty może spełnić inna opcja tej samej usługi.
+
+Lista jest stronicowana kursorem (keyset): kolejna strona zaczyna się za ostatnim
+wierszem poprzedniej, więc dalekie strony kosztują tyle samo co pierwsza.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+
+from . import availability, fulltext
+from .models import Service, ServiceOption
+
+
+class HomeFilters:
+    FIELDS = ('q', 'type', 'location', 'price', 'check_in', 'check_out', 'guests', 'option')
+
+    def __init__(self, service_type='', location='', max_price=None, check_in=None, check_out=None, option_id=None,
+                 query='', guests=None):
+        self.query = query
+        self.guests = guests
+        self.service_type = service_type
+        self.location = location
+        self.max_price = max_price
+        self.check_in = check_in
+        self.check_out = check_out
+        self.option_id = option_id
+
+    @classmethod
+    def from_query_dict(cls, data):
+        """Buduje filtry z request.GET, pomijając błędne wartości (jak dotychczasowy widok)."""
+        service_type = data.get('type', '').strip()
+        location = data.get('location', '').strip()
+
+        max_price = None
+        try:
+            if data.get('price', ''):
+                max_price = Decimal(data.get('price')).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            pass
+
+        check_in = check_out = None
+        if data.get('check_in', '') and data.get('check_out', ''):
+            try:
+                check_in = datetime.strptime(data.get('check_in'), '%Y-%m-%d').date()
+                check_out = datetime.strptime(data.get('check_out'), '%Y-%m-%d').date()
+            except ValueError:
+                check_in = check_out = None
+
+        option_id = data.get('option', '')
+        option_id = int(option_id) if option_id.isdigit() else None
+
+        guests = data.get('guests', '')
+        guests = int(guests) if guests.isdigit() and int(guests) > 0 else None
+
+        # Zapytanie tekstowe: nadmiarowe spacje nie tworzą osobnych wpisów w cache
+        query = ' '.join(data.get('q', '').split())
+
+        return cls(service_type, location, max_price, check_in, check_out, option_id, query, guests)
+
+    @property
+    def has_dates(self):
+        return self.check_in is not None and self.check_out is not None
+
+    def as_query_dict(self):
+        """Kanoniczna postać filtrów (tylko ustawione pola, stała kolejność)."""
+        values = {
+            'q': self.query,
+            'type': self.service_type,
+            'location': self.location,
+            'price': str(self.max_price) if self.max_price is not None else '',
+            'check_in': self.check_in.isoformat() if self.check_in else '',
+            'check_out': self.check_out.isoformat() if self.check_out else '',
+            'guests': str(self.guests) if self.guests is not None else '',
+            'option': str(self.option_id) if self.option_id is not None else '',
+        }
+        return {field: values[field] for field in self.FIELDS if values[field]}
+
+
+def option_filters(filters):
+    """Filtry opcji jako pary (warunek na opcję, czy przepuszcza usługi bez opcji).
+
+    Liczba gości i daty dotyczą tej samej opcji, bo silnik dostępności sprawdza je razem.
+    """
+    checks = []
+    if filters.max_price is not None:
+        checks.append((Q(price__lte=filters.max_price), True))
+    if filters.has_dates:
+        # Wolne noce (okno dostępności i rezerwacje) liczy silnik w pamięci (zob. availability.py)
+        free = availability.free_options(
+            filters.check_in, filters.check_out, filters.location or None, filters.guests
+        )
+        if free is not None:
+            conditions = Q(pk__in=free)
+        else:
+            # Poza horyzontem silnika: tylko okno dostępności
+            last_night = max(filters.check_out - timedelta(days=1), filters.check_in)
+            conditions = Q(available_from__lte=filters.check_in, available_to__gte=last_night)
+            if filters.guests is not None:
+                conditions &= Q(capacity__gte=filters.guests)
+        # Usługi bez opcji przechodzą filtr dat tylko wtedy, gdy wybrano typ usługi
+        checks.append((conditions, bool(filters.service_type)))
+    elif filters.guests is not None:
+        checks.append((Q(capacity__gte=filters.guests), True))
+    if filters.option_id is not None:
+        checks.append((Q(pk=filters.option_id), False))
+    return checks
+
+
+def search_services(filters, queryset=None):
+    """Zwraca usługi spełniające filtry jako jedno zapytanie bez złączeń po opcjach."""
+    services = queryset if queryset is not None else Service.objects.all()
+
+    # Wyszukiwanie pełnotekstowe dodaje adnotację relevance używaną do sortowania
+    if filters.query:
+        services = fulltext.search(services, filters.query)
+
+    if filters.service_type:
+        services = services.filter(type=filters.service_type)
+    if filters.location:
+        services = services.filter(location=filters.location)
+
+    for conditions, allow_without_options in option_filters(filters):
+        matching_option = Exists(ServiceOption.objects.filter(conditions, service=OuterRef('pk')))
+        if allow_without_options:
+            services = services.filter(matching_option | Q(option_count=0))
+        else:
+            services = services.filter(matching_option)
+
+    return services
+
+
+# Dostępne sortowania listy usług: (etykieta, kolumna klucza)
+SORT_ORDERS = {
+    'relevance': ("Trafność", 'relevance'),
+    'price': ("Cena rosnąco", 'min_price'),
+    'name': ("Nazwa", 'name'),
+    'newest': ("Najnowsze", None),
+}
+DEFAULT_SORT = 'price'
+
+
+def normalize_sort(sort, filters=None):
+    """Trafność ma sens tylko przy zapytaniu tekstowym i jest wtedy domyślna."""
+    has_query = filters is not None and bool(filters.query)
+    if sort == 'relevance' and not has_query:
+        return DEFAULT_SORT
+    if sort not in SORT_ORDERS:
+        return 'relevance' if has_query else DEFAULT_SORT
+    return sort
+
+
+def get_page_size():
+    return getattr(settings, 'HOME_PAGE_SIZE', 12)
+
+
+def encode_cursor(sort, service):
+    column = SORT_ORDERS[sort][1]
+    value = getattr(service, column) if column else None
+    payload = {'s': sort, 'id': service.pk, 'v': str(value) if value is not None else None}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    """Zwraca (wartość klucza, id) z kursora albo None, jeśli kursor jest błędny lub z innego sortowania."""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if payload['s'] != sort:
+            return None
+        value = payload['v']
+        if value is not None and sort == 'price':
+            value = Decimal(value)
+        elif value is not None and sort == 'relevance':
+            value = float(value)
+        return value, int(payload['id'])
+    except (ValueError, KeyError, TypeError, InvalidOperation):
+        return None
+
+
+def order_services(services, sort):
+    if sort == 'relevance':
+        return services.order_by(F('relevance').desc(), 'pk')
+    if sort == 'price':
+        return services.order_by(F('min_price').asc(nulls_last=True), 'pk')
+    if sort == 'name':
+        return services.order_by('name', 'pk')
+    return services.order_by('-pk')
+
+
+def after_cursor(sort, value, last_id):
+    """Warunek "za ostatnim wierszem" zgodny z kolejnością z order_services()."""
+    if sort == 'newest':
+        return Q(pk__lt=last_id)
+    if sort == 'relevance':
+        return Q(relevance__lt=value) | Q(relevance=value, pk__gt=last_id)
+    column = SORT_ORDERS[sort][1]
+    if value is None:
+        # Usługi bez ceny są na końcu listy
+        return Q(**{f'{column}__isnull': True, 'pk__gt': last_id})
+    condition = Q(**{f'{column}__gt': value}) | Q(**{column: value, 'pk__gt': last_id})
+    if sort == 'price':
+        condition |= Q(min_price__isnull=True)
+    return condition
+
+
+class ServicePage:
+    def __init__(self, services, sort, next_cursor, is_first):
+        self.services = services
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_services(services, sort=DEFAULT_SORT, cursor='', page_size=None):
+    """Pobiera jedną stronę usług zaczynając za kursorem (LIMIT page_size + 1).
+
+    Sortowanie po trafności wymaga adnotacji ``relevance`` (zob. fulltext.search).
+    """
+    if sort not in SORT_ORDERS:
+        sort = DEFAULT_SORT
+    page_size = page_size or get_page_size()
+
+    position = decode_cursor(sort, cursor)
+    services = order_services(services, sort)
+    if position is not None:
+        services = services.filter(after_cursor(sort, *position))
+
+    rows = list(services[:page_size + 1])
+    next_cursor = encode_cursor(sort, rows[page_size - 1]) if len(rows) > page_size else None
+    return ServicePage(rows[:page_size], sort, next_cursor, is_first=position is None)
@@ -0,0 +1,58 @@
+"""Rezerwacje cykliczne ("co wtorek o 18:00 przez trzy miesiące").
+
+Reguła powtarzania jest zapisana w ``ReservationSeries``, a terminy wystąpień
+wylicza na bieżąco ``ReservationSeries.occurrences`` (generator, ograniczony do
+``RESERVATION_SERIES_MAX_OCCURRENCES``). Wystąpienia są zwykłymi rezerwacjami z
+ustawionym ``series``, więc dostępność, anulowanie i terminy z siatki działają
+dla nich bez zmian; powstają razem przez ``book_lines``: jedno zapytanie o
+zajętość dla wszystkich terminów, jedno obciążenie salda i jeden ``bulk_create``.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .booking import BookingError, aware, book_lines
+from .holds import release_user_holds
+from .models import Reservation, ReservationSeries
+from .transitions import CONFIRMED, PENDING, PENDING_CANCELLATION, transition_many
+
+
+def get_max_occurrences():
+    return getattr(settings, 'RESERVATION_SERIES_MAX_OCCURRENCES', 26)
+
+
+def book_series(user, option, start, end=None, frequency=ReservationSeries.WEEKLY, interval=1, until=None):
+    """Rezerwuje wszystkie wystąpienia serii albo żadne; zwraca (serię, rezerwacje) lub zgłasza BookingError."""
+    if frequency not in dict(ReservationSeries.FREQUENCY_CHOICES) or interval < 1:
+        raise BookingError("Nieprawidłowa reguła powtarzania.")
+    series = ReservationSeries(
+        user=user, option=option, start_datetime=aware(start), end_datetime=aware(end),
+        frequency=frequency, interval=interval, until=until,
+    )
+    if until is None or until <= timezone.localtime(series.start_datetime).date():
+        raise BookingError("Data końca serii musi być późniejsza niż pierwszy termin.")
+
+    limit = get_max_occurrences()
+    lines = [(option.pk, start, end) for start, end in islice(series.occurrences(), limit + 1)]
+    if len(lines) > limit:
+        raise BookingError(f"Seria może mieć najwyżej {limit} terminów.")
+
+    with transaction.atomic():
+        # Blokada pierwszego terminu z formularza zajmowałaby drugie miejsce obok wystąpienia serii;
+        # przy odrzuceniu serii jej zwolnienie jest wycofywane
+        release_user_holds(user, option)
+        reservations = book_lines(
+            user, lines, f"Rezerwacja cykliczna: {option.service.name}, {len(lines)} terminów", series=series,
+        )
+    return series, reservations
+
+
+def upcoming(series):
+    return Reservation.objects.filter(series=series, start_datetime__gt=timezone.now())
+
+
+def cancel_series(series):
+    """Prośba o anulowanie wszystkich nadchodzących wystąpień jednym UPDATE; zwraca ich liczbę."""
+    return transition_many(upcoming(series), PENDING_CANCELLATION, expected=[PENDING, CONFIRMED])
@@ -0,0 +1,70 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .availability import hold_changed, reservation_changed
+from .catalog import bump_catalog_on_commit
+from .fulltext import ensure_search_index
+from .models import BookingHold, Reservation, Service, ServiceOption, ServiceStatus
+from .slots import ensure_slots, sync_capacity, uses_slots
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=ServiceOption)
+@receiver(post_delete, sender=ServiceOption)
+@receiver(post_save, sender=ServiceStatus)
+@receiver(post_delete, sender=ServiceStatus)
+def invalidate_catalog(sender, **kwargs):
+    """Każda zmiana katalogu unieważnia wszystkie wpisy cache katalogu (po zatwierdzeniu transakcji)."""
+    bump_catalog_on_commit()
+
+
+@receiver(post_save, sender=ServiceOption)
+def allocate_time_slots(sender, instance, **kwargs):
+    """Opcje restauracji i SPA dostają terminy na horyzont z wyprzedzeniem (zob. slots.py)."""
+    if uses_slots(instance.service.type):
+        ensure_slots([instance])
+        sync_capacity(instance)
+
+
+@receiver(post_save, sender=Service)
+def rename_reservations(sender, instance, created, **kwargs):
+    """Nazwa usługi w rezerwacjach podąża za katalogiem (UPDATE po indeksie service_id)."""
+    if not created:
+        Reservation.objects.filter(service=instance).exclude(service_name=instance.name).update(service_name=instance.name)
+
+
+@receiver(post_save, sender=ServiceOption)
+def move_reservations(sender, instance, created, **kwargs):
+    """Opcja przeniesiona do innej usługi przenosi swoje rezerwacje."""
+    if not created:
+        Reservation.objects.filter(option=instance).exclude(service_id=instance.service_id).update(
+            service_id=instance.service_id, service_name=instance.service.name,
+        )
+
+
+@receiver(post_save, sender=Reservation)
+def update_availability(sender, instance, **kwargs):
+    """Nanosi zmienioną rezerwację na bitmapy dostępności (zob. availability.py)."""
+    reservation_changed(instance)
+
+
+@receiver(post_delete, sender=Reservation)
+def release_availability(sender, instance, **kwargs):
+    reservation_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=BookingHold)
+def update_hold_availability(sender, instance, **kwargs):
+    hold_changed(instance)
+
+
+@receiver(post_delete, sender=BookingHold)
+def release_hold_availability(sender, instance, **kwargs):
+    hold_changed(instance, deleted=True)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using='default', **kwargs):
+    if sender.name == 'main':
+        ensure_search_index(using)
@@ -0,0 +1,164 @@
+"""Terminy (sloty) dla usług rezerwowanych na godzinę: restauracji i SPA.
+
+Dla każdej opcji takiej usługi tworzone są z wyprzedzeniem wiersze ``TimeSlot``
+według godzin otwarcia (``SLOT_SCHEDULE``) na ``SLOT_HORIZON_DAYS`` dni naprzód,
+z liczbą miejsc równą liczbie jednostek opcji (``units``, np. stolików), tak
+jak dla usług bez siatki; ``capacity`` opcji to liczba osób przy jednej
+jednostce. Rezerwacja zajmuje miejsce warunkowym UPDATE (``remaining > 0``), a
+anulowanie je zwalnia, więc sprawdzenie dostępności nie wymaga przeglądania
+rezerwacji. Lista wolnych terminów dnia to jedno zapytanie po indeksie
+(service, start).
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import ServiceOption, TimeSlot
+
+# Godzina otwarcia, godzina zamknięcia i długość terminu w minutach
+DEFAULT_SCHEDULE = {
+    'Restauracja': ('12:00', '22:00', 120),
+    'SPA&WELLNESS': ('09:00', '20:00', 60),
+}
+
+
+def get_schedule(service_type):
+    schedule = getattr(settings, 'SLOT_SCHEDULE', DEFAULT_SCHEDULE).get(service_type)
+    if schedule is None:
+        return None
+    opens, closes, minutes = schedule
+    return time.fromisoformat(opens), time.fromisoformat(closes), timedelta(minutes=minutes)
+
+
+def get_horizon():
+    return getattr(settings, 'SLOT_HORIZON_DAYS', 60)
+
+
+def uses_slots(service_type):
+    return get_schedule(service_type) is not None
+
+
+def slots_per_day(service_type):
+    """Liczba terminów w jednym dniu według godzin otwarcia (0 dla usług bez siatki)."""
+    schedule = get_schedule(service_type)
+    if schedule is None:
+        return 0
+    opens, closes, length = schedule
+    return int((datetime.combine(datetime.min, closes) - datetime.combine(datetime.min, opens)) / length)
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def build_day(option, service_type, day):
+    """Niezapisane terminy opcji na dany dzień (pusta lista poza oknem dostępności)."""
+    schedule = get_schedule(service_type)
+    if schedule is None:
+        return []
+    if option.available_from and day < option.available_from:
+        return []
+    if option.available_to and day > option.available_to:
+        return []
+
+    opens, closes, length = schedule
+    start = timezone.make_aware(datetime.combine(day, opens))
+    closing = timezone.make_aware(datetime.combine(day, closes))
+    slots = []
+    while start + length <= closing:
+        slots.append(TimeSlot(
+            service_id=option.service_id, option=option, start=start, end=start + length,
+            capacity=option.units, remaining=option.units,
+        ))
+        start += length
+    return slots
+
+
+def ensure_slots(options, first_day=None, days=None, batch_size=1000):
+    """Tworzy brakujące terminy opcji na ``days`` dni od ``first_day`` (istniejące są pomijane).
+
+    Zwraca liczbę terminów przekazanych do zapisu.
+    """
+    first_day = first_day or timezone.localdate()
+    days = get_horizon() if days is None else days
+    created = 0
+    pending = []
+    for option in options:
+        service_type = option.service.type
+        for offset in range(days):
+            pending.extend(build_day(option, service_type, first_day + timedelta(days=offset)))
+            if len(pending) >= batch_size:
+                created += len(TimeSlot.objects.bulk_create(pending, ignore_conflicts=True))
+                pending = []
+    if pending:
+        created += len(TimeSlot.objects.bulk_create(pending, ignore_conflicts=True))
+    return created
+
+
+def sync_capacity(option):
+    """Przenosi zmianę liczby jednostek opcji na przyszłe terminy, zachowując zajęte miejsca."""
+    # Kolejność ma znaczenie: MySQL liczy przypisania SET od lewej do prawej
+    return TimeSlot.objects.filter(option=option, start__gte=timezone.now()).exclude(capacity=option.units).update(
+        remaining=Greatest(F('remaining') + option.units - F('capacity'), 0),
+        capacity=option.units,
+    )
+
+
+def find_slot(option, start):
+    """Termin opcji zaczynający się dokładnie o ``start``; brakujący dzień jest dogenerowywany.
+
+    Terminy istnieją tylko w horyzoncie [dzisiaj, dzisiaj + SLOT_HORIZON_DAYS];
+    dla dnia spoza niego zgłaszany jest BookingError zamiast tworzenia wierszy.
+    """
+    from .booking import BookingError
+
+    day = timezone.localtime(start).date()
+    today = timezone.localdate()
+    if not today <= day <= today + timedelta(days=get_horizon()):
+        raise BookingError(f"Terminy można rezerwować najwyżej {get_horizon()} dni naprzód.")
+    slot = TimeSlot.objects.filter(option=option, start=start).first()
+    if slot is None:
+        TimeSlot.objects.bulk_create(build_day(option, option.service.type, day), ignore_conflicts=True)
+        slot = TimeSlot.objects.filter(option=option, start=start).first()
+    return slot
+
+
+def take_slot(slot_id):
+    """Zajmuje jedno miejsce; False, gdy termin jest pełny."""
+    return TimeSlot.objects.filter(pk=slot_id, remaining__gt=0).update(remaining=F('remaining') - 1) == 1
+
+
+def release_slot(slot_id):
+    """Zwalnia miejsce zajęte przez anulowaną rezerwację."""
+    if slot_id is None:
+        return False
+    return TimeSlot.objects.filter(pk=slot_id, remaining__lt=F('capacity')).update(remaining=F('remaining') + 1) == 1
+
+
+def release_slots(counts):
+    """Zwalnia wiele miejsc naraz: {id terminu: liczba miejsc}, jeden UPDATE na termin."""
+    for slot_id, count in counts.items():
+        if slot_id is not None:
+            TimeSlot.objects.filter(pk=slot_id).update(remaining=Least(F('remaining') + count, F('capacity')))
+
+
+def free_slots(service_id, day, option_id=None):
+    """Wolne terminy usługi w danym dniu (jedno zapytanie)."""
+    start, end = day_bounds(day)
+    slots = TimeSlot.objects.filter(service_id=service_id, start__gte=start, start__lt=end, remaining__gt=0)
+    if option_id is not None:
+        slots = slots.filter(option_id=option_id)
+    return list(slots.order_by('start', 'option_id').values('id', 'option_id', 'start', 'end', 'remaining'))
+
+
+def ensure_service_slots(service_ids=None, days=None):
+    options = ServiceOption.objects.select_related('service').filter(
+        service__type__in=list(getattr(settings, 'SLOT_SCHEDULE', DEFAULT_SCHEDULE))
+    )
+    if service_ids is not None:
+        options = options.filter(service_id__in=service_ids)
+    return ensure_slots(options.iterator(), days=days)
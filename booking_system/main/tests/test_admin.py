@@ -67,20 +67,13 @@ class AdminTests(TestCase):
 
     def test_service_admin_get_min_price(self):
         service_admin = ServiceAdmin(Service, self.site)
-        mock_service = MagicMock()
-        mock_queryset = MagicMock()
-        mock_service.service_options.all.return_value = mock_queryset
-        mock_queryset.aggregate.return_value = {'price__min': 100.0}
+        mock_service = MagicMock(min_price=100.0)
         result = service_admin.get_min_price(mock_service)
         self.assertEqual(result, '100.00 punktów')
 
     def test_service_admin_get_capacity(self):
         service_admin = ServiceAdmin(Service, self.site)
-        mock_service = MagicMock()
-        mock_service.service_options.all.return_value = [
-            MagicMock(capacity=10),
-            MagicMock(capacity=20)
-        ]
+        mock_service = MagicMock(max_capacity=20)
         result = service_admin.get_capacity(mock_service)
         self.assertEqual(result, 20)
 
@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..booking import book_option
+from ..models import Message, Review, Service, ServiceOption, User
+
+
+class ChangelistQueryCountTestCase(TestCase):
+    """Liczba zapytań listy w panelu nie zależy od liczby wierszy na stronie."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@example.com', first_name='Admin', last_name='User', password='adminpass',
+        )
+        self.client = Client()
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        start = timezone.now() + timedelta(days=1)
+        for number in range(self.rows, self.rows + count):
+            user = User.objects.create_user(
+                email=f'user{number}@example.com', first_name='Jan', last_name=f'Kowalski {number}',
+                password='haslo123', balance=1000,
+            )
+            service = Service.objects.create(name=f'Hotel {number}', location='Kraków', type='Hotel')
+            option = ServiceOption.objects.create(service=service, name='Pokój', capacity=2, price=100)
+            book_option(user, option, start, start + timedelta(days=1), price=100)
+            Review.objects.create(user=user, service=service, rating=5, comment='Polecam')
+            Message.objects.create(user=user, subject='Pytanie', content='Treść', sender='user')
+        self.rows += count
+
+    def queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists(self):
+        pages = {
+            'admin:main_service_changelist': 7,
+            'admin:main_reservation_changelist': 9,
+            'admin:main_pointstransaction_changelist': 7,
+            'admin:main_review_changelist': 8,
+            'admin:main_message_changelist': 7,
+        }
+        self.add_rows(2)
+        few = {url_name: self.queries(url_name) for url_name in pages}
+        self.add_rows(8)
+        many = {url_name: self.queries(url_name) for url_name in pages}
+
+        self.assertEqual(few, many)
+        self.assertEqual(many, pages)
@@ -0,0 +1,150 @@
+from datetime import datetime, time, timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..admission import NO_FUNDS, NO_PLACES, drain, enqueue, position
+from ..models import AdmissionRequest, PointsTransaction, Reservation, Service, ServiceOption, TimeSlot, User
+
+
+def at(day, hour=0):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@override_settings(SLOT_SCHEDULE={'Restauracja': ('12:00', '16:00', 120)}, SLOT_HORIZON_DAYS=2)
+class AdmissionQueueTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.package = ServiceOption.objects.create(
+            service=self.hotel, name='Pakiet promocyjny', capacity=2, price=100, units=2, flash_sale=True,
+        )
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', first_name='Jan', last_name='Kowalski',
+                password='haslo123', balance=1000,
+            )
+            for number in range(12)
+        ]
+
+    def post(self, user, service, data):
+        client = Client()
+        client.force_login(user)
+        response = client.post(reverse('make_reservation', args=[service.id]), data, follow=True)
+        return client, [str(message) for message in response.context['messages']]
+
+    def stay(self):
+        return {
+            'option': self.package.id,
+            'start_date': f'{self.day:%Y-%m-%d}',
+            'end_date': f'{self.day + timedelta(days=2):%Y-%m-%d}',
+        }
+
+    def test_requests_are_queued_and_drained_in_order(self):
+        for user in self.users[:5]:
+            client, messages = self.post(user, self.hotel, self.stay())
+        self.assertEqual(messages, [
+            "Twoje zgłoszenie czeka w kolejce (miejsce 5). Wynik pojawi się na tej stronie.",
+        ])
+        self.assertFalse(Reservation.objects.exists())
+
+        out = StringIO()
+        call_command('drain_admission_queue', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn("Przetworzono 5 zgłoszeń (2 rezerwacji, 3 odrzuconych)", out.getvalue())
+
+        booked = AdmissionRequest.objects.filter(status=AdmissionRequest.BOOKED).order_by('created_at')
+        self.assertEqual([request.user for request in booked], self.users[:2])
+        self.assertEqual(
+            set(AdmissionRequest.objects.filter(status=AdmissionRequest.REJECTED).values_list('result', flat=True)),
+            {NO_PLACES},
+        )
+        self.assertEqual(Reservation.objects.filter(option=self.package).count(), 2)
+        self.assertEqual(
+            sorted(User.objects.filter(pk__in=[user.pk for user in self.users[:5]]).values_list('balance', flat=True)),
+            [800, 800, 1000, 1000, 1000],
+        )
+        self.assertEqual(PointsTransaction.objects.filter(reason=PointsTransaction.RESERVATION).count(), 2)
+
+        # Strona usługi pokazuje wynik; stan zgłoszenia jest dostępny do odpytywania
+        response = client.get(reverse('admission_status', args=[AdmissionRequest.objects.get(user=self.users[4]).pk]))
+        self.assertEqual(
+            response.json(), {'status': 'rejected', 'result': NO_PLACES, 'position': None, 'reservation': None},
+        )
+        self.assertContains(client.get(reverse('service_detail', args=[self.hotel.id])), NO_PLACES)
+
+    def test_debits_and_requests_point_to_their_reservations(self):
+        for user in self.users[:3]:
+            enqueue(user, self.package, at(self.day), at(self.day + timedelta(days=1)), price=100)
+        # Jak w MySQL: bulk_create nie zwraca kluczy głównych
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            self.assertEqual(drain(self.package.pk), (2, 1))
+
+        for request in AdmissionRequest.objects.filter(status=AdmissionRequest.BOOKED):
+            self.assertEqual((request.reservation.user_id, request.reservation.option_id), (request.user_id, self.package.pk))
+            debit = PointsTransaction.objects.get(reservation=request.reservation)
+            self.assertEqual((debit.user_id, debit.amount), (request.user_id, -100))
+        self.assertIsNone(AdmissionRequest.objects.get(status=AdmissionRequest.REJECTED).reservation)
+        self.assertFalse(PointsTransaction.objects.filter(reservation__isnull=True).exists())
+
+        client = Client()
+        client.force_login(self.users[0])
+        request = AdmissionRequest.objects.get(user=self.users[0])
+        response = client.get(reverse('admission_status', args=[request.pk]))
+        self.assertEqual(response.json()['reservation'], request.reservation_id)
+
+    def test_one_queued_request_per_user_and_position(self):
+        first, created = enqueue(self.users[0], self.package, at(self.day), at(self.day + timedelta(days=1)))
+        self.assertTrue(created)
+        self.assertFalse(enqueue(self.users[0], self.package, at(self.day), at(self.day + timedelta(days=1)))[1])
+        second, _ = enqueue(self.users[1], self.package, at(self.day), at(self.day + timedelta(days=1)))
+        self.assertEqual((position(first), position(second)), (1, 2))
+
+    def test_insufficient_funds_and_slots(self):
+        restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        table = ServiceOption.objects.create(service=restaurant, name='Stolik', capacity=2, price=50, flash_sale=True)
+        slot = TimeSlot.objects.get(option=table, start=at(self.day, 12))
+        TimeSlot.objects.filter(pk=slot.pk).update(remaining=2)
+        self.users[0].balance = 10
+        self.users[0].save()
+        for user in self.users[:4]:
+            enqueue(user, table, slot.start, slot.end, slot=slot, price=50)
+
+        self.assertEqual(drain(table.pk), (2, 2))
+        self.assertEqual(
+            dict(AdmissionRequest.objects.values_list('user_id', 'result')),
+            {
+                self.users[0].pk: NO_FUNDS,
+                self.users[1].pk: "Rezerwacja została pomyślnie utworzona!",
+                self.users[2].pk: "Rezerwacja została pomyślnie utworzona!",
+                self.users[3].pk: NO_PLACES,
+            },
+        )
+        slot.refresh_from_db()
+        self.assertEqual(slot.remaining, 0)
+
+    def test_batch_query_count_does_not_grow_with_requests(self):
+        option = ServiceOption.objects.create(
+            service=self.hotel, name='Pakiet rodzinny', capacity=4, price=100, units=50, flash_sale=True,
+        )
+
+        def count(users):
+            for user in users:
+                enqueue(user, option, at(self.day), at(self.day + timedelta(days=1)), price=100)
+            with CaptureQueriesContext(connection) as queries:
+                drain(option.pk, batch_size=20)
+            return len(queries)
+
+        self.assertEqual(count(self.users[:2]), count(self.users[2:12]))
+
+    def test_hold_is_not_placed_for_flash_sale_option(self):
+        client = Client()
+        client.force_login(self.users[0])
+        response = client.post(reverse('place_booking_hold', args=[self.hotel.id]), self.stay())
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("kolejki", response.json()['error'])
@@ -0,0 +1,76 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..autocomplete import PrefixIndex, canonical_location, get_index, suggest, LOCATION, SERVICE
+from ..models import Service
+
+
+class PrefixIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            ('Kraków', LOCATION), ('Łódź', LOCATION), ('Krynica-Zdrój', LOCATION),
+            ('Hotel Wawel', SERVICE), ('Kraków', LOCATION),
+        ])
+
+    def labels(self, prefix, **kwargs):
+        return [suggestion['label'] for suggestion in self.index.lookup(prefix, **kwargs)]
+
+    def test_prefix_ignores_case_and_diacritics(self):
+        self.assertEqual(self.labels('Krakow'), ['Kraków'])
+        self.assertEqual(self.labels('lodz'), ['Łódź'])
+        self.assertEqual(self.labels('KR'), ['Kraków', 'Krynica-Zdrój'])
+
+    def test_matches_start_of_any_word(self):
+        self.assertEqual(self.labels('wawel'), ['Hotel Wawel'])
+        self.assertEqual(self.labels('zdroj'), ['Krynica-Zdrój'])
+
+    def test_whole_label_matches_come_first(self):
+        index = PrefixIndex([('Apartament Hotel', SERVICE), ('Hotel Zakopane', SERVICE)])
+        self.assertEqual([s['label'] for s in index.lookup('hotel')], ['Hotel Zakopane', 'Apartament Hotel'])
+
+    def test_kind_and_limit(self):
+        self.assertEqual(self.labels('k', kind=SERVICE), [])
+        self.assertEqual(self.labels('k', limit=1), ['Kraków'])
+        self.assertEqual(self.labels('  '), [])
+
+    def test_canonical_location(self):
+        cities = ['Kraków', 'Łódź']
+        self.assertEqual(canonical_location('LODZ', cities), 'Łódź')
+        self.assertEqual(canonical_location('Gdańsk', cities), 'Gdańsk')
+
+
+class AutocompleteEndpointTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        Service.objects.create(name='Manufaktura SPA', location='Łódź', type='SPA&WELLNESS')
+        self.client = Client()
+
+    def get(self, **params):
+        return self.client.get(reverse('autocomplete'), params).json()['suggestions']
+
+    def test_returns_locations_and_names(self):
+        self.assertEqual(self.get(q='lodz'), [{'label': 'Łódź', 'kind': 'location'}])
+        self.assertEqual(self.get(q='hotel w'), [{'label': 'Hotel Wawel', 'kind': 'service'}])
+        self.assertEqual(self.get(q='m', kind='location'), [])
+
+    def test_warm_lookup_does_not_query_database(self):
+        get_index()
+        with CaptureQueriesContext(connection) as context:
+            suggest('krak')
+            self.get(q='krak')
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_index_is_rebuilt_on_catalog_change(self):
+        self.assertEqual(self.get(q='gdansk'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(name='Hotel Morski', location='Gdańsk', type='Hotel')
+        self.assertEqual(self.get(q='gdansk'), [{'label': 'Gdańsk', 'kind': 'location'}])
+
+    def test_home_accepts_folded_location(self):
+        response = self.client.get(reverse('home'), {'location': 'krakow'})
+        self.assertContains(response, 'Hotel Wawel')
+        self.assertNotContains(response, 'Manufaktura SPA')
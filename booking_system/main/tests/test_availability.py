@@ -0,0 +1,135 @@
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, Client, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..availability import AvailabilityEngine, bump_availability_version, free_options, get_engine
+from ..models import Reservation, Service, ServiceOption
+
+
+def at(day):
+    return timezone.make_aware(datetime.combine(day, time(14)))
+
+
+class AvailabilityEngineTestCase(SimpleTestCase):
+    def setUp(self):
+        self.today = date(2030, 1, 1)
+        self.engine = AvailabilityEngine(self.today, horizon=60)
+        self.engine.add_option(1, 2, 'Kraków', self.today, self.today + timedelta(days=30))
+        self.engine.add_option(2, 4, 'Kraków', self.today + timedelta(days=10), self.today + timedelta(days=20))
+        self.engine.add_option(3, 4, 'Zakopane', self.today, self.today + timedelta(days=59))
+        self.engine.add_option(4, 2, 'Zakopane', None, None)
+        self.engine.index_options()
+
+    def free(self, first, last, **kwargs):
+        return self.engine.free_options(self.today + timedelta(days=first), self.today + timedelta(days=last), **kwargs)
+
+    def test_window_must_cover_all_nights(self):
+        self.assertEqual(self.free(9, 12), [1, 3])
+        self.assertEqual(self.free(10, 21), [1, 2, 3])
+        self.assertEqual(self.free(10, 22), [1, 3])
+
+    def test_city_and_capacity(self):
+        self.assertEqual(self.free(12, 14, city='Kraków'), [1, 2])
+        self.assertEqual(self.free(12, 14, city='Kraków', min_capacity=3), [2])
+        self.assertEqual(self.free(12, 14, city='Gdańsk'), [])
+
+    def test_overlapping_reservations_are_counted(self):
+        self.engine.apply(10, 1, 'confirmed', self.today + timedelta(days=5), self.today + timedelta(days=8))
+        self.engine.apply(11, 1, 'pending', self.today + timedelta(days=7), self.today + timedelta(days=9))
+        self.assertEqual(self.free(8, 9, city='Kraków'), [])
+        self.assertEqual(self.free(9, 10, city='Kraków'), [1])
+
+        self.engine.apply(11, 1, 'cancelled', self.today + timedelta(days=7), self.today + timedelta(days=9))
+        self.assertEqual(self.free(7, 8, city='Kraków'), [])
+        self.assertEqual(self.free(8, 9, city='Kraków'), [1])
+
+        self.engine.remove_reservation(10)
+        self.assertEqual(self.free(5, 9, city='Kraków'), [1])
+
+    def test_moving_reservation_releases_old_nights(self):
+        self.engine.apply(10, 3, 'confirmed', self.today, self.today + timedelta(days=2))
+        self.engine.apply(10, 3, 'confirmed', self.today + timedelta(days=4), self.today + timedelta(days=5))
+        self.assertEqual(self.free(0, 2, city='Zakopane'), [3])
+        self.assertEqual(self.free(4, 5, city='Zakopane'), [])
+
+    def test_outside_horizon_is_unknown(self):
+        self.assertIsNone(self.free(-1, 2))
+        self.assertIsNone(self.free(50, 61))
+
+
+class AvailabilityIntegrationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='gosc@example.com', first_name='Jan', last_name='Gość', password='haslo123'
+        )
+        today = timezone.localdate()
+        self.check_in = today + timedelta(days=3)
+        self.check_out = today + timedelta(days=5)
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.room = ServiceOption.objects.create(
+            service=self.hotel, name='Pokój', capacity=2, price=100,
+            available_from=today, available_to=today + timedelta(days=30),
+        )
+
+    def reserve(self, **kwargs):
+        values = dict(user=self.user, option=self.room, start_datetime=at(self.check_in),
+                      end_datetime=at(self.check_out), status='confirmed')
+        values.update(kwargs)
+        return Reservation.objects.create(**values)
+
+    def reserve_committed(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.reserve(**kwargs)
+
+    def test_reservation_changes_are_applied_incrementally(self):
+        engine = get_engine()
+        reservation = self.reserve_committed()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(free_options(self.check_in, self.check_out), [])
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertIs(get_engine(), engine)
+
+        reservation.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertEqual(free_options(self.check_in, self.check_out), [self.room.pk])
+
+        self.reserve_committed(start_datetime=at(self.check_out), end_datetime=at(self.check_out + timedelta(days=1)))
+        self.assertEqual(free_options(self.check_in, self.check_out), [self.room.pk])
+        self.assertIs(get_engine(), engine)
+
+    def test_rolled_back_change_is_not_applied(self):
+        engine = get_engine()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.reserve()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(free_options(self.check_in, self.check_out), [self.room.pk])
+        self.assertIs(get_engine(), engine)
+
+    def test_external_change_rebuilds_engine(self):
+        engine = get_engine()
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, option=self.room, service=self.hotel, status='pending',
+                        start_datetime=at(self.check_in), end_datetime=at(self.check_out)),
+        ])
+        bump_availability_version()
+        self.assertEqual(free_options(self.check_in, self.check_out), [])
+        self.assertIsNot(get_engine(), engine)
+
+    def test_home_date_filter_skips_booked_options(self):
+        query = {'check_in': self.check_in.isoformat(), 'check_out': self.check_out.isoformat()}
+        self.assertContains(Client().get(reverse('home'), query), 'Hotel Wawel')
+        self.reserve_committed()
+        self.assertNotContains(Client().get(reverse('home'), query), 'Hotel Wawel')
+        self.assertNotContains(Client().get(reverse('home'), dict(query, guests=3)), 'Hotel Wawel')
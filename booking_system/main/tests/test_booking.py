@@ -0,0 +1,135 @@
+import threading
+from datetime import datetime, time, timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, Client, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from ..booking import BookingError, book_option
+from ..models import Reservation, Service, ServiceOption, User
+
+
+def at(days, hour=14):
+    return timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=days), time(hour)))
+
+
+def create_user(email, balance=1000):
+    return User.objects.create_user(
+        email=email, first_name='Jan', last_name='Kowalski', password='haslo123', balance=balance,
+    )
+
+
+class BookOptionTestCase(TestCase):
+    def setUp(self):
+        self.user = create_user('jan@example.com')
+        self.hotel = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        self.room = ServiceOption.objects.create(service=self.hotel, name='Pokój', capacity=2, price=100, units=2)
+
+    def test_rejects_when_all_units_are_taken(self):
+        book_option(self.user, self.room, at(1), at(3), 100)
+        book_option(self.user, self.room, at(2), at(4), 100)
+        with self.assertRaisesMessage(BookingError, "zarezerwowana"):
+            book_option(self.user, self.room, at(2), at(3), 100)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_adjacent_and_cancelled_reservations_do_not_block(self):
+        self.room.units = 1
+        self.room.save()
+        first = book_option(self.user, self.room, at(1), at(3), 100)
+        book_option(self.user, self.room, at(3), at(5), 100)
+        first.status = 'cancelled'
+        first.save()
+        book_option(self.user, self.room, at(1), at(3), 100)
+
+    def test_point_reservations_block_for_default_duration(self):
+        restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        table = ServiceOption.objects.create(service=restaurant, name='Stolik', capacity=4, price=50)
+        book_option(self.user, table, at(1, 18), price=50)
+        with self.assertRaises(BookingError):
+            book_option(self.user, table, at(1, 19), price=50)
+        book_option(self.user, table, at(1, 20), price=50)
+
+    def test_balance_is_debited_once(self):
+        reservation = book_option(self.user, self.room, at(1), at(2), 300)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 700)
+        self.assertEqual(reservation.service, self.hotel)
+        self.assertEqual(reservation.status, 'pending')
+
+    def test_insufficient_balance_creates_nothing(self):
+        with self.assertRaisesMessage(BookingError, "Nie masz wystarczających środków na koncie."):
+            book_option(self.user, self.room, at(1), at(2), 5000)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_rejects_dates_outside_option_window(self):
+        self.room.available_from = timezone.localdate() + timedelta(days=2)
+        self.room.available_to = timezone.localdate() + timedelta(days=4)
+        self.room.save()
+        with self.assertRaisesMessage(BookingError, "nie jest dostępna w wybranym terminie"):
+            book_option(self.user, self.room, at(1), at(3), 100)
+        with self.assertRaisesMessage(BookingError, "nie jest dostępna w wybranym terminie"):
+            book_option(self.user, self.room, at(4), at(6), 100)
+        with self.assertRaisesMessage(BookingError, "w przeszłości"):
+            book_option(self.user, self.room, at(-1), at(3), 100)
+        # Dzień wyjazdu nie jest nocą pobytu
+        book_option(self.user, self.room, at(2), at(5), 100)
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 900)
+
+    def test_option_row_is_locked_before_counting(self):
+        # Na sqlite FOR UPDATE nie trafia do SQL, więc sprawdzane jest samo żądanie blokady
+        with patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=QuerySet.select_for_update) as lock:
+            book_option(self.user, self.room, at(1), at(3), 100)
+        self.assertEqual([call.args[0].model for call in lock.call_args_list], [ServiceOption])
+
+    def test_view_reports_conflict(self):
+        self.room.units = 1
+        self.room.save()
+        book_option(create_user('anna@example.com'), self.room, at(1), at(3), 100)
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(reverse('make_reservation', args=[self.hotel.id]), {
+            'option': self.room.id,
+            'start_date': at(2).strftime('%Y-%m-%d'),
+            'end_date': at(4).strftime('%Y-%m-%d'),
+        }, follow=True)
+        self.assertContains(response, "Wybrana opcja jest już zarezerwowana w tym terminie.")
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 0)
+
+
+class ConcurrentBookingTestCase(TransactionTestCase):
+    THREADS = 8
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_no_overbooking_under_contention(self):
+        hotel = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        room = ServiceOption.objects.create(service=hotel, name='Pokój', capacity=2, price=100, units=3)
+        users = [create_user(f'gosc{i}@example.com') for i in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+
+        def worker(user):
+            try:
+                barrier.wait()
+                book_option(user, room, at(1), at(3), 100)
+                outcomes.append('ok')
+            except BookingError:
+                outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('ok'), room.units)
+        self.assertEqual(outcomes.count('rejected'), self.THREADS - room.units)
+        self.assertEqual(Reservation.objects.overlapping(room.pk, at(1), at(3)).count(), room.units)
+        debited = User.objects.filter(balance=900).count()
+        self.assertEqual(debited, room.units)
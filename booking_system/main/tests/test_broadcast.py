@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ..broadcast import broadcast, broadcast_to, create_messages, recipients, target_reservations
+from ..models import Message, Reservation, Service, ServiceOption, User
+
+
+class BroadcastTestCase(TestCase):
+    def setUp(self):
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.spa = Service.objects.create(name='SPA Bałtyk', location='Gdańsk', type='SPA&WELLNESS')
+        self.room = ServiceOption.objects.create(service=self.hotel, name='Pokój', capacity=2, price=100)
+        self.massage = ServiceOption.objects.create(service=self.spa, name='Masaż', capacity=1, price=80)
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', first_name='Jan', last_name='Kowalski',
+                password='haslo123', is_active=True,
+            )
+            for number in range(6)
+        ]
+
+    def reserve(self, user, option, days, status='confirmed'):
+        start = timezone.now() + timedelta(days=days)
+        return Reservation.objects.create(
+            user=user, option=option, start_datetime=start, end_datetime=start + timedelta(days=1), status=status,
+        )
+
+    def test_keys_are_read_back_by_batch_without_returning(self):
+        # Jak w MySQL: bulk_create nie zwraca kluczy, a w tej samej chwili powstaje inna wiadomość adresata
+        Message.objects.create(user=self.users[0], subject='Inna', content='Treść', sender='admin')
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            messages = create_messages([
+                Message(user=user, subject='Ogłoszenie', content='Treść', sender='admin') for user in self.users[:3]
+            ])
+        self.assertEqual(
+            [(message.pk, message.user_id) for message in messages],
+            list(Message.objects.filter(subject='Ogłoszenie').order_by('user_id').values_list('pk', 'user_id')),
+        )
+
+    def test_single_admin_message_links_first_reservation(self):
+        first = self.reserve(self.users[0], self.room, 5)
+        self.reserve(self.users[0], self.massage, 1)
+        with self.assertNumQueries(3):
+            message = Message.objects.create(user=self.users[0], subject='Temat', content='Treść', sender='admin')
+        self.assertEqual(list(message.reservations.all()), [first])
+
+        message.is_read = True
+        with self.assertNumQueries(1):
+            message.save()
+        self.assertEqual(message.reservations.count(), 1)
+
+    def test_broadcast_to_service_targets_upcoming_reservations(self):
+        upcoming = [self.reserve(user, self.room, 3) for user in self.users[:3]]
+        self.reserve(self.users[3], self.room, -3)
+        self.reserve(self.users[4], self.room, 3, status='cancelled')
+        self.reserve(self.users[5], self.massage, 3)
+        # Wcześniejsza rezerwacja w innej usłudze nie jest wiązana z wiadomością o hotelu
+        self.reserve(self.users[0], self.massage, -10)
+
+        sent = broadcast_to('Remont basenu', 'Basen będzie nieczynny.', service=self.hotel, batch_size=2)
+
+        self.assertEqual(sent, 3)
+        links = Reservation.messages.through.objects.values_list('reservation_id', flat=True)
+        self.assertEqual(sorted(links), [reservation.pk for reservation in upcoming])
+        self.assertEqual(set(Message.objects.values_list('user_id', flat=True)), {user.pk for user in self.users[:3]})
+
+    def test_broadcast_to_city(self):
+        self.reserve(self.users[0], self.room, -30)
+        self.reserve(self.users[1], self.massage, 3)
+        self.assertEqual(list(recipients(target_reservations(city='kraków'))), [self.users[0]])
+
+    def test_queries_do_not_grow_with_recipients(self):
+        for user in self.users:
+            self.reserve(user, self.room, 3)
+        # Na paczkę: odczyt identyfikatorów, INSERT wiadomości, pierwsze rezerwacje, INSERT powiązań
+        # (plus SAVEPOINT/RELEASE transakcji) i końcowy pusty odczyt identyfikatorów
+        with self.assertNumQueries(7):
+            self.assertEqual(broadcast(User.objects.all(), 'Temat', 'Treść'), 6)
+        self.assertEqual(Reservation.messages.through.objects.count(), 6)
+
+    def test_admin_broadcast_view(self):
+        self.reserve(self.users[0], self.room, 3)
+        admin = User.objects.create_superuser(
+            email='admin@example.com', first_name='Admin', last_name='User', password='adminpass',
+        )
+        client = Client()
+        client.force_login(admin)
+        url = reverse('admin:message-broadcast')
+
+        response = client.post(url, {'subject': 'Temat', 'content': 'Treść'})
+        self.assertContains(response, "Wybierz usługę lub podaj miasto.")
+
+        response = client.post(url, {'subject': 'Temat', 'content': 'Treść', 'service': self.hotel.pk})
+        self.assertRedirects(response, reverse('admin:main_message_changelist'))
+        self.assertEqual(Message.objects.get().user, self.users[0])
@@ -0,0 +1,72 @@
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from ..caching import get_or_compute, get_cache_stats, reset_cache_stats, acquire_lock
+
+
+class Counter:
+    def __init__(self, value='value'):
+        self.calls = 0
+        self.value = value
+
+    def __call__(self):
+        self.calls += 1
+        return f'{self.value}-{self.calls}'
+
+
+class GetOrComputeTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+
+    def test_miss_then_hit(self):
+        compute = Counter()
+        self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-1')
+        self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-1')
+        self.assertEqual(compute.calls, 1)
+        stats = get_cache_stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+
+    def test_expired_entry_is_served_stale_while_another_process_recomputes(self):
+        compute = Counter()
+        get_or_compute('key', compute, timeout=60)
+        acquire_lock('key', 1000)
+        with patch('main.caching.time.time', return_value=time.time() + 61):
+            self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-1')
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual(get_cache_stats()['stale_served'], 1)
+
+    def test_expired_entry_is_recomputed_by_lock_holder(self):
+        compute = Counter()
+        get_or_compute('key', compute, timeout=60)
+        with patch('main.caching.time.time', return_value=time.time() + 61):
+            self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-2')
+        self.assertEqual(get_cache_stats()['refreshes'], 1)
+        self.assertEqual(cache.get('lock:key'), None)
+
+    def test_early_refresh_before_expiry(self):
+        compute = Counter()
+        get_or_compute('key', compute, timeout=60)
+        cache.set('key', dict(cache.get('key'), delta=1000.0), 120)
+        with patch('main.caching.random.random', return_value=0.999):
+            self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-2')
+
+    def test_single_flight_waits_for_other_process(self):
+        compute = Counter()
+        acquire_lock('key', 10)
+
+        def other_process_finishes(seconds):
+            cache.set('key', {'value': 'other', 'expires_at': time.time() + 60, 'delta': 0.1}, 120)
+
+        with patch('main.caching.time.sleep', side_effect=other_process_finishes):
+            self.assertEqual(get_or_compute('key', compute, timeout=60), 'other')
+        self.assertEqual(compute.calls, 0)
+
+    def test_computes_itself_when_lock_holder_gives_up(self):
+        compute = Counter()
+        acquire_lock('key', 10)
+        with patch('main.caching.time.sleep', side_effect=lambda seconds: cache.delete('lock:key')):
+            self.assertEqual(get_or_compute('key', compute, timeout=60), 'value-1')
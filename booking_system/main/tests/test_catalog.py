@@ -0,0 +1,156 @@
+import warnings
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..catalog import get_facets, get_type_options, get_catalog_version
+from ..models import Service, ServiceOption, ServiceStatus, User
+
+
+@override_settings(CATALOG_PRICE_BUCKETS=(100, 500))
+class CatalogFacetsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hotel = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        ServiceOption.objects.create(service=self.hotel, name='Pokój', capacity=2, price=80)
+        self.spa = Service.objects.create(name='Spa', location='Zakopane', type='SPA&WELLNESS')
+        ServiceOption.objects.create(service=self.spa, name='Masaż', capacity=1, price=300)
+        Service.objects.create(name='Hostel', location='Kraków', type='Hotel')
+
+    def test_facets_content(self):
+        facets = get_facets()
+        self.assertEqual(facets['cities'], ['Kraków', 'Zakopane'])
+        counts = {facet['value']: facet['count'] for facet in facets['types']}
+        self.assertEqual(counts, {'Hotel': 2, 'Restauracja': 0, 'SPA&WELLNESS': 1, 'Wycieczka': 0})
+        self.assertEqual([bucket['count'] for bucket in facets['price_buckets']], [1, 1, 0])
+
+    def test_facets_are_computed_in_one_aggregate_query(self):
+        # Jedno zapytanie agregujące i jedno o status serwisu
+        with self.assertNumQueries(2):
+            get_facets()
+        with self.assertNumQueries(0):
+            get_facets()
+
+    def test_type_options_are_cached(self):
+        self.assertEqual([option['name'] for option in get_type_options('Hotel')], ['Pokój'])
+        with self.assertNumQueries(0):
+            get_type_options('Hotel')
+
+    def test_service_save_and_delete_invalidate(self):
+        get_facets()
+        with self.captureOnCommitCallbacks(execute=True):
+            service = Service.objects.create(name='Pensjonat', location='Gdańsk', type='Hotel')
+        self.assertIn('Gdańsk', get_facets()['cities'])
+        with self.captureOnCommitCallbacks(execute=True):
+            service.delete()
+        self.assertNotIn('Gdańsk', get_facets()['cities'])
+
+    def test_option_changes_invalidate(self):
+        get_type_options('Hotel')
+        with self.captureOnCommitCallbacks(execute=True):
+            option = ServiceOption.objects.create(service=self.hotel, name='Apartament', capacity=4, price=700)
+        self.assertIn('Apartament', [o['name'] for o in get_type_options('Hotel')])
+        self.assertEqual(get_facets()['price_buckets'][0]['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceOption.objects.filter(pk=option.pk).update(name='Suite')
+        self.assertIn('Suite', [o['name'] for o in get_type_options('Hotel')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            option.delete()
+        self.assertNotIn('Suite', [o['name'] for o in get_type_options('Hotel')])
+
+    def test_bulk_price_change_invalidates_buckets(self):
+        get_facets()
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceOption.objects.filter(service=self.hotel).update(price=Decimal('450'))
+        self.assertEqual([bucket['count'] for bucket in get_facets()['price_buckets']], [0, 2, 0])
+
+    def test_service_status_invalidates(self):
+        self.assertIsNone(get_facets()['service_status'])
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            status = ServiceStatus.objects.create(status='maintenance', message='Prace')
+        self.assertGreater(get_catalog_version(), version)
+        self.assertEqual(get_facets()['service_status'], status)
+
+    def test_rolled_back_change_keeps_version(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Service.objects.create(name='Pensjonat', location='Gdańsk', type='Hotel')
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(get_catalog_version(), version)
+
+
+class HomeFacetsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=80)
+
+    def test_warm_home_page_makes_no_catalog_queries(self):
+        self.client.get(reverse('home'), {'type': 'Hotel'})
+        # Fasety i siatka usług pochodzą z cache
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'), {'type': 'Hotel'})
+        self.assertEqual(response.context['cities'], ['Kraków'])
+        self.assertEqual(len(response.context['options']), 1)
+        self.assertContains(response, 'Hotel')
+
+    def test_grid_key_is_canonical(self):
+        self.client.get(reverse('home') + '?price=500&type=Hotel&location=')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home') + '?type=Hotel&price=500.0&sort=price')
+
+    def test_grid_key_is_safe_for_any_user_text(self):
+        # Spacje, znaki sterujące i długość ponad 250 znaków są niedozwolone w kluczach memcached
+        location = 'Nowy Sącz \n ' + 'ą' * 300
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.client.get(reverse('home'), {'location': location})
+            with self.assertNumQueries(0):
+                self.client.get(reverse('home'), {'location': location})
+
+    def test_grid_is_invalidated_by_catalog_change(self):
+        self.client.get(reverse('home'))
+        self.option.price = 55
+        with self.captureOnCommitCallbacks(execute=True):
+            self.option.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, '55,00 punktów')
+
+    def test_user_header_is_not_cached_with_grid(self):
+        user = User.objects.create_user(email='user@example.com', first_name='Jan', last_name='Nowak', password='x')
+        self.client.force_login(user)
+        self.assertContains(self.client.get(reverse('home')), 'Wyloguj')
+        self.client.logout()
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, 'Wyloguj')
+        self.assertContains(response, 'Logowanie')
+        self.assertContains(response, 'Hotel')
+
+
+class ServiceDetailCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=80)
+
+    def test_warm_detail_only_queries_reviews(self):
+        url = reverse('service_detail', args=[self.service.id])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'Pokój')
+
+    def test_missing_service_returns_404(self):
+        response = self.client.get(reverse('service_detail', args=[self.service.id + 100]))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime, time, timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..booking import BookingError, book_group
+from ..models import PointsTransaction, Reservation, Service, ServiceOption, TimeSlot, User
+
+
+def at(day, hour=0):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@override_settings(SLOT_SCHEDULE={'Restauracja': ('12:00', '16:00', 120)}, SLOT_HORIZON_DAYS=2, BOOKING_GROUP_MAX_LINES=30)
+class GroupBookingTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.rooms = [
+            ServiceOption.objects.create(
+                service=self.hotel, name=f'Pokój {number}', capacity=2, price=100,
+                available_from=self.day, available_to=self.day + timedelta(days=10),
+            )
+            for number in range(20)
+        ]
+        self.restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        self.table = ServiceOption.objects.create(service=self.restaurant, name='Stolik', capacity=3, units=3, price=50)
+        self.user = User.objects.create_user(
+            email='biuro@example.com', first_name='Biuro', last_name='Podróży', password='haslo123', balance=10000,
+        )
+
+    def stay(self, option):
+        return option.pk, at(self.day), at(self.day + timedelta(days=2))
+
+    def test_books_all_lines_and_debits_once(self):
+        reservations = book_group(self.user, [self.stay(room) for room in self.rooms])
+
+        self.assertEqual(len(reservations), 20)
+        self.assertEqual(Reservation.objects.filter(user=self.user, service=self.hotel).count(), 20)
+        self.assertEqual(Reservation.objects.first().service_name, 'Hotel Wawel')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10000 - 20 * 200)
+        self.assertEqual(PointsTransaction.objects.filter(user=self.user, reason=PointsTransaction.RESERVATION).count(), 1)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        def count(rooms):
+            with CaptureQueriesContext(connection) as queries:
+                book_group(self.user, [self.stay(room) for room in rooms])
+            return len(queries)
+
+        self.assertEqual(count(self.rooms[:2]), count(self.rooms[2:20]))
+
+    def test_conflicting_line_rolls_back_everything(self):
+        book_group(self.user, [self.stay(self.rooms[5])])
+        balance = User.objects.get(pk=self.user.pk).balance
+
+        with self.assertRaises(BookingError):
+            book_group(self.user, [self.stay(room) for room in self.rooms[:10]])
+
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, balance)
+
+    def test_lines_in_same_group_compete_for_units(self):
+        with self.assertRaises(BookingError):
+            book_group(self.user, [self.stay(self.rooms[0]), self.stay(self.rooms[0])])
+
+    def test_slot_lines_take_places_in_one_update(self):
+        start = at(self.day, 12)
+        book_group(self.user, [(self.table.pk, start, None)] * 3)
+        self.assertEqual(TimeSlot.objects.get(option=self.table, start=start).remaining, 0)
+
+        with self.assertRaises(BookingError):
+            book_group(self.user, [(self.table.pk, start, None)])
+
+    def test_line_limit(self):
+        with self.assertRaises(BookingError):
+            book_group(self.user, [self.stay(self.rooms[0])] * 31)
+
+    def test_insufficient_balance(self):
+        self.user.balance = 300
+        self.user.save()
+        with self.assertRaises(BookingError):
+            book_group(self.user, [self.stay(room) for room in self.rooms[:2]])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_keys_are_read_back_without_returning(self):
+        # Jak w MySQL: bulk_create nie zwraca kluczy głównych
+        lines = [self.stay(room) for room in self.rooms[:2]] + [(self.table.pk, at(self.day, 12), None)] * 2
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            reservations = book_group(self.user, lines)
+        self.assertEqual(
+            sorted(reservation.pk for reservation in reservations),
+            sorted(Reservation.objects.values_list('pk', flat=True)),
+        )
+        for reservation in reservations:
+            self.assertEqual(Reservation.objects.get(pk=reservation.pk).option_id, reservation.option_id)
+
+    def test_endpoint_is_idempotent(self):
+        client = Client()
+        client.force_login(self.user)
+        body = json.dumps({'lines': [
+            {'option': room.pk, 'start': f'{self.day:%Y-%m-%d}', 'end': f'{self.day + timedelta(days=2):%Y-%m-%d}'}
+            for room in self.rooms[:3]
+        ]})
+
+        url = reverse('book_group')
+        response = client.post(url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='grupa-1')
+        self.assertEqual(response.status_code, 201)
+        ids = response.json()['reservations']
+        self.assertEqual(sorted(ids), sorted(Reservation.objects.values_list('pk', flat=True)))
+
+        # Powtórzenie zwraca te same rezerwacje zamiast pustej listy
+        response = client.post(url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='grupa-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['reservations'], ids)
+        self.assertEqual(Reservation.objects.count(), 3)
+
+        response = client.post(url, '{"lines": [{"option": "x"}]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,156 @@
+from datetime import datetime, time, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..availability import free_options
+from ..booking import BookingError, book_option, place_hold
+from ..holds import hold_metrics
+from ..models import BookingHold, Reservation, Service, ServiceOption, TimeSlot, User
+
+
+def at(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@override_settings(SLOT_SCHEDULE={'Restauracja': ('12:00', '16:00', 120)}, SLOT_HORIZON_DAYS=2, HOLD_MINUTES=10)
+class BookingHoldTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.room = ServiceOption.objects.create(
+            service=self.hotel, name='Pokój', capacity=2, price=100,
+            available_from=self.day, available_to=self.day + timedelta(days=10),
+        )
+        self.restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        self.table = ServiceOption.objects.create(service=self.restaurant, name='Stolik', capacity=1, price=50)
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123', balance=1000,
+        )
+        self.other = User.objects.create_user(
+            email='anna@example.com', first_name='Anna', last_name='Nowak', password='haslo123', balance=1000,
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def stay(self):
+        return at(self.day, 0), at(self.day + timedelta(days=2), 0)
+
+    def test_hold_blocks_other_users(self):
+        start, end = self.stay()
+        place_hold(self.user, self.room, start, end)
+
+        with self.assertRaises(BookingError):
+            book_option(self.other, self.room, start, end, price=200)
+        with self.assertRaises(BookingError):
+            place_hold(self.other, self.room, start, end)
+        self.assertEqual(free_options(self.day, self.day + timedelta(days=1), 'Kraków'), [])
+
+    def test_hold_is_converted_into_reservation(self):
+        start, end = self.stay()
+        hold = place_hold(self.user, self.room, start, end)
+
+        reservation = book_option(self.user, self.room, start, end, price=200, hold=hold)
+
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, BookingHold.CONVERTED)
+        self.assertEqual(hold.reservation, reservation)
+        self.assertEqual(Reservation.objects.overlapping(self.room.pk, start, end).count(), 1)
+
+    def test_new_hold_releases_previous_one(self):
+        start, end = self.stay()
+        first = place_hold(self.user, self.room, start, end)
+        second = place_hold(self.user, self.room, start + timedelta(days=3), end + timedelta(days=3))
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, BookingHold.RELEASED)
+        self.assertEqual(second.status, BookingHold.ACTIVE)
+        book_option(self.other, self.room, start, end, price=200)
+
+    def test_slot_hold_takes_a_place_until_expired(self):
+        slot = TimeSlot.objects.get(option=self.table, start=at(self.day, 12))
+        hold = place_hold(self.user, self.table, slot.start, slot=slot)
+        slot.refresh_from_db()
+        self.assertEqual(slot.remaining, 0)
+
+        BookingHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('expire_holds', stdout=out)
+
+        slot.refresh_from_db()
+        hold.refresh_from_db()
+        self.assertEqual(slot.remaining, 1)
+        self.assertEqual(hold.status, BookingHold.EXPIRED)
+        self.assertIn("Zamknięto 1", out.getvalue())
+
+    def test_expired_hold_falls_back_to_normal_booking(self):
+        start, end = self.stay()
+        hold = place_hold(self.user, self.room, start, end)
+        BookingHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        reservation = book_option(self.user, self.room, start, end, price=200, hold=hold)
+
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, BookingHold.ACTIVE)
+        self.assertIsNone(hold.reservation)
+        self.assertEqual(reservation.status, 'pending')
+
+    def test_hold_endpoint_and_reservation_form(self):
+        form = {
+            'option': self.room.id,
+            'start_date': f'{self.day:%Y-%m-%d}',
+            'end_date': f'{self.day + timedelta(days=2):%Y-%m-%d}',
+        }
+        response = self.client.post(reverse('place_booking_hold', args=[self.hotel.id]), form)
+        self.assertEqual(response.status_code, 201)
+        hold_id = response.json()['hold_id']
+
+        other = Client()
+        other.force_login(self.other)
+        response = other.post(reverse('place_booking_hold', args=[self.hotel.id]), form)
+        self.assertEqual(response.status_code, 409)
+
+        self.client.post(reverse('make_reservation', args=[self.hotel.id]), dict(form, hold=hold_id))
+        self.assertEqual(BookingHold.objects.get(pk=hold_id).status, BookingHold.CONVERTED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 800)
+
+    def test_hold_for_other_stay_is_not_used_by_form(self):
+        start = at(self.day, 0)
+        hold = place_hold(self.user, self.room, start, start + timedelta(days=10))
+        self.user.balance = 5000
+        self.user.save()
+        self.client.post(reverse('make_reservation', args=[self.hotel.id]), {
+            'option': self.room.id,
+            'start_date': f'{self.day:%Y-%m-%d}',
+            'end_date': f'{self.day + timedelta(days=1):%Y-%m-%d}',
+            'hold': hold.pk,
+        })
+        reservation = Reservation.objects.get(user=self.user)
+        self.assertEqual(reservation.end_datetime, start + timedelta(days=1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 4900)
+
+    def test_claimed_hold_is_priced_for_its_own_stay(self):
+        start = at(self.day, 0)
+        hold = place_hold(self.user, self.room, start, start + timedelta(days=3))
+        reservation = book_option(self.user, self.room, start, start + timedelta(days=1), price=100, hold=hold)
+        self.assertEqual(reservation.end_datetime, start + timedelta(days=3))
+        self.assertEqual(reservation.price, 300)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 700)
+
+    def test_metrics(self):
+        start, end = self.stay()
+        hold = place_hold(self.user, self.room, start, end)
+        book_option(self.user, self.room, start, end, price=200, hold=hold)
+        place_hold(self.other, self.room, start + timedelta(days=3), end + timedelta(days=3))
+
+        metrics = hold_metrics()
+        self.assertEqual(metrics['placed'], 2)
+        self.assertEqual(metrics['active'], 1)
+        self.assertEqual(metrics['converted'], 1)
+        self.assertEqual(metrics['conversion_rate'], 100.0)
@@ -0,0 +1,144 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib import messages
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..idempotency import run_once
+from ..models import IdempotencyKey, Reservation, Service, ServiceOption, User
+
+
+class ReservationIdempotencyTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123', balance=1000,
+        )
+        self.service = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=100, units=5)
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.url = reverse('make_reservation', args=[self.service.id])
+        self.data = {
+            'option': self.option.id,
+            'start_date': (timezone.localdate() + timedelta(days=1)).isoformat(),
+            'end_date': (timezone.localdate() + timedelta(days=2)).isoformat(),
+        }
+
+    def post(self, data=None, **headers):
+        response = self.client.post(self.url, data or self.data, follow=True, headers=headers)
+        return [str(message) for message in response.context['messages']]
+
+    def assertBooked(self, reservations, balance):
+        self.assertEqual(Reservation.objects.count(), reservations)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, balance)
+
+    def test_resubmitted_form_books_once(self):
+        data = dict(self.data, idempotency_key='abc123')
+        self.assertEqual(self.post(data), ["Rezerwacja została pomyślnie utworzona!"])
+        self.assertEqual(self.post(data), ["Rezerwacja została pomyślnie utworzona!"])
+        self.assertBooked(1, 900)
+
+    def test_header_key_and_new_key_books_again(self):
+        self.post(**{'Idempotency-Key': 'k1'})
+        self.post(**{'Idempotency-Key': 'k1'})
+        self.post(**{'Idempotency-Key': 'k2'})
+        self.assertBooked(2, 800)
+
+    def test_error_outcome_is_replayed(self):
+        data = dict(self.data, idempotency_key='abc', end_date=self.data['start_date'])
+        first = self.post(data)
+        self.assertEqual(first, ["Data zakończenia musi być późniejsza niż data rozpoczęcia."])
+        self.assertEqual(self.post(data), first)
+        self.assertBooked(0, 1000)
+
+    def test_same_key_with_other_data_is_rejected(self):
+        self.post(dict(self.data, idempotency_key='abc'))
+        other = dict(self.data, idempotency_key='abc', end_date=(timezone.localdate() + timedelta(days=3)).isoformat())
+        self.assertIn("innymi danymi", self.post(other)[0])
+        self.assertBooked(1, 900)
+
+    def test_expired_key_can_be_reused(self):
+        data = dict(self.data, idempotency_key='abc')
+        self.post(data)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.post(data)
+        self.assertBooked(2, 800)
+
+    def test_failed_attempt_releases_key(self):
+        with patch('main.views.book_option', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.url, dict(self.data, idempotency_key='abc'))
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.post(dict(self.data, idempotency_key='abc'))
+        self.assertBooked(1, 900)
+
+    def test_service_detail_renders_fresh_key(self):
+        first = self.client.get(reverse('service_detail', args=[self.service.id])).context['idempotency_key']
+        second = self.client.get(reverse('service_detail', args=[self.service.id])).context['idempotency_key']
+        self.assertNotEqual(first, second)
+
+
+class RunOnceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+        )
+        self.record = IdempotencyKey.objects.create(
+            user=self.user, key='abc', fingerprint='f', expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+    def fail(self):
+        raise AssertionError("akcja nie powinna zostać wykonana")
+
+    def test_duplicate_waits_for_first_attempt(self):
+        def finish_first_attempt(seconds):
+            IdempotencyKey.objects.filter(pk=self.record.pk).update(
+                status=IdempotencyKey.COMPLETED, response_level=messages.SUCCESS, response_message="Gotowe",
+            )
+
+        with patch('main.idempotency.time.sleep', side_effect=finish_first_attempt) as sleep:
+            self.assertEqual(run_once(self.user, 'abc', 'f', self.fail), (messages.SUCCESS, "Gotowe"))
+        sleep.assert_called_once()
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.2)
+    def test_duplicate_gives_up_after_timeout(self):
+        level, text = run_once(self.user, 'abc', 'f', self.fail)
+        self.assertEqual(level, messages.ERROR)
+        self.assertIn("wciąż przetwarzane", text)
+
+    def test_claim_is_retried_when_conflicting_key_disappears(self):
+        # Równoległe żądanie założyło klucz i usunęło go (błąd albo czyszczenie) przed odczytem
+        create = IdempotencyKey.objects.create
+        attempts = []
+
+        def racing_create(**fields):
+            attempts.append(fields['key'])
+            if len(attempts) == 1:
+                raise IntegrityError("duplicate key")
+            return create(**fields)
+
+        with patch.object(IdempotencyKey.objects, 'create', side_effect=racing_create):
+            result = run_once(self.user, 'new', 'f', lambda: (messages.SUCCESS, "Gotowe"))
+        self.assertEqual(result, (messages.SUCCESS, "Gotowe"))
+        self.assertEqual(attempts, ['new', 'new'])
+        self.assertEqual(IdempotencyKey.objects.get(key='new').status, IdempotencyKey.COMPLETED)
+
+    def test_claim_gives_up_after_bounded_retries(self):
+        with patch.object(IdempotencyKey.objects, 'create', side_effect=IntegrityError("duplicate key")) as create:
+            level, text = run_once(self.user, 'new', 'f', self.fail)
+        self.assertEqual(level, messages.ERROR)
+        self.assertIn("wciąż przetwarzane", text)
+        self.assertEqual(create.call_count, 3)
+
+    def test_purge_command_removes_expired_keys(self):
+        IdempotencyKey.objects.create(
+            user=self.user, key='old', fingerprint='f', expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        call_command('purge_idempotency_keys', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['abc'])
@@ -1,6 +1,11 @@
+import os
 import unittest
 from datetime import date, timedelta, datetime
+from decimal import Decimal
+from io import StringIO
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase
 from django.utils import timezone
 from django.utils.timezone import make_aware, now
 from ..models import UserManager, User, Service, ServiceOption, Reservation, Review, Message, ServiceStatus
@@ -178,6 +183,63 @@ class ServiceMinPriceTestCase(unittest.TestCase):
         self.assertEqual(self.service.get_min_price(), 0)
 
 
+class ServiceOptionStatsTestCase(TestCase):
+    def setUp(self):
+        self.service = Service.objects.create(name='Hotel Service', location='Test Location', type='Hotel')
+        self.other_service = Service.objects.create(name='Other Service', location='Test Location', type='Hotel')
+
+    def assertStats(self, service, min_price, max_price, max_capacity, option_count):
+        service.refresh_from_db()
+        self.assertEqual(service.min_price, min_price)
+        self.assertEqual(service.max_price, max_price)
+        self.assertEqual(service.max_capacity, max_capacity)
+        self.assertEqual(service.option_count, option_count)
+
+    def test_stats_follow_create_edit_delete(self):
+        option = ServiceOption.objects.create(service=self.service, name='A', capacity=2, price=100)
+        ServiceOption.objects.create(service=self.service, name='B', capacity=4, price=300)
+        self.assertStats(self.service, Decimal('100.00'), Decimal('300.00'), 4, 2)
+
+        option.price = 50
+        option.save()
+        self.assertStats(self.service, Decimal('50.00'), Decimal('300.00'), 4, 2)
+
+        option.delete()
+        self.assertStats(self.service, Decimal('300.00'), Decimal('300.00'), 4, 1)
+
+    def test_moving_option_refreshes_both_services(self):
+        ServiceOption.objects.create(service=self.service, name='A', capacity=2, price=100)
+        option = ServiceOption.objects.get(name='A')
+        option.service = self.other_service
+        option.save()
+        self.assertStats(self.service, None, None, None, 0)
+        self.assertStats(self.other_service, Decimal('100.00'), Decimal('100.00'), 2, 1)
+
+    def test_stats_follow_bulk_paths(self):
+        ServiceOption.objects.bulk_create([
+            ServiceOption(service=self.service, name='A', capacity=2, price=100),
+            ServiceOption(service=self.service, name='B', capacity=6, price=200),
+        ])
+        self.assertStats(self.service, Decimal('100.00'), Decimal('200.00'), 6, 2)
+
+        ServiceOption.objects.filter(service=self.service).update(price=150)
+        self.assertStats(self.service, Decimal('150.00'), Decimal('150.00'), 6, 2)
+
+        ServiceOption.objects.filter(name='A').update(service=self.other_service)
+        self.assertStats(self.other_service, Decimal('150.00'), Decimal('150.00'), 2, 1)
+
+        ServiceOption.objects.all().delete()
+        self.assertStats(self.service, None, None, None, 0)
+        self.assertStats(self.other_service, None, None, None, 0)
+
+    def test_rebuild_service_stats_command(self):
+        ServiceOption.objects.create(service=self.service, name='A', capacity=3, price=120)
+        Service.objects.update(min_price=None, max_price=None, max_capacity=None, option_count=0)
+        call_command('rebuild_service_stats', batch_size=1, stdout=StringIO())
+        self.assertStats(self.service, Decimal('120.00'), Decimal('120.00'), 3, 1)
+        self.assertStats(self.other_service, None, None, None, 0)
+
+
 class ServiceOptionStrTestCase(unittest.TestCase):
     def setUp(self):
         self.service = Service.objects.create(
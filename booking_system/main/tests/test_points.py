@@ -0,0 +1,121 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import Mock
+
+from django.contrib.admin.sites import AdminSite
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ..admin import CustomUserAdmin
+from ..booking import book_option
+from ..models import PointsTransaction, Reservation, Service, ServiceOption, User
+from ..points import InsufficientPoints, apply_points
+
+
+def ledger_total(user):
+    return PointsTransaction.objects.filter(user=user).aggregate(total=Sum('amount'))['total'] or 0
+
+
+class ApplyPointsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+        )
+
+    def test_stale_instances_do_not_lose_updates(self):
+        other = User.objects.get(pk=self.user.pk)
+        apply_points(self.user, 1000, PointsTransaction.ADMIN_GRANT)
+        apply_points(other, 500, PointsTransaction.REVIEW_REWARD)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1500)
+        self.assertEqual(ledger_total(self.user), 1500)
+
+    def test_decimal_amounts_are_rounded_to_points(self):
+        entry = apply_points(self.user, -Decimal('99.50'), PointsTransaction.RESERVATION)
+        self.assertEqual(entry.amount, -100)
+
+    def test_require_funds_rejects_overdraft(self):
+        apply_points(self.user, 100, PointsTransaction.ADMIN_GRANT)
+        with self.assertRaises(InsufficientPoints):
+            apply_points(self.user, -150, PointsTransaction.RESERVATION, require_funds=True)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100)
+        self.assertEqual(PointsTransaction.objects.count(), 1)
+
+
+class LedgerFlowsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123', is_active=True,
+        )
+        apply_points(self.user, 2000, PointsTransaction.ADMIN_GRANT)
+        self.service = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=300)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def assertBalance(self, expected):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, expected)
+        self.assertEqual(ledger_total(self.user), expected)
+
+    def test_booking_and_refund(self):
+        start = timezone.now() + timedelta(days=1)
+        reservation = book_option(self.user, self.option, start, start + timedelta(days=1), self.option.price)
+        entry = PointsTransaction.objects.get(reason=PointsTransaction.RESERVATION)
+        self.assertEqual((entry.amount, entry.reservation), (-300, reservation))
+        self.assertBalance(1700)
+
+        reservation.status = 'pending cancellation'
+        reservation.save()
+        staff = User.objects.create_user(
+            email='admin@example.com', first_name='A', last_name='B', password='haslo123', is_staff=True,
+        )
+        self.client.force_login(staff)
+        self.client.get(reverse('confirm_reservation_cancellation', args=[reservation.id]))
+        self.assertEqual(PointsTransaction.objects.get(reason=PointsTransaction.REFUND).amount, 150)
+        self.assertBalance(1850)
+
+    def test_review_reward_and_revocation(self):
+        self.client.post(reverse('add_review', args=[self.service.id]), {'comment': 'Super', 'rating': 5})
+        self.assertBalance(3000)
+        review = self.user.review_set.get()
+        self.client.post(reverse('delete_review', args=[review.id]), {'redirect_to': 'my_reviews'})
+        self.assertBalance(2000)
+        self.assertEqual(PointsTransaction.objects.filter(reason=PointsTransaction.REVIEW_REWARD).count(), 2)
+
+    def test_admin_balance_edit_is_recorded(self):
+        user_admin = CustomUserAdmin(User, AdminSite())
+        form = Mock(initial={'balance': 2000})
+        self.user.balance = 2500
+        user_admin.save_model(Mock(user='admin'), self.user, form, change=True)
+        entry = PointsTransaction.objects.latest('pk')
+        self.assertEqual((entry.amount, entry.reason), (500, PointsTransaction.ADMIN_GRANT))
+        self.assertBalance(2500)
+
+
+class ReconcilePointsCommandTestCase(TestCase):
+    def test_reports_and_fixes_mismatches(self):
+        users = [
+            User.objects.create_user(
+                email=f'user{i}@example.com', first_name='Jan', last_name='K', password='haslo123',
+            )
+            for i in range(3)
+        ]
+        apply_points(users[0], 100, PointsTransaction.ADMIN_GRANT)
+        User.objects.filter(pk=users[1].pk).update(balance=700)
+
+        output = StringIO()
+        call_command('reconcile_points', batch_size=2, stdout=output)
+        self.assertIn('user1@example.com: saldo 700, księga 0', output.getvalue())
+        self.assertIn('niezgodnych: 1', output.getvalue())
+
+        call_command('reconcile_points', fix=True, stdout=StringIO())
+        output = StringIO()
+        call_command('reconcile_points', stdout=output)
+        self.assertIn('wszystkie salda zgadzają się', output.getvalue())
+        self.assertEqual(ledger_total(users[1]), 700)
@@ -0,0 +1,91 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ..admin import get_most_popular_service
+from ..models import Reservation, Service, ServiceOption, User
+
+
+class ReservationServiceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+        )
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.spa = Service.objects.create(name='SPA Zdrój', location='Kraków', type='SPA&WELLNESS')
+        self.room = ServiceOption.objects.create(service=self.hotel, name='Pokój', capacity=2, price=100)
+        self.start = timezone.now() + timedelta(days=1)
+
+    def reserve(self, **kwargs):
+        return Reservation(user=self.user, start_datetime=self.start, end_datetime=self.start + timedelta(days=1), **kwargs)
+
+    def test_save_with_loaded_option_runs_no_extra_queries(self):
+        reservation = self.reserve(option=self.room)
+        with self.assertNumQueries(1):
+            reservation.save()
+        self.assertEqual(reservation.service_id, self.hotel.pk)
+        self.assertEqual(reservation.service_name, 'Hotel Wawel')
+
+        loaded = Reservation.objects.get(pk=reservation.pk)
+        loaded.status = 'confirmed'
+        with self.assertNumQueries(1):
+            loaded.save()
+
+    def test_save_with_option_id_fetches_service_once(self):
+        reservation = self.reserve(option_id=self.room.pk)
+        with self.assertNumQueries(2):
+            reservation.save()
+        self.assertEqual(reservation.service_id, self.hotel.pk)
+
+    def test_changing_option_updates_service(self):
+        reservation = self.reserve(option=self.room)
+        reservation.save()
+        massage = ServiceOption.objects.create(service=self.spa, name='Masaż', capacity=1, price=80)
+        reservation = Reservation.objects.get(pk=reservation.pk)
+        reservation.option = ServiceOption.objects.get(pk=massage.pk)
+        reservation.save()
+        self.assertEqual((reservation.service_id, reservation.service_name), (self.spa.pk, 'SPA Zdrój'))
+
+    def test_catalog_changes_are_propagated(self):
+        reservation = self.reserve(option=self.room)
+        reservation.save()
+
+        self.hotel.name = 'Hotel Pod Wawelem'
+        self.hotel.save()
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.service_name, 'Hotel Pod Wawelem')
+
+        self.room.service = self.spa
+        self.room.save()
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.service_id, self.spa.pk)
+
+    def test_backfill_is_chunked_and_resumable(self):
+        for _ in range(5):
+            self.reserve(option=self.room).save()
+        Reservation.objects.update(service=None, service_name='')
+        first, second = Reservation.objects.order_by('pk').values_list('pk', flat=True)[:2]
+
+        out = StringIO()
+        call_command('backfill_reservation_service', '--batch-size', '2', '--after-id', str(second), stdout=out)
+        self.assertEqual(Reservation.objects.filter(service=self.hotel).count(), 3)
+        self.assertIn('Uzupełniono 3', out.getvalue())
+
+        call_command('backfill_reservation_service', stdout=StringIO())
+        self.assertFalse(Reservation.objects.filter(service__isnull=True).exists())
+        self.assertEqual(Reservation.objects.get(pk=first).service_name, 'Hotel Wawel')
+
+    def test_statistics_group_by_service(self):
+        for _ in range(2):
+            self.reserve(option=self.room).save()
+        self.assertEqual(get_most_popular_service()['service__name'], 'Hotel Wawel')
+
+        client = Client()
+        client.force_login(self.user)
+        with self.assertNumQueries(4):
+            response = client.get(reverse('my_reservations'))
+        self.assertContains(response, 'Hotel Wawel', count=2)
@@ -0,0 +1,280 @@
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..availability import get_engine
+from ..models import Service, ServiceOption
+from ..search import HomeFilters, search_services, paginate_services, normalize_sort
+from ..text import fold, stem, search_terms
+
+# Maksymalna liczba zapytań SQL przy renderowaniu strony głównej dla anonimowego użytkownika
+HOME_QUERY_BUDGET = 4
+
+
+def filters(query):
+    return HomeFilters.from_query_dict(QueryDict(query))
+
+
+class HomeFiltersTestCase(TestCase):
+    def test_invalid_values_are_ignored(self):
+        parsed = filters('price=abc&check_in=2024-13-01&check_out=2024-01-02&option=x')
+        self.assertIsNone(parsed.max_price)
+        self.assertFalse(parsed.has_dates)
+        self.assertIsNone(parsed.option_id)
+
+    def test_as_query_dict_is_canonical(self):
+        parsed = filters('option=3&location=Kraków&price=250&type=Hotel')
+        self.assertEqual(
+            list(parsed.as_query_dict().items()),
+            [('type', 'Hotel'), ('location', 'Kraków'), ('price', '250.00'), ('option', '3')],
+        )
+
+    def test_query_whitespace_is_collapsed(self):
+        self.assertEqual(filters('q=++zakopane+++spa+').as_query_dict()['q'], 'zakopane spa')
+
+
+class TextNormalizationTestCase(TestCase):
+    def test_fold_removes_polish_diacritics(self):
+        self.assertEqual(fold('Łódź Żółć'), 'lodz zolc')
+
+    def test_stem_strips_inflection(self):
+        self.assertEqual(stem('krakowie'), stem('krakow'))
+        self.assertEqual(stem('spa'), 'spa')
+
+    def test_search_terms_are_unique(self):
+        self.assertEqual(search_terms('Kraków, Krakowie & SPA&WELLNESS'), ['krak', 'spa', 'wellness'])
+
+
+class FullTextSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.spa = Service.objects.create(name='Zakopane SPA&WELLNESS', location='Zakopane', type='SPA&WELLNESS')
+        self.hotel = Service.objects.create(
+            name='Hotel Wawel', location='Kraków', type='Hotel', description='Pokoje z widokiem na Wawel, śniadanie na tarasie z Wawelem w tle'
+        )
+        self.restaurant = Service.objects.create(
+            name='Pod Wawelem', location='Kraków', type='Restauracja',
+            description='Kuchnia regionalna, ogródek letni i sala bankietowa dla stu gości'
+        )
+
+    def search(self, query):
+        return list(search_services(filters(query)))
+
+    def test_matches_words_in_any_case(self):
+        self.assertEqual(self.search('q=zakopane+spa'), [self.spa])
+
+    def test_matches_without_diacritics_and_inflected(self):
+        self.assertCountEqual(self.search('q=krakow'), [self.hotel, self.restaurant])
+        self.assertCountEqual(self.search('q=w+Krakowie'), [self.hotel, self.restaurant])
+
+    def test_all_terms_are_required(self):
+        self.assertEqual(self.search('q=krakow+hotel'), [self.hotel])
+
+    def test_more_occurrences_rank_higher(self):
+        page = paginate_services(search_services(filters('q=wawel')), 'relevance')
+        self.assertEqual(list(page.services), [self.hotel, self.restaurant])
+
+    def test_combines_with_filters(self):
+        self.assertEqual(self.search('q=wawel&type=Restauracja'), [self.restaurant])
+
+    def test_search_document_follows_edits(self):
+        self.spa.name = 'Termy Chochołowskie'
+        self.spa.save()
+        self.assertEqual(self.search('q=chocholowskie'), [self.spa])
+        self.assertEqual(self.search('q=wellness'), [self.spa])
+        self.spa.delete()
+        self.assertEqual(self.search('q=termy'), [])
+
+    def test_rebuild_command_restores_documents(self):
+        Service.objects.update(search_document='')
+        self.assertEqual(self.search('q=zakopane'), [])
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.search('q=zakopane'), [self.spa])
+
+    def test_relevance_sort_paginates(self):
+        services = search_services(filters('q=wawel'))
+        first = paginate_services(services, 'relevance', page_size=1)
+        second = paginate_services(services, 'relevance', first.next_cursor, page_size=1)
+        self.assertEqual(list(first.services) + list(second.services), [self.hotel, self.restaurant])
+        self.assertFalse(second.has_next)
+
+    def test_relevance_is_default_only_with_query(self):
+        self.assertEqual(normalize_sort('', filters('q=wawel')), 'relevance')
+        self.assertEqual(normalize_sort('relevance', filters('')), 'price')
+        self.assertEqual(normalize_sort('name', filters('q=wawel')), 'name')
+
+    def test_home_renders_matches(self):
+        response = Client().get(reverse('home'), {'q': 'zakopane'})
+        self.assertContains(response, 'Zakopane SPA&amp;WELLNESS')
+        self.assertNotContains(response, 'Hotel Wawel')
+
+
+class SearchServicesTestCase(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.hotel = Service.objects.create(name='Hotel', location='Kraków', type='Hotel')
+        self.cheap = ServiceOption.objects.create(
+            service=self.hotel, name='Cheap', capacity=2, price=100,
+            available_from=today, available_to=today + timedelta(days=5),
+        )
+        self.expensive = ServiceOption.objects.create(
+            service=self.hotel, name='Expensive', capacity=4, price=900,
+            available_from=today + timedelta(days=20), available_to=today + timedelta(days=30),
+        )
+        self.empty_hotel = Service.objects.create(name='Empty', location='Gdańsk', type='Hotel')
+        self.spa = Service.objects.create(name='Spa', location='Kraków', type='SPA&WELLNESS')
+        ServiceOption.objects.create(service=self.spa, name='Masaż', capacity=1, price=500)
+
+    def search(self, query):
+        return list(search_services(filters(query)).order_by('pk'))
+
+    def test_type_and_location(self):
+        self.assertEqual(self.search('type=Hotel&location=Kraków'), [self.hotel])
+
+    def test_price_keeps_services_without_options(self):
+        self.assertEqual(self.search('price=200'), [self.hotel, self.empty_hotel])
+
+    def test_dates_require_type_for_services_without_options(self):
+        check_in = date.today() + timedelta(days=1)
+        check_out = date.today() + timedelta(days=2)
+        query = f'check_in={check_in}&check_out={check_out}'
+        self.assertEqual(self.search(query), [self.hotel])
+        self.assertEqual(self.search(query + '&type=Hotel'), [self.hotel, self.empty_hotel])
+
+    def test_each_filter_may_match_another_option(self):
+        check_in = date.today() + timedelta(days=21)
+        check_out = date.today() + timedelta(days=22)
+        # Tania opcja nie jest dostępna w tych datach, a dostępna jest za droga: jak w dawnym
+        # widoku usługa przechodzi, bo cenę i daty spełniają różne opcje
+        self.assertEqual(self.search(f'price=200&check_in={check_in}&check_out={check_out}'), [self.hotel])
+        self.assertEqual(self.search(f'price=200&option={self.expensive.id}'), [self.hotel])
+        self.assertEqual(self.search(f'price=50&check_in={check_in}&check_out={check_out}'), [])
+
+    def test_guests_and_dates_apply_to_the_same_option(self):
+        check_in = date.today() + timedelta(days=1)
+        check_out = date.today() + timedelta(days=2)
+        # Pokój dla 4 osób jest dostępny dopiero za 20 dni
+        self.assertEqual(self.search(f'guests=3&check_in={check_in}&check_out={check_out}'), [])
+        self.assertEqual(self.search('guests=3&type=Hotel'), [self.hotel, self.empty_hotel])
+
+    def test_option_filter(self):
+        self.assertEqual(self.search(f'option={self.expensive.id}'), [self.hotel])
+
+    def test_no_duplicate_rows(self):
+        self.assertEqual(self.search('price=1000'), [self.hotel, self.empty_hotel, self.spa])
+
+
+class PaginateServicesTestCase(TestCase):
+    def setUp(self):
+        self.services = []
+        for i, price in enumerate([300, 100, 200, 100, None, 250, None]):
+            service = Service.objects.create(name=f'Usługa {6 - i}', location='Kraków', type='Hotel')
+            if price is not None:
+                ServiceOption.objects.create(service=service, name='Opcja', capacity=2, price=price)
+            self.services.append(service)
+
+    def walk(self, sort, page_size=2):
+        seen, cursor = [], ''
+        while True:
+            page = paginate_services(Service.objects.all(), sort=sort, cursor=cursor, page_size=page_size)
+            seen.extend(page.services)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_price_order_with_services_without_price_last(self):
+        seen = self.walk('price')
+        expected = sorted(
+            Service.objects.all(),
+            key=lambda service: (service.min_price is None, service.min_price or 0, service.pk),
+        )
+        self.assertEqual(seen, expected)
+
+    def test_name_order(self):
+        self.assertEqual(self.walk('name', page_size=3), list(Service.objects.order_by('name', 'pk')))
+
+    def test_newest_order(self):
+        self.assertEqual(self.walk('newest'), list(reversed(self.services)))
+
+    def test_cursor_from_other_sort_starts_from_first_page(self):
+        page = paginate_services(Service.objects.all(), sort='name', page_size=2)
+        other = paginate_services(Service.objects.all(), sort='newest', cursor=page.next_cursor, page_size=2)
+        self.assertTrue(other.is_first)
+        self.assertEqual(other.services, list(reversed(self.services))[:2])
+
+    def test_invalid_cursor_is_ignored(self):
+        page = paginate_services(Service.objects.all(), sort='name', cursor='???', page_size=2)
+        self.assertTrue(page.is_first)
+
+    def test_deep_page_costs_one_query(self):
+        page = paginate_services(Service.objects.all(), sort='price', page_size=2)
+        page = paginate_services(Service.objects.all(), sort='price', cursor=page.next_cursor, page_size=2)
+        with self.assertNumQueries(1):
+            paginate_services(Service.objects.all(), sort='price', cursor=page.next_cursor, page_size=2)
+
+
+@override_settings(HOME_PAGE_SIZE=2)
+class HomePaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            service = Service.objects.create(name=f'Hotel {i}', location='Kraków', type='Hotel')
+            ServiceOption.objects.create(service=service, name='Pokój', capacity=2, price=100 + i)
+
+    def test_next_page_link_carries_filters(self):
+        response = self.client.get(reverse('home'), {'type': 'Hotel', 'price': '500', 'sort': 'name'})
+        page = response.context['page']
+        self.assertEqual(len(page.services), 2)
+        next_query = QueryDict(page.next_query)
+        self.assertEqual(next_query['type'], 'Hotel')
+        self.assertEqual(next_query['price'], '500.00')
+        self.assertEqual(next_query['sort'], 'name')
+
+        response = self.client.get(reverse('home') + '?' + page.next_query)
+        self.assertEqual([service.name for service in response.context['page'].services], ['Hotel 2', 'Hotel 3'])
+
+
+class HomeQueryBudgetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def create_services(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                service = Service.objects.create(name=f'Hotel {i}', location=f'Miasto {i % 3}', type='Hotel')
+                ServiceOption.objects.bulk_create([
+                    ServiceOption(service=service, name='Pokój', capacity=2, price=100 + i),
+                    ServiceOption(service=service, name='Apartament', capacity=4, price=300 + i),
+                ])
+
+    def count_home_queries(self, query=''):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('home') + query)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_number_of_services(self):
+        query = '?type=Hotel&price=500'
+        self.create_services(3)
+        small = self.count_home_queries(query)
+        self.create_services(30)
+        large = self.count_home_queries(query)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, HOME_QUERY_BUDGET)
+
+    def test_query_budget_with_all_filters(self):
+        self.create_services(20)
+        check_in = date.today() + timedelta(days=1)
+        check_out = date.today() + timedelta(days=3)
+        query = f'?type=Hotel&location=Miasto 1&price=400&check_in={check_in}&check_out={check_out}'
+        # Silnik dostępności jest budowany raz na wersję katalogu i rezerwacji, nie na żądanie
+        get_engine()
+        self.assertLessEqual(self.count_home_queries(query), HOME_QUERY_BUDGET)
@@ -0,0 +1,123 @@
+from datetime import date, datetime, time, timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..booking import BookingError, book_option
+from ..models import PointsTransaction, Reservation, ReservationSeries, Service, ServiceOption, TimeSlot, User
+from ..series import book_series, cancel_series
+from ..slots import find_slot
+
+
+def at(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+class OccurrencesTestCase(SimpleTestCase):
+    @override_settings(TIME_ZONE='Europe/Warsaw')
+    def test_weekly_rule_keeps_local_hour_across_time_change(self):
+        series = ReservationSeries(
+            start_datetime=at(date(2026, 10, 20), 18), end_datetime=at(date(2026, 10, 20), 20),
+            frequency=ReservationSeries.WEEKLY, until=date(2026, 11, 10),
+        )
+        starts = [timezone.localtime(start) for start, end in series.occurrences()]
+        self.assertEqual([start.day for start in starts], [20, 27, 3, 10])
+        self.assertEqual({start.hour for start in starts}, {18})
+        self.assertEqual({end - start for start, end in series.occurrences()}, {timedelta(hours=2)})
+
+    def test_rule_is_expanded_lazily(self):
+        series = ReservationSeries(
+            start_datetime=at(date(2026, 1, 1), 12), frequency=ReservationSeries.DAILY, interval=2,
+            until=date(9999, 1, 1),
+        )
+        occurrences = series.occurrences()
+        self.assertEqual(next(occurrences)[0].date(), date(2026, 1, 1))
+        self.assertEqual(next(occurrences)[0].date(), date(2026, 1, 3))
+
+
+@override_settings(SLOT_SCHEDULE={'Restauracja': ('12:00', '18:00', 120)}, SLOT_HORIZON_DAYS=90)
+class ReservationSeriesTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        self.table = ServiceOption.objects.create(service=self.restaurant, name='Stolik', capacity=1, price=50)
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123', balance=1000,
+        )
+
+    def book(self, weeks=12, **kwargs):
+        return book_series(
+            self.user, self.table, at(self.day, 14), at(self.day, 16), ReservationSeries.WEEKLY,
+            until=self.day + timedelta(weeks=weeks), **kwargs,
+        )
+
+    def test_books_every_occurrence_with_one_debit(self):
+        series, reservations = self.book()
+
+        self.assertEqual(len(reservations), 13)
+        self.assertEqual(Reservation.objects.filter(series=series).count(), 13)
+        last = Reservation.objects.filter(series=series).order_by('start_datetime').last()
+        self.assertEqual(last.start_datetime, at(self.day + timedelta(weeks=12), 14))
+        self.assertEqual(last.slot.remaining, 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000 - 13 * 50)
+        self.assertEqual(PointsTransaction.objects.filter(user=self.user, reason=PointsTransaction.RESERVATION).count(), 1)
+
+    def test_occurrences_have_keys_without_returning(self):
+        # Jak w MySQL: bulk_create nie zwraca kluczy głównych
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            series, reservations = self.book(weeks=3)
+        self.assertEqual(
+            [reservation.pk for reservation in reservations],
+            list(Reservation.objects.filter(series=series).order_by('start_datetime').values_list('pk', flat=True)),
+        )
+
+    def test_one_taken_occurrence_rejects_the_whole_series(self):
+        other = User.objects.create_user(
+            email='anna@example.com', first_name='Anna', last_name='Nowak', password='haslo123', balance=1000,
+        )
+        taken = at(self.day + timedelta(weeks=3), 14)
+        book_option(other, self.table, taken, price=50, slot=find_slot(self.table, taken))
+
+        with self.assertRaises(BookingError):
+            self.book()
+        self.assertFalse(ReservationSeries.objects.exists())
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+
+    def test_occurrences_beyond_slot_horizon_are_refused(self):
+        with self.assertRaisesMessage(BookingError, "najwyżej 90 dni naprzód"):
+            self.book(weeks=14)
+        self.assertFalse(TimeSlot.objects.filter(start__date__gt=self.day + timedelta(days=90)).exists())
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_occurrence_limit(self):
+        with self.settings(RESERVATION_SERIES_MAX_OCCURRENCES=5), self.assertRaisesMessage(BookingError, "najwyżej 5"):
+            self.book(weeks=5)
+        self.assertFalse(TimeSlot.objects.filter(remaining=0).exists())
+
+    def test_form_my_reservations_and_cancel(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(reverse('make_reservation', args=[self.restaurant.id]), {
+            'option': self.table.id, 'datetime': f'{self.day:%Y-%m-%d} 14:00',
+            'repeat': 'weekly', 'repeat_until': f'{self.day + timedelta(weeks=3):%Y-%m-%d}',
+        }, follow=True)
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ["Rezerwacja cykliczna została utworzona. Liczba terminów: 4."],
+        )
+        series = ReservationSeries.objects.get()
+
+        response = client.get(reverse('my_reservations'))
+        self.assertEqual(response.context['reservations'], [])
+        self.assertEqual(len(response.context['series']), 1)
+        self.assertContains(response, "4 nadchodzących z 4")
+
+        client.post(reverse('cancel_reservation_series', args=[series.pk]))
+        self.assertEqual(Reservation.objects.filter(series=series, status='pending cancellation').count(), 4)
+        self.assertEqual(cancel_series(series), 0)
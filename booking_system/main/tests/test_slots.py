@@ -0,0 +1,150 @@
+from datetime import datetime, time, timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..availability import free_options
+from ..models import Reservation, Service, ServiceOption, TimeSlot, User
+from ..slots import release_slot, take_slot
+
+SCHEDULE = {'Restauracja': ('12:00', '18:00', 120)}
+
+
+def at(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@override_settings(SLOT_SCHEDULE=SCHEDULE, SLOT_HORIZON_DAYS=3)
+class TimeSlotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.restaurant = Service.objects.create(name='Pod Wawelem', location='Kraków', type='Restauracja')
+        self.table = ServiceOption.objects.create(
+            service=self.restaurant, name='Stolik', capacity=4, units=2, price=50,
+            available_from=timezone.localdate(), available_to=self.day + timedelta(days=10),
+        )
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123', balance=1000,
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def slot(self, hour):
+        return TimeSlot.objects.get(option=self.table, start=at(self.day, hour))
+
+    def book(self, hour, user=None):
+        client = self.client
+        if user is not None:
+            client = Client()
+            client.force_login(user)
+        response = client.post(reverse('make_reservation', args=[self.restaurant.id]), {
+            'option': self.table.id, 'datetime': f'{self.day:%Y-%m-%d} {hour:02d}:00',
+        }, follow=True)
+        return [str(message) for message in response.context['messages']]
+
+    def test_slots_are_preallocated_from_opening_hours(self):
+        self.assertEqual(TimeSlot.objects.filter(option=self.table).count(), 3 * 3)
+        hours = [timezone.localtime(slot.start).hour for slot in TimeSlot.objects.filter(start__date=self.day)]
+        self.assertEqual(sorted(hours), [12, 14, 16])
+        self.assertEqual(self.slot(12).remaining, 2)
+
+    def test_option_window_limits_slots(self):
+        option = ServiceOption.objects.create(
+            service=self.restaurant, name='Taras', capacity=4, price=80,
+            available_from=self.day, available_to=self.day,
+        )
+        self.assertEqual(TimeSlot.objects.filter(option=option).count(), 3)
+
+    def test_booking_takes_a_place_until_full(self):
+        self.assertEqual(self.book(14), ["Rezerwacja została pomyślnie utworzona!"])
+        other = User.objects.create_user(
+            email='anna@example.com', first_name='Anna', last_name='Nowak', password='haslo123', balance=1000,
+        )
+        self.book(14, other)
+        self.assertEqual(self.slot(14).remaining, 0)
+        self.assertEqual(self.book(14), ["Brak wolnych miejsc w wybranym terminie."])
+
+        reservation = Reservation.objects.filter(user=self.user).get()
+        self.assertEqual((reservation.slot, reservation.end_datetime), (self.slot(14), at(self.day, 16)))
+
+    def test_day_beyond_horizon_is_refused_without_creating_slots(self):
+        far = timezone.localdate() + timedelta(days=30)
+        response = self.client.post(reverse('make_reservation', args=[self.restaurant.id]), {
+            'option': self.table.id, 'datetime': f'{far:%Y-%m-%d} 12:00',
+        }, follow=True)
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ["Terminy można rezerwować najwyżej 3 dni naprzód."],
+        )
+        self.assertFalse(TimeSlot.objects.filter(start__date=far).exists())
+
+    def test_time_outside_grid_is_rejected(self):
+        self.assertEqual(self.book(13), ["Wybierz godzinę z listy wolnych terminów."])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_cancellation_returns_the_place(self):
+        self.book(12)
+        reservation = Reservation.objects.get()
+        reservation.status = 'pending cancellation'
+        reservation.save()
+        staff = User.objects.create_user(
+            email='admin@example.com', first_name='A', last_name='B', password='haslo123', is_staff=True,
+        )
+        self.client.force_login(staff)
+        self.client.get(reverse('confirm_reservation_cancellation', args=[reservation.id]))
+        self.assertEqual(self.slot(12).remaining, 2)
+
+    def test_take_and_release_respect_bounds(self):
+        slot = self.slot(16)
+        self.assertTrue(take_slot(slot.pk))
+        self.assertTrue(take_slot(slot.pk))
+        self.assertFalse(take_slot(slot.pk))
+        self.assertTrue(release_slot(slot.pk))
+        self.assertTrue(release_slot(slot.pk))
+        self.assertFalse(release_slot(slot.pk))
+
+    def test_units_change_keeps_taken_places(self):
+        take_slot(self.slot(12).pk)
+        self.table.units = 5
+        self.table.save()
+        self.assertEqual((self.slot(12).capacity, self.slot(12).remaining), (5, 4))
+        self.table.units = 1
+        self.table.save()
+        self.assertEqual((self.slot(12).capacity, self.slot(12).remaining), (1, 0))
+
+    def test_day_is_taken_in_engine_only_when_every_slot_is_full(self):
+        other = User.objects.create_user(
+            email='anna@example.com', first_name='Anna', last_name='Nowak', password='haslo123', balance=1000,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for hour in (12, 14):
+                self.book(hour)
+                self.book(hour, other)
+        self.assertIn(self.table.pk, free_options(self.day, self.day + timedelta(days=1)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(16)
+            self.book(16, other)
+        self.assertNotIn(self.table.pk, free_options(self.day, self.day + timedelta(days=1)))
+
+    def test_free_slots_endpoint_uses_one_query(self):
+        take_slot(self.slot(12).pk)
+        take_slot(self.slot(12).pk)
+        url = reverse('service_slots', args=[self.restaurant.id])
+        with CaptureQueriesContext(connection) as context:
+            data = Client().get(url, {'date': self.day.isoformat(), 'option': self.table.id}).json()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual([(slot['start'], slot['end'], slot['remaining']) for slot in data['slots']],
+                         [('14:00', '16:00', 2), ('16:00', '18:00', 2)])
+        self.assertEqual(Client().get(url, {'date': 'jutro'}).status_code, 400)
+
+    def test_generate_command_fills_missing_days(self):
+        TimeSlot.objects.all().delete()
+        call_command('generate_time_slots', days=2, stdout=StringIO())
+        self.assertEqual(TimeSlot.objects.count(), 2 * 3)
@@ -0,0 +1,284 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.contrib.admin.sites import AdminSite
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..admin import ReservationAdmin
+from ..booking import place_hold
+from ..models import PointsTransaction, Reservation, Service, ServiceOption, User
+from ..transitions import (
+    CANCELLED, CONFIRMED, PENDING, PENDING_CANCELLATION, PENDING_MODIFICATION, TransitionError,
+    approve_modifications, can_transition, cancel, expire_stale, reject_modifications, request_modification,
+    transition, transition_many,
+)
+
+
+class ReservationTransitionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+        )
+        self.admin = User.objects.create_superuser(
+            email='admin@example.com', first_name='Admin', last_name='User', password='adminpass',
+        )
+        self.service = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=100)
+        self.reservation = self.reserve(PENDING_CANCELLATION)
+
+    def reserve(self, status):
+        start = timezone.now() + timedelta(days=1)
+        return Reservation.objects.create(
+            user=self.user, option=self.option, start_datetime=start, end_datetime=start + timedelta(days=2),
+            price=200, status=status,
+        )
+
+    def test_allowed_transitions(self):
+        self.assertTrue(can_transition(PENDING, CONFIRMED))
+        self.assertFalse(can_transition(CANCELLED, PENDING))
+        self.assertFalse(can_transition(PENDING_CANCELLATION, CONFIRMED))
+        with self.assertRaises(TransitionError):
+            transition(self.reservation, 'archived')
+
+    def test_transition_is_single_conditional_update(self):
+        pending = self.reserve(PENDING)
+        with self.assertNumQueries(1):
+            self.assertTrue(transition(pending, CONFIRMED))
+        self.assertFalse(transition(pending, CONFIRMED, expected=[PENDING]))
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, CONFIRMED)
+
+    def test_cancel_refunds_once(self):
+        stale = Reservation.objects.get(pk=self.reservation.pk)
+        self.assertIsNotNone(cancel(self.reservation, 200, expected=[PENDING_CANCELLATION]))
+        # Druga akcja na nieaktualnym obiekcie (np. równoległy administrator) nic nie zwraca
+        self.assertIsNone(cancel(stale, 200, expected=[PENDING_CANCELLATION]))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 200)
+        self.assertEqual(PointsTransaction.objects.filter(reason=PointsTransaction.REFUND).count(), 1)
+
+    def test_admin_actions(self):
+        reservation_admin = ReservationAdmin(Reservation, AdminSite())
+        pending = [self.reserve(PENDING) for _ in range(3)]
+
+        reservation_admin.confirm_reservations(Mock(), Reservation.objects.all())
+        self.assertEqual(Reservation.objects.filter(status=CONFIRMED).count(), 3)
+
+        reservation_admin.approve_cancellation(Mock(), Reservation.objects.all())
+        reservation_admin.approve_cancellation(Mock(), Reservation.objects.all())
+        self.assertEqual(Reservation.objects.filter(status=CANCELLED).count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 200)
+
+        reservation_admin.cancel_reservation(Mock(), Reservation.objects.filter(pk=pending[0].pk))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 400)
+
+    def test_views_replay_safely(self):
+        client = Client()
+        client.force_login(self.admin)
+        url = reverse('confirm_reservation_cancellation', args=[self.reservation.pk])
+        client.post(url)
+        client.post(url)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100)
+
+        pending = self.reserve(PENDING)
+        client.force_login(self.user)
+        client.post(reverse('cancel_reservation_request', args=[pending.pk]))
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, PENDING_CANCELLATION)
+        self.assertEqual(transition_many(Reservation.objects.all(), CONFIRMED), 0)
+
+
+class ModificationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jan@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+        )
+        self.service = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=100)
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def reserve(self, offset, new_offset=None, status=CONFIRMED, nights=2):
+        start = self.start + timedelta(days=offset)
+        reservation = Reservation.objects.create(
+            user=self.user, option=self.option, start_datetime=start, end_datetime=start + timedelta(days=2),
+            price=200, status=status,
+        )
+        if new_offset is not None:
+            new_start = self.start + timedelta(days=new_offset)
+            request_modification(reservation, new_start, new_start + timedelta(days=nights))
+        return reservation
+
+    def test_approve_moves_free_requests_and_reports_conflicts(self):
+        self.reserve(10)
+        free = self.reserve(0, new_offset=20)
+        clashing = self.reserve(3, new_offset=11)
+        # Dwie prośby o ten sam wolny termin: zatwierdzona zostaje tylko pierwsza
+        first = self.reserve(6, new_offset=30)
+        second = self.reserve(40, new_offset=30)
+
+        # Odczyt próśb, blokada opcji, zajętość, blokady terminów i UPDATE oraz SAVEPOINT/RELEASE transakcji
+        with self.assertNumQueries(7):
+            approved, conflicts = approve_modifications(Reservation.objects.all())
+
+        self.assertEqual(approved, 2)
+        self.assertEqual({reservation.pk for reservation in conflicts}, {clashing.pk, second.pk})
+        free.refresh_from_db()
+        self.assertEqual(free.status, CONFIRMED)
+        self.assertEqual(free.start_datetime, self.start + timedelta(days=20))
+        self.assertIsNone(free.new_start_datetime)
+        first.refresh_from_db()
+        self.assertEqual(first.start_datetime, self.start + timedelta(days=30))
+        clashing.refresh_from_db()
+        self.assertEqual(clashing.status, PENDING_MODIFICATION)
+
+    def test_approval_locks_options_before_reading_occupancy(self):
+        self.reserve(0, new_offset=20)
+        with patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=QuerySet.select_for_update) as lock, \
+                CaptureQueriesContext(connection) as queries:
+            approve_modifications(Reservation.objects.all())
+        self.assertEqual([call.args[0].model for call in lock.call_args_list], [ServiceOption])
+        tables = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertIn('"main_serviceoption"', tables[1])
+
+    def test_request_approved_into_slot_vacated_by_another_request(self):
+        moving = self.reserve(0, new_offset=20)
+        following = self.reserve(5, new_offset=0)
+        approved, conflicts = approve_modifications(Reservation.objects.all())
+        self.assertEqual((approved, conflicts), (2, []))
+        following.refresh_from_db()
+        self.assertEqual(following.start_datetime, self.start)
+
+    def test_reject(self):
+        reservation = self.reserve(0, new_offset=20)
+        self.assertEqual(reject_modifications(Reservation.objects.all()), 1)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, CONFIRMED)
+        self.assertEqual(reservation.start_datetime, self.start)
+        self.assertIsNone(reservation.new_end_datetime)
+
+    def test_unconfirmed_reservation_stays_unconfirmed(self):
+        moved = self.reserve(0, new_offset=20, status=PENDING)
+        kept = self.reserve(5, new_offset=25, status=PENDING)
+        self.assertEqual(approve_modifications(Reservation.objects.filter(pk=moved.pk)), (1, []))
+        self.assertEqual(reject_modifications(Reservation.objects.filter(pk=kept.pk)), 1)
+
+        moved.refresh_from_db()
+        self.assertEqual((moved.status, moved.start_datetime), (PENDING, self.start + timedelta(days=20)))
+        kept.refresh_from_db()
+        self.assertEqual((kept.status, kept.start_datetime, kept.previous_status), (PENDING, self.start + timedelta(days=5), ''))
+
+    def test_changed_stay_length_is_repriced(self):
+        self.user.balance = 150
+        self.user.save()
+        longer = self.reserve(0, new_offset=20, nights=3)
+        shorter = self.reserve(5, new_offset=30, nights=1)
+        unpaid = self.reserve(10, new_offset=40, nights=5)
+
+        approved, conflicts = approve_modifications(Reservation.objects.all())
+
+        self.assertEqual((approved, conflicts), (2, [unpaid]))
+        prices = dict(Reservation.objects.values_list('pk', 'price'))
+        self.assertEqual((prices[longer.pk], prices[shorter.pk], prices[unpaid.pk]), (300, 100, 200))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 150 - 100 + 100)
+        self.assertEqual(
+            set(PointsTransaction.objects.values_list('reservation_id', 'amount')), {(longer.pk, -100), (shorter.pk, 100)},
+        )
+        unpaid.refresh_from_db()
+        self.assertEqual(unpaid.status, PENDING_MODIFICATION)
+
+    def test_invalid_requests_are_not_approved(self):
+        self.option.available_to = (self.start + timedelta(days=30)).date()
+        self.option.save()
+        closed = self.reserve(5, new_offset=40)
+        other = User.objects.create_user(
+            email='anna@example.com', first_name='Anna', last_name='Nowak', password='haslo123', balance=1000,
+        )
+        held = self.reserve(10, new_offset=25)
+        place_hold(other, self.option, self.start + timedelta(days=25), self.start + timedelta(days=26))
+
+        approved, conflicts = approve_modifications(Reservation.objects.all())
+        self.assertEqual(approved, 0)
+        self.assertEqual({reservation.pk for reservation in conflicts}, {closed.pk, held.pk})
+        self.assertEqual(Reservation.objects.filter(status=PENDING_MODIFICATION).count(), 2)
+
+    def test_user_requests_date_change(self):
+        reservation = self.reserve(0)
+        client = Client()
+        client.force_login(self.user)
+        new_start = timezone.localtime(self.start + timedelta(days=7))
+        response = client.post(reverse('request_change_date', args=[reservation.pk]), {
+            'new_start_datetime': f'{new_start:%Y-%m-%dT%H:%M}',
+            'new_end_datetime': f'{new_start + timedelta(days=2):%Y-%m-%dT%H:%M}',
+        })
+        self.assertRedirects(response, reverse('my_reservations'))
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, PENDING_MODIFICATION)
+        self.assertEqual(reservation.new_start_datetime, new_start.replace(second=0))
+
+        transition(reservation, 'cancelled')
+        client.post(reverse('request_change_date', args=[reservation.pk]), {
+            'new_start_datetime': f'{new_start:%Y-%m-%dT%H:%M}',
+            'new_end_datetime': f'{new_start + timedelta(days=2):%Y-%m-%dT%H:%M}',
+        })
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'cancelled')
+
+
+class ExpireReservationsTestCase(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', first_name='Jan', last_name='Kowalski', password='haslo123',
+            )
+            for number in range(3)
+        ]
+        self.service = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.option = ServiceOption.objects.create(service=self.service, name='Pokój', capacity=2, price=100)
+
+    def reserve(self, user, status, age_hours):
+        start = timezone.now() + timedelta(days=3)
+        return Reservation.objects.create(
+            user=user, option=self.option, start_datetime=start, end_datetime=start + timedelta(days=1),
+            price=100, status=status, status_changed_at=timezone.now() - timedelta(hours=age_hours),
+        )
+
+    def test_command_confirms_and_cancels_stale_reservations(self):
+        old_pending = [self.reserve(user, PENDING, 72) for user in self.users]
+        fresh = self.reserve(self.users[0], PENDING, 1)
+        for user in self.users:
+            self.reserve(user, PENDING_CANCELLATION, 200)
+        self.reserve(self.users[1], PENDING_CANCELLATION, 200)
+
+        out = StringIO()
+        call_command('expire_reservations', '--batch-size', '2', stdout=out)
+
+        self.assertEqual(Reservation.objects.filter(pk__in=[r.pk for r in old_pending], status=CONFIRMED).count(), 3)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, PENDING)
+        self.assertEqual(Reservation.objects.filter(status=CANCELLED).count(), 4)
+        balances = sorted(User.objects.filter(pk__in=[user.pk for user in self.users]).values_list('balance', flat=True))
+        self.assertEqual(balances, [50, 50, 100])
+        self.assertEqual(PointsTransaction.objects.filter(reason=PointsTransaction.REFUND).count(), 4)
+        self.assertIn("pending cancellation -> cancelled: 4 rezerwacji", out.getvalue())
+
+    def test_chunk_is_constant_number_of_queries(self):
+        for user in self.users * 4:
+            self.reserve(user, PENDING_CANCELLATION, 200)
+        cutoff = timezone.now() - timedelta(hours=1)
+        # SELECT ... FOR UPDATE, UPDATE statusu, UPDATE sald, INSERT do księgi (plus zapisy punktu zapisu)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expire_stale(PENDING_CANCELLATION, CANCELLED, cutoff, 100, refund_ratio=1), 12)
+        self.assertLessEqual(len([query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), 4)
+        self.assertEqual(expire_stale(PENDING_CANCELLATION, CANCELLED, cutoff, 100, refund_ratio=1), 0)
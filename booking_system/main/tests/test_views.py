@@ -1,4 +1,5 @@
 from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
@@ -461,6 +462,7 @@ class UserDataTestCase(TestCase):
 
 class GetServiceOptionsTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.service = Service.objects.create(name='Test Service', location='Test Location', type='Hotel')
         self.option1 = ServiceOption.objects.create(service=self.service, name='Option 1', capacity=2, price=100)
         self.option2 = ServiceOption.objects.create(service=self.service, name='Option 2', capacity=4, price=200)
@@ -476,3 +478,46 @@ class GetServiceOptionsTestCase(TestCase):
 
 
 
+
+
+class GetServiceOptionsCachingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Test Service', location='Test Location', type='Hotel')
+        self.other_service = Service.objects.create(name='Other Service', location='Test Location', type='Hotel')
+        self.option1 = ServiceOption.objects.create(service=self.service, name='Option 1', capacity=2, price=100)
+        self.option2 = ServiceOption.objects.create(service=self.service, name='Option 2', capacity=4, price=200)
+        self.option3 = ServiceOption.objects.create(service=self.other_service, name='Option 3', capacity=4, price=300)
+        self.url = reverse('get_service_options')
+
+    def test_if_none_match_returns_304_without_database(self):
+        response = self.client.get(self.url, {'type': 'Hotel'})
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'type': 'Hotel'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_change_changes_etag(self):
+        etag = self.client.get(self.url, {'type': 'Hotel'})['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceOption.objects.create(service=self.service, name='Option 4', capacity=1, price=50)
+        response = self.client.get(self.url, {'type': 'Hotel'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['options']), 4)
+
+    def test_etag_depends_on_parameters(self):
+        etag = self.client.get(self.url, {'type': 'Hotel'})['ETag']
+        self.assertNotEqual(etag, self.client.get(self.url, {'type': 'Hotel', 'limit': 1})['ETag'])
+
+    def test_response_is_cached_per_type(self):
+        self.client.get(self.url, {'type': 'Hotel'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'type': 'Hotel', 'service_id': self.other_service.id})
+        self.assertEqual(response.json()['options'], [{'id': self.option3.id, 'name': 'Option 3'}])
+
+    def test_limit(self):
+        data = self.client.get(self.url, {'type': 'Hotel', 'limit': 2}).json()
+        self.assertEqual(len(data['options']), 2)
+        self.assertTrue(data['has_more'])
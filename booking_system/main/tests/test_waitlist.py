@@ -0,0 +1,120 @@
+from datetime import datetime, time, timedelta
+
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ..booking import book_option
+from ..models import Message, Reservation, Service, ServiceOption, User, WaitlistEntry
+from ..transitions import PENDING_CANCELLATION, cancel, transition
+from ..waitlist import join, promote
+
+
+def at(day, hour=0):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+class WaitlistTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=2)
+        self.hotel = Service.objects.create(name='Hotel Wawel', location='Kraków', type='Hotel')
+        self.room = ServiceOption.objects.create(
+            service=self.hotel, name='Apartament', capacity=2, price=100,
+            available_from=self.day, available_to=self.day + timedelta(days=10),
+        )
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', first_name='Jan', last_name='Kowalski',
+                password='haslo123', balance=1000,
+            )
+            for number in range(4)
+        ]
+        self.start, self.end = at(self.day), at(self.day + timedelta(days=2))
+        self.booked = book_option(self.users[0], self.room, self.start, self.end, price=200)
+
+    def cancel_booked(self):
+        transition(self.booked, PENDING_CANCELLATION)
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel(self.booked, 100)
+
+    def test_cancellation_promotes_first_waiting_user(self):
+        first, _ = join(self.users[1], self.room, self.start, self.end)
+        second, _ = join(self.users[2], self.room, self.start, self.end)
+
+        self.cancel_booked()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, WaitlistEntry.PROMOTED)
+        self.assertEqual(first.reservation.user, self.users[1])
+        self.assertEqual(second.status, WaitlistEntry.WAITING)
+        self.users[1].refresh_from_db()
+        self.assertEqual(self.users[1].balance, 800)
+        message = Message.objects.get(user=self.users[1])
+        self.assertEqual(list(message.reservations.all()), [first.reservation])
+
+    def test_user_without_funds_is_skipped(self):
+        self.users[1].balance = 0
+        self.users[1].save()
+        poor, _ = join(self.users[1], self.room, self.start, self.end)
+        rich, _ = join(self.users[2], self.room, self.start, self.end)
+
+        self.cancel_booked()
+
+        poor.refresh_from_db()
+        rich.refresh_from_db()
+        self.assertEqual(poor.status, WaitlistEntry.WAITING)
+        self.assertEqual(rich.status, WaitlistEntry.PROMOTED)
+
+    def test_promotion_reads_only_a_bounded_prefix(self):
+        for user in self.users[1:]:
+            join(user, self.room, self.start, self.end)
+        # Nic się nie zwolniło: nikt nie dostaje miejsca, a lista pozostaje w kolejności
+        with self.settings(WAITLIST_PROMOTION_BATCH=2):
+            self.assertEqual(promote(self.room.pk, self.start, self.end), [])
+        self.assertEqual(WaitlistEntry.objects.filter(status=WaitlistEntry.WAITING).count(), 3)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_past_entries_are_expired_instead_of_promoted(self):
+        start = timezone.now() - timedelta(days=5)
+        past = Reservation.objects.create(
+            user=self.users[0], option=self.room, start_datetime=start, end_datetime=start + timedelta(days=2),
+            price=200, status=PENDING_CANCELLATION,
+        )
+        entry = WaitlistEntry.objects.create(
+            user=self.users[1], option=self.room, start_datetime=start, end_datetime=start + timedelta(days=2),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel(past, 100)
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, WaitlistEntry.EXPIRED)
+        self.assertFalse(Reservation.objects.filter(user=self.users[1]).exists())
+        self.users[1].refresh_from_db()
+        self.assertEqual(self.users[1].balance, 1000)
+
+    def test_non_overlapping_entries_are_ignored(self):
+        later, _ = join(self.users[1], self.room, self.end + timedelta(days=3), self.end + timedelta(days=4))
+        self.cancel_booked()
+        later.refresh_from_db()
+        self.assertEqual(later.status, WaitlistEntry.WAITING)
+
+    def test_join_and_leave_views(self):
+        client = Client()
+        client.force_login(self.users[1])
+        form = {
+            'option': self.room.id,
+            'start_date': f'{self.day:%Y-%m-%d}',
+            'end_date': f'{self.day + timedelta(days=2):%Y-%m-%d}',
+        }
+        client.post(reverse('join_waitlist', args=[self.hotel.id]), form)
+        client.post(reverse('join_waitlist', args=[self.hotel.id]), form)
+        entry = WaitlistEntry.objects.get()
+        self.assertEqual(entry.start_datetime, self.start)
+
+        response = client.get(reverse('my_reservations'))
+        self.assertContains(response, 'Lista oczekujących')
+
+        client.post(reverse('leave_waitlist', args=[entry.pk]))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, WaitlistEntry.LEFT)
@@ -0,0 +1,41 @@
+"""Normalizacja tekstu do wyszukiwania: usuwanie polskich znaków i prosty stemming."""
+import re
+import unicodedata
+
+# Znaki, których NFKD nie rozkłada na literę bazową i znak diakrytyczny
+SPECIAL_FOLDS = str.maketrans({'ł': 'l', 'Ł': 'L', 'ß': 'ss'})
+
+TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+# Najczęstsze końcówki fleksyjne (po usunięciu znaków diakrytycznych), od najdłuższych
+POLISH_SUFFIXES = sorted([
+    'owie', 'ami', 'ach', 'ego', 'emu', 'ych', 'ymi', 'iej', 'ich', 'imi', 'owi',
+    'ow', 'om', 'em', 'ie', 'ia', 'ii', 'a', 'e', 'i', 'o', 'u', 'y',
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+# Przyimki i spójniki pomijane w dokumentach i zapytaniach ("hotel w Krakowie")
+STOPWORDS = frozenset(['a', 'i', 'o', 'u', 'w', 'z', 'na', 'do', 'od', 'po', 'we', 'ze', 'za', 'oraz'])
+
+
+def fold(text):
+    """Małe litery bez znaków diakrytycznych, np. "Łódź" -> "lodz"."""
+    text = (text or '').translate(SPECIAL_FOLDS)
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+def stem(token):
+    for suffix in POLISH_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def search_terms(text):
+    """Znormalizowane rdzenie słów tekstu, bez powtórzeń i w kolejności wystąpienia."""
+    return list(dict.fromkeys(stem(token) for token in tokenize(text)))
@@ -0,0 +1,309 @@
+"""Dozwolone zmiany statusu rezerwacji.
+
+Każda zmiana to jeden warunkowy UPDATE (``WHERE id = ? AND status IN (...)``):
+zmienia status tylko wtedy, gdy rezerwacja wciąż jest w stanie, z którego
+przejście jest dozwolone. Skutki uboczne (zwrot punktów, zwolnienie terminu)
+wykonuje wyłącznie wywołujący, którego UPDATE zmienił wiersz, więc równoległe
+lub powtórzone akcje administratora nie zwracają punktów dwa razy. Zwolnione
+miejsce trafia po zatwierdzeniu transakcji do listy oczekujących (zob. waitlist.py).
+
+Prośby o zmianę terminu są zatwierdzane i odrzucane zbiorczo
+(``approve_modifications``, ``reject_modifications``); w obu przypadkach
+rezerwacja wraca do statusu zapisanego w ``previous_status`` przez
+``request_modification``, więc niepotwierdzona rezerwacja nie staje się przy
+okazji potwierdzoną. Zmiana liczby nocy pobytu jest przeliczana przy
+zatwierdzeniu po stawce za noc zapłaconej przy rezerwacji: różnica jest
+pobierana z salda albo zwracana przez księgę punktów (points.py). Zaległe rezerwacje są wygaszane partiami po indeksie
+(status, status_changed_at) (``expire_stale``).
+
+UPDATE omija sygnały modelu, dlatego zmiana zajętości jest nanoszona na silnik
+dostępności bezpośrednio, po zatwierdzeniu transakcji (zob. availability.py).
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .availability import bump_on_commit, reservation_changed
+from .booking import BookingError, effective_end, nights, overlaps, validate_line
+from .holds import active_holds
+from .models import PointsTransaction, Reservation, ServiceOption, overlap_condition
+from .points import InsufficientPoints, apply_points, apply_points_many
+from .slots import release_slot, release_slots
+from .waitlist import promote_on_commit
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+CANCELLED = 'cancelled'
+PENDING_CANCELLATION = 'pending cancellation'
+PENDING_MODIFICATION = 'pending modification'
+
+# Status -> statusy, do których wolno przejść
+TRANSITIONS = {
+    PENDING: {CONFIRMED, PENDING_CANCELLATION, PENDING_MODIFICATION, CANCELLED},
+    CONFIRMED: {PENDING_CANCELLATION, PENDING_MODIFICATION, CANCELLED},
+    PENDING_CANCELLATION: {CANCELLED},
+    PENDING_MODIFICATION: {PENDING, CONFIRMED, PENDING_CANCELLATION, CANCELLED},
+    CANCELLED: set(),
+}
+
+
+class TransitionError(Exception):
+    """Niedozwolona zmiana statusu."""
+
+
+def sources(target, expected=None):
+    """Statusy, z których wolno przejść do ``target`` (opcjonalnie zawężone do ``expected``)."""
+    if target not in TRANSITIONS:
+        raise TransitionError(f"Nieznany status rezerwacji: {target}.")
+    allowed = [status for status, targets in TRANSITIONS.items() if target in targets]
+    if expected is not None:
+        allowed = [status for status in allowed if status in expected]
+    return allowed
+
+
+def can_transition(status, target):
+    return target in TRANSITIONS.get(status, ())
+
+
+def transition(reservation, target, expected=None, **changes):
+    """Zmienia status jednej rezerwacji; True, gdy zmiany dokonało to wywołanie.
+
+    ``changes`` to dodatkowe kolumny zapisywane w tym samym UPDATE.
+    """
+    changed_at = timezone.now()
+    updated = Reservation.objects.filter(
+        pk=reservation.pk, status__in=sources(target, expected),
+    ).update(status=target, status_changed_at=changed_at, **changes)
+    if not updated:
+        return False
+
+    reservation.status = target
+    reservation.status_changed_at = changed_at
+    for field, value in changes.items():
+        setattr(reservation, field, value)
+    reservation_changed(reservation)
+    return True
+
+
+def transition_many(queryset, target, expected=None, **changes):
+    """Zmienia status wszystkich pasujących rezerwacji jednym UPDATE; zwraca liczbę zmienionych."""
+    updated = queryset.filter(status__in=sources(target, expected)).update(
+        status=target, status_changed_at=timezone.now(), **changes,
+    )
+    if updated:
+        bump_on_commit()
+    return updated
+
+
+def cancel(reservation, refund, expected=None, description="Anulowanie rezerwacji"):
+    """Anuluje rezerwację, zwalnia termin i zwraca ``refund`` punktów.
+
+    Zwraca wpis zwrotu w księdze albo None, gdy rezerwacja nie była w stanie
+    pozwalającym na anulowanie (np. anulował ją już ktoś inny).
+    """
+    with transaction.atomic():
+        if not transition(reservation, CANCELLED, expected):
+            return None
+        release_slot(reservation.slot_id)
+        promote_on_commit(reservation.option_id, reservation.start_datetime, reservation.end_datetime)
+        return apply_points(
+            reservation.user, refund, PointsTransaction.REFUND, reservation=reservation, description=description,
+        )
+
+
+def request_modification(reservation, new_start, new_end):
+    """Zgłasza prośbę o zmianę terminu; True, gdy zmiany dokonało to wywołanie.
+
+    Dotychczasowy status trafia do ``previous_status`` w tym samym UPDATE, a warunek
+    na ten status chroni przed zapisaniem nieaktualnego odczytu.
+    """
+    previous = reservation.status
+    if not can_transition(previous, PENDING_MODIFICATION):
+        return False
+    return transition(
+        reservation, PENDING_MODIFICATION, expected=[previous],
+        new_start_datetime=new_start, new_end_datetime=new_end, previous_status=previous,
+    )
+
+
+def restore_previous_status(queryset, **changes):
+    """Kończy prośby o zmianę terminu powrotem do statusu sprzed prośby jednym UPDATE; zwraca liczbę zmienionych.
+
+    Prośby bez zapisanego statusu wracają do potwierdzonych.
+    """
+    # Kolejność ma znaczenie: MySQL liczy przypisania SET od lewej do prawej, więc status
+    # musi odczytać previous_status, zanim ten zostanie wyczyszczony
+    updated = queryset.filter(status=PENDING_MODIFICATION).update(
+        status=Case(When(previous_status=PENDING, then=Value(PENDING)), default=Value(CONFIRMED)),
+        status_changed_at=timezone.now(), previous_status='', **changes,
+    )
+    if updated:
+        bump_on_commit()
+    return updated
+
+
+def modification_allowed(reservation):
+    """Czy nowy termin prośby jest poprawny dla opcji i mieści się w jej oknie dostępności."""
+    option, start, end = reservation.option, reservation.new_start_datetime, reservation.new_end_datetime
+    try:
+        validate_line(option, start, end)
+    except BookingError:
+        return False
+    return True
+
+
+def modified_price(reservation):
+    """Cena rezerwacji w nowym terminie: hotel po zapłaconej stawce za noc, pozostałe bez zmian."""
+    if reservation.option.service.type != 'Hotel' or None in (reservation.end_datetime, reservation.new_end_datetime):
+        return reservation.price
+    paid_nights = nights(reservation.start_datetime, reservation.end_datetime)
+    new_nights = nights(reservation.new_start_datetime, reservation.new_end_datetime)
+    if new_nights == paid_nights:
+        return reservation.price
+    return (reservation.price * new_nights / paid_nights).quantize(Decimal('0.01'))
+
+
+def settle_price_changes(reservations):
+    """Pobiera lub zwraca różnicę ceny zatwierdzanych prośb; zwraca ({id: nowa cena}, nieopłacone).
+
+    Dopłata wymaga środków na koncie (warunkowy UPDATE salda); prośba, której
+    właściciel nie ma środków, nie jest zatwierdzana.
+    """
+    prices, unpaid, refunds = {}, [], []
+    for reservation in reservations:
+        price = modified_price(reservation)
+        if price == reservation.price:
+            continue
+        if price > reservation.price:
+            try:
+                apply_points(
+                    reservation.user, reservation.price - price, PointsTransaction.RESERVATION,
+                    reservation=reservation, description="Dopłata za zmianę terminu", require_funds=True,
+                )
+            except InsufficientPoints:
+                unpaid.append(reservation)
+                continue
+        else:
+            refunds.append((reservation.user_id, reservation.price - price, reservation.pk))
+        prices[reservation.pk] = price
+    apply_points_many(refunds, PointsTransaction.REFUND, description="Zwrot za zmianę terminu")
+    return prices, unpaid
+
+
+def approve_modifications(queryset):
+    """Przenosi wybrane prośby o zmianę terminu na nowy termin, pomijając kolidujące.
+
+    Całość jest jedną transakcją z blokadami wierszy opcji (w kolejności id, jak w
+    ``booking.book_lines``), więc równoległa rezerwacja nie zajmie terminu między
+    sprawdzeniem a zapisem. Kolizje z innymi rezerwacjami tej samej opcji (również
+    z prośbami z tej samej partii) i z cudzymi blokadami terminów są sprawdzane
+    dwoma zapytaniami, a zatwierdzone prośby zapisywane jednym UPDATE. Prośby poza
+    oknem dostępności opcji albo bez środków na dopłatę za dłuższy pobyt są
+    traktowane jak kolidujące. Zwraca (liczbę zatwierdzonych, listę kolidujących
+    rezerwacji).
+    """
+    with transaction.atomic():
+        requests = list(
+            queryset.filter(status=PENDING_MODIFICATION, new_start_datetime__isnull=False)
+            .select_related('option__service', 'user').order_by('new_start_datetime', 'pk')
+        )
+        requests = [reservation for reservation in requests if reservation.option_id is not None]
+        if not requests:
+            return 0, []
+        # Blokady wierszy opcji w stałej kolejności, jak przy rezerwacji, żeby się nie zakleszczyć
+        option_ids = {reservation.option_id for reservation in requests}
+        list(ServiceOption.objects.select_for_update().filter(pk__in=option_ids).order_by('pk').values_list('pk'))
+        invalid = [reservation for reservation in requests if not modification_allowed(reservation)]
+        requests = [reservation for reservation in requests if reservation not in invalid]
+        if not requests:
+            return 0, invalid
+
+        first = min(reservation.new_start_datetime for reservation in requests)
+        last = max(effective_end(reservation.new_start_datetime, reservation.new_end_datetime) for reservation in requests)
+
+        # Zajęte przedziały opcji (również obecne terminy próśb z partii): jedno zapytanie dla wszystkich
+        taken = defaultdict(dict)
+        rows = Reservation.objects.active().filter(overlap_condition(first, last), option_id__in=option_ids)
+        for pk, option_id, start, end in rows.values_list('pk', 'option_id', 'start_datetime', 'end_datetime'):
+            taken[option_id][pk] = (start, end)
+        # Cudze blokady terminów zajmują miejsce jak rezerwacje; własna blokada właściciela prośby nie
+        held = defaultdict(list)
+        holds = active_holds().filter(overlap_condition(first, last), option_id__in=option_ids)
+        for option_id, start, end, user_id in holds.values_list('option_id', 'start_datetime', 'end_datetime', 'user_id'):
+            held[option_id].append((start, end, user_id))
+
+        # Zatwierdzona prośba zwalnia dotychczasowy termin, więc odrzucone wcześniej prośby
+        # są sprawdzane ponownie, dopóki kolejny przebieg coś zatwierdza (bez zapytań)
+        approved, conflicts = [], requests
+        while conflicts:
+            pending, conflicts = conflicts, []
+            for reservation in pending:
+                interval = (reservation.new_start_datetime, reservation.new_end_datetime)
+                occupied = taken[reservation.option_id]
+                clashes = sum(overlaps(interval, other) for pk, other in occupied.items() if pk != reservation.pk)
+                clashes += sum(
+                    overlaps(interval, (start, end))
+                    for start, end, user_id in held[reservation.option_id] if user_id != reservation.user_id
+                )
+                if clashes >= reservation.option.units:
+                    conflicts.append(reservation)
+                    continue
+                occupied[reservation.pk] = interval
+                approved.append(reservation)
+            if len(conflicts) == len(pending):
+                break
+
+        prices, unpaid = settle_price_changes(approved)
+        changes = {}
+        if prices:
+            changes['price'] = Case(
+                *(When(pk=pk, then=Value(price)) for pk, price in prices.items()), default=F('price'),
+            )
+        # Kolejność ma znaczenie: MySQL liczy przypisania SET od lewej do prawej
+        updated = restore_previous_status(
+            Reservation.objects.filter(pk__in=[reservation.pk for reservation in approved if reservation not in unpaid]),
+            start_datetime=F('new_start_datetime'), end_datetime=F('new_end_datetime'),
+            new_start_datetime=None, new_end_datetime=None, **changes,
+        ) if len(approved) > len(unpaid) else 0
+        return updated, invalid + conflicts + unpaid
+
+
+def reject_modifications(queryset):
+    """Odrzuca prośby o zmianę terminu; rezerwacja zostaje w dotychczasowym terminie i statusie."""
+    return restore_previous_status(queryset, new_start_datetime=None, new_end_datetime=None)
+
+
+def stale(status, cutoff):
+    """Rezerwacje w statusie ``status`` niezmienionym od ``cutoff``, w kolejności indeksu."""
+    return Reservation.objects.filter(status=status, status_changed_at__lt=cutoff).order_by('status_changed_at', 'pk')
+
+
+def expire_stale(status, target, cutoff, batch_size, refund_ratio=0, description="Automatyczne anulowanie rezerwacji"):
+    """Przenosi jedną partię zaległych rezerwacji do ``target``; zwraca liczbę zmienionych (0 = koniec).
+
+    Partia to jedna krótka transakcja: zablokowanie wierszy partii (zablokowane
+    przez innych są pomijane), jeden UPDATE statusu, a przy anulowaniu zwolnienie
+    terminów i zwroty ``refund_ratio`` ceny jednym UPDATE sald i jednym INSERT do księgi.
+    """
+    refund_ratio = Decimal(str(refund_ratio))
+    with transaction.atomic():
+        rows = list(
+            stale(status, cutoff).select_for_update(skip_locked=True)
+            .values_list('pk', 'user_id', 'slot_id', 'price', 'option_id', 'start_datetime', 'end_datetime')[:batch_size]
+        )
+        if not rows:
+            return 0
+        updated = transition_many(Reservation.objects.filter(pk__in=[row[0] for row in rows]), target, expected=[status])
+
+        if target == CANCELLED:
+            release_slots(Counter(row[2] for row in rows))
+            apply_points_many(
+                [(user_id, price * refund_ratio, pk) for pk, user_id, slot_id, price, *interval in rows],
+                PointsTransaction.REFUND, description=description,
+            )
+            for interval in {tuple(row[4:]) for row in rows}:
+                promote_on_commit(*interval)
+    return updated
@@ -29,6 +29,7 @@ urlpatterns = [
     path('activate/<uidb64>/<token>/', views.activate, name='activate'),
     path('password_reset/', password_reset_request, name='password_reset'),
     path('reservation/cancel/<int:reservation_id>/', views.cancel_reservation_request, name='cancel_reservation_request'),
+    path('reservation/<int:reservation_id>/change_date/', views.request_change_date, name='request_change_date'),
     path('password_reset_done/', auth_views.PasswordResetDoneView.as_view(template_name='password_reset_done.html'),
          name='password_reset_done'),
     path(
@@ -45,6 +46,14 @@ urlpatterns = [
     path('email-change-confirm/<uidb64>/<token>/', email_change_confirm, name='email_change_confirm'),
     # Widok dla administratora
     path('api/get_service_options/', views.get_service_options, name='get_service_options'),
+    path('api/service/<int:service_id>/slots/', views.service_slots, name='service_slots'),
+    path('api/service/<int:service_id>/hold/', views.place_booking_hold, name='place_booking_hold'),
+    path('api/reservations/group/', views.book_group_view, name='book_group'),
+    path('api/admission/<int:request_id>/', views.admission_status, name='admission_status'),
+    path('service/<int:service_id>/waitlist/', views.join_waitlist, name='join_waitlist'),
+    path('waitlist/<int:entry_id>/leave/', views.leave_waitlist, name='leave_waitlist'),
+    path('series/<int:series_id>/cancel/', views.cancel_reservation_series, name='cancel_reservation_series'),
+    path('api/autocomplete/', views.autocomplete, name='autocomplete'),
     path('service-status/', views.service_status, name='service_status'),
     path('admin/data-summary/', DataSummaryAdminView().data_summary_view, name='data-summary'),
     path('admin/data-summary/export-csv/', DataSummaryAdminView().export_csv, name='export-csv'),
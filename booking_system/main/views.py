@@ -1,3 +1,7 @@
+import hashlib
+import json
+import uuid
+
 from django import forms
 from django.contrib.auth import login, update_session_auth_hash
 from django.contrib.auth import logout
@@ -7,24 +11,43 @@ from django.contrib.auth.tokens import default_token_generator
 from django.contrib.auth.views import PasswordResetConfirmView
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.db import transaction
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django.shortcuts import redirect, get_object_or_404
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.utils.encoding import force_bytes, force_str
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode, urlencode
 from .forms import UserUpdateForm, ReviewForm, CustomSetPasswordForm, EmailChangeForm, RegistrationForm
 from .forms import CustomAuthenticationForm
-from .models import Service, Review, Reservation, User, ServiceOption, ServiceStatus
+from .models import Service, Review, Reservation, User, ServiceOption, ServiceStatus, PointsTransaction, BookingHold, WaitlistEntry
+from .models import AdmissionRequest, ReservationSeries
 from datetime import timezone
-from django.utils.timezone import now, localtime
+from django.utils.timezone import now, localtime, is_naive
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib import messages
 from .models import Message
+from .catalog import get_facets, get_type_options, get_catalog_entry, get_service_detail
+from .catalog import get_catalog_version, get_catalog_last_modified
+from .autocomplete import suggest, canonical_location
+from .booking import book_group, book_option, place_hold, BookingError
+from . import admission, waitlist
+from .series import book_series, cancel_series
+from .idempotency import get_key, request_fingerprint, run_once, run_once_with_data
+from .slots import find_slot, free_slots, uses_slots
+from .transitions import (
+    CONFIRMED, PENDING, PENDING_CANCELLATION, PENDING_MODIFICATION, can_transition, cancel, request_modification,
+    transition,
+)
+from .points import apply_points
+from .availability import get_availability_version
+from .search import HomeFilters, search_services, paginate_services, normalize_sort, SORT_ORDERS
 from .tokens import account_activation_token
 from django.shortcuts import render
 from django.conf import settings
 from django.db.models import Count, Q
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.utils.timezone import make_aware
 from django.contrib.auth import views as auth_views
 from .forms import CustomPasswordResetForm
@@ -40,8 +63,8 @@ def register(request):
         form = RegistrationForm(request.POST)
         if form.is_valid():
             user = form.save(commit=False)
-            user.balance = 2000
             user.save()
+            apply_points(user, 2000, PointsTransaction.ADMIN_GRANT, description="Punkty powitalne")
 
             mail_subject = 'Aktywacja konta'
 
@@ -90,67 +113,41 @@ def activate(request, uidb64, token):
         return render(request, 'activation_invalid.html')
 
 def home(request):
-    # Pobranie unikalnych lokalizacji
-    cities = Service.objects.values_list('location', flat=True).distinct()
-    service_status = ServiceStatus.objects.first()
-
-    # Pobranie filtrów z request.GET
-    service_type = request.GET.get('type', '')  # Rodzaj usługi
-    location = request.GET.get('location', '')  # Lokalizacja
-    max_price = request.GET.get('price', '')  # Maksymalna cena
-    check_in = request.GET.get('check_in', '')  # Data od
-    check_out = request.GET.get('check_out', '')  # Data do
-    option_id = request.GET.get('option', '')  # Wybrana opcja
-
-    # Pobieranie wszystkich usług
-    services = Service.objects.annotate(option_count=Count('service_options'))
-
-    # Filtrowanie po typie usługi
-    if service_type:
-        services = services.filter(type=service_type)
-
-    # Filtrowanie po lokalizacji
-    if location:
-        services = services.filter(location=location)
-
-    # Filtrowanie po cenie
-    if max_price:
-        try:
-            max_price = float(max_price)
-            services = services.filter(
-                Q(service_options__price__lte=max_price) | Q(option_count=0)
-            )
-        except ValueError:
-            pass
-
-    # Filtrowanie po dostępności dat
-    if check_in and check_out:
-        try:
-            check_in_date = datetime.strptime(check_in, '%Y-%m-%d').date()
-            check_out_date = datetime.strptime(check_out, '%Y-%m-%d').date()
-
-            # Filtrowanie usług z opcjami dostępnych w danych datach
-            available_services = services.filter(
-                service_options__available_from__lte=check_out_date,
-                service_options__available_to__gte=check_in_date
-            ).distinct()
-
-            # Dodanie usług bez opcji tylko, gdy wybrano typ usługi
-            if service_type:
-                services = available_services | services.filter(option_count=0)
-            else:
-                services = available_services
-        except ValueError:
-            pass  # Ignoruj błędne daty
-
-    # Filtrowanie po konkretnej opcji
-    if option_id:
-        services = services.filter(service_options__id=option_id)
+    # Miasta, liczności typów i przedziałów cen oraz status serwisu pochodzą z cache katalogu
+    facets = get_facets()
+
+    # Filtry z request.GET kompilowane do jednego zapytania (zob. search.py)
+    filters = HomeFilters.from_query_dict(request.GET)
+    # Lokalizacja wpisana bez polskich znaków ("krakow") jest zamieniana na nazwę z katalogu
+    filters.location = canonical_location(filters.location, facets['cities'])
+    service_type = filters.service_type
+    services = search_services(filters)
+
+    # Stronicowanie kursorem; linki do kolejnych stron niosą wszystkie filtry
+    sort = normalize_sort(request.GET.get('sort', ''), filters)
+    cursor = request.GET.get('cursor', '')
+    page_query = dict(filters.as_query_dict(), sort=sort)
+
+    def render_grid():
+        page = paginate_services(services, sort=sort, cursor=cursor)
+        page.first_query = urlencode(page_query)
+        page.next_query = urlencode(dict(page_query, cursor=page.next_cursor)) if page.has_next else ''
+        return render_to_string('service_grid.html', {'page': page})
+
+    # Siatka usług jest cache'owana pod skrótem kanonicznego klucza filtrów i wersją katalogu
+    # (tekst użytkownika nie trafia do klucza memcached); przy wygaśnięciu przelicza ją
+    # tylko jeden proces (zob. caching.py)
+    grid_key = dict(page_query, cursor=cursor)
+    if filters.has_dates:
+        # Wynik filtru dat zależy też od rezerwacji
+        grid_key['availability'] = get_availability_version()
+    grid_digest = hashlib.sha256(urlencode(grid_key).encode()).hexdigest()
+    service_grid = get_catalog_entry(f'home-grid:{grid_digest}', render_grid)
 
     # Pobranie listy opcji dla wybranego typu usługi
     options = []
     if service_type:
-        options = ServiceOption.objects.filter(service__type=service_type)
+        options = get_type_options(service_type)
     # Liczba nowych wiadomości
     new_messages_count = 0
     if request.user.is_authenticated:
@@ -163,21 +160,86 @@ def home(request):
 
     # Renderowanie szablonu
     return render(request, 'home.html', {
-        'services': services.distinct(),
-        'cities': cities,
+        'service_grid': service_grid,
+        'sort': sort,
+        'sort_orders': [
+            (key, label) for key, (label, column) in SORT_ORDERS.items() if key != 'relevance' or filters.query
+        ],
+        'cities': facets['cities'],
+        'service_types': facets['types'],
+        'price_buckets': facets['price_buckets'],
         'options': options,
         'new_messages_count': new_messages_count,
-        'service_status': service_status,
+        'service_status': facets['service_status'],
     })
 
 
+def service_options_etag(request):
+    # ETag zależy tylko od wersji katalogu i parametrów, więc 304 nie wymaga bazy danych
+    params = '&'.join(f"{name}={request.GET.get(name, '')}" for name in ('type', 'service_id', 'limit'))
+    digest = hashlib.md5(params.encode()).hexdigest()[:12]
+    return f"options-{get_catalog_version()}-{digest}"
+
+
+def service_options_last_modified(request):
+    return get_catalog_last_modified()
+
+
+@condition(etag_func=service_options_etag, last_modified_func=service_options_last_modified)
 def get_service_options(request):
     service_type = request.GET.get('type')
     if not service_type:
         return JsonResponse({'options': []})
 
-    options = ServiceOption.objects.filter(service__type=service_type).values('id', 'name')
-    return JsonResponse({'options': list(options)})
+    # Lista opcji typu jest w cache; service_id i limit zawężają odpowiedź
+    options = get_type_options(service_type)
+    service_id = request.GET.get('service_id', '')
+    if service_id.isdigit():
+        options = [option for option in options if option['service_id'] == int(service_id)]
+
+    max_limit = getattr(settings, 'SERVICE_OPTIONS_MAX_LIMIT', 500)
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), max_limit) if limit.isdigit() else max_limit
+
+    response = JsonResponse({
+        'options': [{'id': option['id'], 'name': option['name']} for option in options[:limit]],
+        'has_more': len(options) > limit,
+    })
+    # Przeglądarka zawsze pyta serwer, ale z If-None-Match dostaje 304
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
+
+def autocomplete(request):
+    # Podpowiedzi z indeksu w pamięci (zob. autocomplete.py), bez zapytań do bazy
+    kind = request.GET.get('kind', '')
+    suggestions = suggest(request.GET.get('q', ''), request.GET.get('limit'), kind or None)
+    response = JsonResponse({'suggestions': suggestions})
+    patch_cache_control(response, max_age=60)
+    return response
+
+def service_slots(request, service_id):
+    """Wolne terminy usługi w danym dniu (?date=RRRR-MM-DD, opcjonalnie &option=id)."""
+    try:
+        day = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': "Nieprawidłowa data."}, status=400)
+    option_id = request.GET.get('option', '')
+    option_id = int(option_id) if option_id.isdigit() else None
+
+    slots = free_slots(service_id, day, option_id)
+    return JsonResponse({
+        'date': day.isoformat(),
+        'slots': [
+            {
+                'id': slot['id'],
+                'option_id': slot['option_id'],
+                'start': localtime(slot['start']).strftime('%H:%M'),
+                'end': localtime(slot['end']).strftime('%H:%M'),
+                'remaining': slot['remaining'],
+            }
+            for slot in slots
+        ],
+    })
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -205,9 +267,12 @@ def logout_view(request):
 
 
 def service_detail(request, service_id):
-    service = get_object_or_404(Service, id=service_id)
-    reviews = Review.objects.filter(service=service)
-    options = service.service_options.all()
+    # Usługa i jej opcje pochodzą z cache katalogu, opinie zawsze z bazy
+    detail = get_service_detail(service_id)
+    if detail is None:
+        raise Http404("Usługa nie istnieje.")
+    service, options = detail['service'], detail['options']
+    reviews = Review.objects.filter(service=service).select_related('user')
 
     # Konwersja dat na string w formacie 'YYYY-MM-DD'
     availability = [
@@ -219,11 +284,22 @@ def service_detail(request, service_id):
         for option in options
     ]
 
+    # Zgłoszenia z kolejki wyprzedaży: oczekujące i rozstrzygnięte przed chwilą
+    admission_requests = []
+    if request.user.is_authenticated:
+        admission_requests = AdmissionRequest.objects.select_related('option').filter(
+            Q(status=AdmissionRequest.QUEUED) | Q(processed_at__gte=now() - timedelta(minutes=5)),
+            user=request.user, option__service_id=service.id,
+        )
+
     return render(request, 'service_detail.html', {
         'service': service,
         'options': options,
         'reviews': reviews,
         'availability': availability,  # Przekazujemy dostępność jako listę
+        'admission_requests': admission_requests,
+        # Nowy klucz przy każdym wyświetleniu; ponowne wysłanie tego samego formularza go powtarza
+        'idempotency_key': uuid.uuid4().hex,
     })
 
 @login_required
@@ -238,8 +314,7 @@ def add_review(request, service_id):
             review.service = service
             review.save()
 
-            request.user.balance += 1000
-            request.user.save()
+            apply_points(request.user, 1000, PointsTransaction.REVIEW_REWARD, description=f"Opinia: {service.name}")
 
             messages.success(request, "Twoja opinia została dodana! Otrzymałeś 1000 punktów.", extra_tags='review')
             return redirect('service_detail', service_id=service_id)
@@ -248,90 +323,261 @@ def add_review(request, service_id):
 
     form = ReviewForm()
     return render(request, 'service_detail.html', {'service': service, 'form': form})
-@login_required
-def make_reservation(request, service_id):
-    service = get_object_or_404(Service, id=service_id)
 
-    if request.method == 'POST':
-        option_id = request.POST.get('option')
-        if not option_id:
-            messages.error(request, "Nie wybrano żadnej opcji rezerwacji.", extra_tags='reservation')
-            return redirect('service_detail', service_id=service_id)
+
+def parse_booking(request, service):
+    """Opcja, termin, cena i termin z siatki z formularza rezerwacji; błędy jako BookingError."""
+    slot = None
+    end_date = None
+    option_id = request.POST.get('option')
+    if not option_id:
+        raise BookingError("Nie wybrano żadnej opcji rezerwacji.")
+
+    try:
+        option = ServiceOption.objects.get(id=option_id, service=service)
+    except (ServiceOption.DoesNotExist, ValueError):
+        raise BookingError("Wybrana opcja nie istnieje dla tej usługi.")
+
+    if service.type == 'Hotel':
+        start_date = request.POST.get('start_date')
+        end_date = request.POST.get('end_date')
+        if not start_date or not end_date:
+            raise BookingError("Proszę podać daty dla rezerwacji.")
 
         try:
-            option = ServiceOption.objects.get(id=option_id, service=service)
-        except ServiceOption.DoesNotExist:
-            messages.error(request, "Wybrana opcja nie istnieje dla tej usługi.", extra_tags='reservation')
-            return redirect('service_detail', service_id=service_id)
+            start_date = datetime.strptime(start_date, '%Y-%m-%d')
+            end_date = datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            raise BookingError("Nieprawidłowy format daty.")
 
-        if service.type == 'Hotel':
-            start_date = request.POST.get('start_date')
-            end_date = request.POST.get('end_date')
-            if not start_date or not end_date:
-                messages.error(request, "Proszę podać daty dla rezerwacji.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
+        today = now().date()
+        if start_date.date() < today or end_date.date() < today:
+            raise BookingError("Nie można zarezerwować usługi w przeszłości.")
 
-            try:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d')
-                end_date = datetime.strptime(end_date, '%Y-%m-%d')
-            except ValueError:
-                messages.error(request, "Nieprawidłowy format daty.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
-
-            today = now().date()
-            if start_date.date() < today or end_date.date() < today:
-                messages.error(request, "Nie można zarezerwować usługi w przeszłości.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
-
-            if end_date <= start_date:
-                messages.error(request, "Data zakończenia musi być późniejsza niż data rozpoczęcia.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
-
-            duration = (end_date - start_date).days
-            total_price = option.price * duration
-        elif service.type in ['Restauracja', 'SPA&WELLNESS']:
-            datetime_str = request.POST.get('datetime')
-            if not datetime_str:
-                messages.error(request, "Proszę podać datę i godzinę dla rezerwacji.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
+        if end_date <= start_date:
+            raise BookingError("Data zakończenia musi być późniejsza niż data rozpoczęcia.")
+
+        duration = (end_date - start_date).days
+        total_price = option.price * duration
+        start_date, end_date = make_aware(start_date), make_aware(end_date)
+    elif uses_slots(service.type):
+        datetime_str = request.POST.get('datetime')
+        if not datetime_str:
+            raise BookingError("Proszę podać datę i godzinę dla rezerwacji.")
 
+        try:
+            start_date = make_aware(datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M'))
+        except ValueError:
             try:
-                start_date = make_aware(datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M'))
+                start_date = make_aware(datetime.strptime(datetime_str, '%Y-%m-%d %H:%M'))
             except ValueError:
-                try:
-                    start_date = make_aware(datetime.strptime(datetime_str, '%Y-%m-%d %H:%M'))
-                except ValueError:
-                    messages.error(request, "Nieprawidłowy format daty i godziny.", extra_tags='reservation')
-                    return redirect('service_detail', service_id=service_id)
+                raise BookingError("Nieprawidłowy format daty i godziny.")
 
-            if start_date < now():
-                messages.error(request, "Nie można zarezerwować usługi w przeszłości.", extra_tags='reservation')
-                return redirect('service_detail', service_id=service_id)
+        if start_date < now():
+            raise BookingError("Nie można zarezerwować usługi w przeszłości.")
 
-            total_price = option.price
-        else:
-            start_date = now()
-            total_price = option.price
+        # Rezerwacja dotyczy terminu z siatki godzin otwarcia (zob. slots.py)
+        slot = find_slot(option, start_date)
+        if slot is None:
+            raise BookingError("Wybierz godzinę z listy wolnych terminów.")
 
-        if request.user.balance < total_price:
-            messages.error(request, "Nie masz wystarczających środków na koncie.", extra_tags='reservation')
-            return redirect('service_detail', service_id=service_id)
+        total_price = option.price
+    else:
+        start_date = now()
+        total_price = option.price
+
+    return option, start_date, end_date, slot, total_price
+
+
+def find_hold(request, option, start_date, end_date):
+    """Aktywna blokada użytkownika z formularza, jeśli dotyczy wybranej opcji i terminu."""
+    hold_id = request.POST.get('hold', '')
+    if not hold_id.isdigit():
+        return None
+    # Blokada musi dotyczyć dokładnie terminu z formularza; koniec terminu z siatki wynika z jego początku
+    holds = BookingHold.objects.select_related('slot').filter(
+        pk=hold_id, user=request.user, option=option, status=BookingHold.ACTIVE, start_datetime=start_date,
+    )
+    if not uses_slots(option.service.type):
+        holds = holds.filter(end_datetime=end_date)
+    return holds.first()
+
+
+def reserve_series_from_post(request, option, start_date, end_date):
+    """Rezerwacja cykliczna z pól ``repeat`` (daily/weekly) i ``repeat_until`` formularza."""
+    if not uses_slots(option.service.type):
+        return messages.ERROR, "Rezerwację cykliczną można utworzyć tylko w restauracji i SPA."
+    try:
+        until = datetime.strptime(request.POST.get('repeat_until', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return messages.ERROR, "Podaj datę końca serii."
 
-        request.user.balance -= total_price
-        request.user.save()
+    try:
+        series, reservations = book_series(request.user, option, start_date, end_date, request.POST['repeat'], until=until)
+    except BookingError as error:
+        return messages.ERROR, str(error)
 
-        reservation = Reservation(
-            user=request.user,
-            option=option,
-            start_datetime=start_date,
-            end_datetime=end_date if service.type == 'Hotel' else None,
-            price=total_price,
-            status='pending'
+    return messages.SUCCESS, f"Rezerwacja cykliczna została utworzona. Liczba terminów: {len(reservations)}."
+
+
+def reserve_from_post(request, service):
+    """Waliduje formularz rezerwacji i rezerwuje opcję; zwraca poziom i treść komunikatu."""
+    try:
+        option, start_date, end_date, slot, total_price = parse_booking(request, service)
+    except BookingError as error:
+        return messages.ERROR, str(error)
+
+    if request.POST.get('repeat'):
+        return reserve_series_from_post(request, option, start_date, end_date)
+
+    if request.user.balance < total_price:
+        return messages.ERROR, "Nie masz wystarczających środków na koncie."
+
+    if option.flash_sale:
+        # Tryb wyprzedaży: bez blokady opcji, zgłoszenie rozstrzygnie drain_admission_queue
+        entry, created = admission.enqueue(request.user, option, start_date, end_date, slot=slot, price=total_price)
+        if not created:
+            return messages.INFO, "Twoje zgłoszenie na tę opcję już czeka w kolejce."
+        return messages.INFO, (
+            f"Twoje zgłoszenie czeka w kolejce (miejsce {admission.position(entry)}). "
+            "Wynik pojawi się na tej stronie."
+        )
+
+    # Sprawdzenie wolnych jednostek i obciążenie salda pod blokadą opcji (zob. booking.py)
+    try:
+        book_option(
+            request.user, option, start_date, end_date, total_price,
+            slot=slot, hold=find_hold(request, option, start_date, end_date),
         )
-        reservation.save()
+    except BookingError as error:
+        return messages.ERROR, str(error)
+
+    return messages.SUCCESS, "Rezerwacja została pomyślnie utworzona!"
+
+
+@login_required
+def join_waitlist(request, service_id):
+    """Zapis na listę oczekujących na termin z formularza rezerwacji."""
+    service = get_object_or_404(Service, id=service_id)
+    if request.method == 'POST':
+        try:
+            option, start_date, end_date, slot, total_price = parse_booking(request, service)
+        except BookingError as error:
+            messages.error(request, str(error), extra_tags='reservation')
+        else:
+            entry, created = waitlist.join(request.user, option, start_date, end_date)
+            if created:
+                messages.success(
+                    request, "Zapisano Cię na listę oczekujących. Gdy miejsce się zwolni, zarezerwujemy je automatycznie.",
+                    extra_tags='reservation',
+                )
+            else:
+                messages.info(request, "Jesteś już na liście oczekujących na ten termin.", extra_tags='reservation')
 
-        messages.success(request, "Rezerwacja została pomyślnie utworzona!", extra_tags='reservation')
-        return redirect('service_detail', service_id=service_id)
+    return redirect('service_detail', service_id=service_id)
+
+
+@login_required
+def leave_waitlist(request, entry_id):
+    if request.method == 'POST':
+        if waitlist.leave(request.user, entry_id):
+            messages.info(request, "Wypisano Cię z listy oczekujących.")
+        else:
+            messages.error(request, "Nie jesteś już na tej liście oczekujących.")
+    return redirect('my_reservations')
+
+
+@login_required
+def place_booking_hold(request, service_id):
+    """Blokuje wybrany termin na HOLD_MINUTES minut (POST z polami formularza rezerwacji)."""
+    if request.method != 'POST':
+        return JsonResponse({'error': "Dozwolona jest tylko metoda POST."}, status=405)
+    service = get_object_or_404(Service, id=service_id)
+
+    try:
+        option, start_date, end_date, slot, total_price = parse_booking(request, service)
+        if option.flash_sale:
+            # Blokada zajmowałaby wiersz opcji, którego w trybie wyprzedaży nie blokujemy w żądaniach
+            raise BookingError("Podczas wyprzedaży terminy nie są blokowane; rezerwacje trafiają do kolejki.")
+        hold = place_hold(request.user, option, start_date, end_date, slot=slot)
+    except BookingError as error:
+        return JsonResponse({'error': str(error)}, status=409)
+
+    return JsonResponse({
+        'hold_id': hold.pk,
+        'expires_at': hold.expires_at.isoformat(),
+        'price': total_price,
+    }, status=201)
+
+
+@login_required
+def admission_status(request, request_id):
+    """Stan zgłoszenia z kolejki wyprzedaży; odpytywany przez stronę usługi."""
+    entry = get_object_or_404(AdmissionRequest, id=request_id, user=request.user)
+    return JsonResponse({
+        'status': entry.status,
+        'result': entry.result,
+        'position': admission.position(entry),
+        'reservation': entry.reservation_id,
+    })
+
+
+def parse_group_line(line):
+    """Pozycja rezerwacji grupowej: {"option": id, "start": data lub data i godzina, "end": opcjonalnie}."""
+    def parse(value):
+        if not value:
+            return None
+        parsed = parse_datetime(value) or datetime.combine(parse_date(value), datetime.min.time())
+        return make_aware(parsed) if is_naive(parsed) else parsed
+
+    start = parse(line['start'])
+    if start is None:
+        raise ValueError("Brak daty rozpoczęcia.")
+    return int(line['option']), start, parse(line.get('end'))
+
+
+@login_required
+def book_group_view(request):
+    """Rezerwacja wielu opcji naraz (JSON {"lines": [...]}); wszystkie pozycje albo żadna."""
+    if request.method != 'POST':
+        return JsonResponse({'error': "Dozwolona jest tylko metoda POST."}, status=405)
+    try:
+        lines = [parse_group_line(line) for line in json.loads(request.body)['lines']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Nieprawidłowe dane rezerwacji grupowej."}, status=400)
+
+    def action():
+        try:
+            created = book_group(request.user, lines)
+        except BookingError as error:
+            return messages.ERROR, str(error), None
+        return messages.SUCCESS, f"Utworzono rezerwacje: {len(created)}.", [reservation.pk for reservation in created]
+
+    # Ponowione żądanie z tym samym nagłówkiem Idempotency-Key nie rezerwuje drugi raz,
+    # a dostaje id rezerwacji utworzonych przez pierwsze
+    key = get_key(request)
+    level, text, ids = run_once_with_data(request.user, key, request_fingerprint(request), action) if key else action()
+    if level != messages.SUCCESS:
+        return JsonResponse({'error': text}, status=409)
+    return JsonResponse({'message': text, 'reservations': ids}, status=201)
+
+
+@login_required
+def make_reservation(request, service_id):
+    service = get_object_or_404(Service, id=service_id)
+
+    if request.method == 'POST':
+        # Ponownie wysłany formularz (ten sam klucz) dostaje wynik pierwszego wysłania
+        key = get_key(request)
+        if key:
+            level, text = run_once(
+                request.user, key, request_fingerprint(request), lambda: reserve_from_post(request, service)
+            )
+        else:
+            level, text = reserve_from_post(request, service)
+        messages.add_message(request, level, text, extra_tags='reservation')
+
+    return redirect('service_detail', service_id=service_id)
 
 
 @login_required
@@ -408,44 +654,82 @@ def user_data(request):
 
 @login_required
 def my_reservations(request):
-    reservations = Reservation.objects.select_related('option', 'option__service').filter(user=request.user)
+    # Nazwa i typ usługi z Reservation.service (zawsze ustawione, zob. Reservation.sync_service)
+    reservations = Reservation.objects.select_related('option', 'service', 'series').filter(user=request.user)
 
     formatted_reservations = []
+    series = {}
     for reservation in reservations:
-        service_type = reservation.option.service.type  # Poprawiona ścieżka do typu usługi
+        service_type = reservation.service.type if reservation.service else None
+        option = reservation.option
         start_datetime = localtime(reservation.start_datetime)  # Użyj lokalnej strefy czasowej
         end_datetime = localtime(reservation.end_datetime) if reservation.end_datetime else None
 
-        # Pobierz dane dostępności
-        available_from = reservation.option.available_from
-        available_to = reservation.option.available_to
-
-        if service_type in ['Hotel', 'Wycieczka']:
-            # Wyświetl tylko daty bez godzin
-            formatted_reservations.append({
-                'id': reservation.id,
-                'service_name': reservation.option.service.name,
-                'option_name': reservation.option.name,
-                'start_date': start_datetime.strftime('%d-%m-%Y'),
-                'end_date': end_datetime.strftime('%d-%m-%Y') if end_datetime else None,
-                'status': reservation.get_status_display(),
-                'available_from': available_from.strftime('%d-%m-%Y') if available_from else None,
-                'available_to': available_to.strftime('%d-%m-%Y') if available_to else None,
-            })
-        else:
-            # Wyświetl datę i godzinę
-            formatted_reservations.append({
-                'id': reservation.id,
-                'service_name': reservation.option.service.name,
-                'option_name': reservation.option.name,
-                'start_date': start_datetime.strftime('%d-%m-%Y %H:%M'),
-                'end_date': end_datetime.strftime('%d-%m-%Y %H:%M') if end_datetime else None,
-                'status': reservation.get_status_display(),
-                'available_from': available_from.strftime('%d-%m-%Y') if available_from else None,
-                'available_to': available_to.strftime('%d-%m-%Y') if available_to else None,
+        # Wystąpienia rezerwacji cyklicznej są pokazywane jako jedna pozycja serii
+        if reservation.series_id is not None:
+            entry = series.setdefault(reservation.series_id, {
+                'id': reservation.series_id,
+                'service_name': reservation.service_name,
+                'option_name': option.name if option else "Brak danych",
+                'rule': (
+                    f"{reservation.series.get_frequency_display()}, godz. "
+                    f"{localtime(reservation.series.start_datetime):%H:%M}, do {reservation.series.until:%d-%m-%Y}"
+                ),
+                'count': 0,
+                'active': 0,
+                'next': None,
             })
+            entry['count'] += 1
+            if reservation.status in (PENDING, CONFIRMED) and reservation.start_datetime > now():
+                entry['active'] += 1
+                if entry['next'] is None or start_datetime < entry['next']:
+                    entry['next'] = start_datetime
+            continue
+
+        # Pobierz dane dostępności
+        available_from = option.available_from if option else None
+        available_to = option.available_to if option else None
+
+        # Hotele i wycieczki: tylko daty bez godzin
+        date_format = '%d-%m-%Y' if service_type in ['Hotel', 'Wycieczka'] else '%d-%m-%Y %H:%M'
+        formatted_reservations.append({
+            'id': reservation.id,
+            'service_name': reservation.service_name,
+            'option_name': option.name if option else "Brak danych",
+            'start_date': start_datetime.strftime(date_format),
+            'end_date': end_datetime.strftime(date_format) if end_datetime else None,
+            'status': reservation.get_status_display(),
+            'status_code': reservation.status,
+            'can_change_date': can_transition(reservation.status, PENDING_MODIFICATION) and not uses_slots(service_type),
+            'available_from': available_from.strftime('%d-%m-%Y') if available_from else None,
+            'available_to': available_to.strftime('%d-%m-%Y') if available_to else None,
+        })
+
+    for entry in series.values():
+        entry['next'] = entry['next'].strftime('%d-%m-%Y %H:%M') if entry['next'] else None
+
+    waiting = WaitlistEntry.objects.select_related('option__service').filter(
+        user=request.user, status=WaitlistEntry.WAITING,
+    ).order_by('start_datetime')
+
+    return render(request, 'my_reservations.html', {
+        'reservations': formatted_reservations,
+        'series': list(series.values()),
+        'waitlist': waiting,
+    })
 
-    return render(request, 'my_reservations.html', {'reservations': formatted_reservations})
+
+@login_required
+def cancel_reservation_series(request, series_id):
+    """Prośba o anulowanie wszystkich nadchodzących terminów serii (zatwierdza administrator)."""
+    series = get_object_or_404(ReservationSeries, id=series_id, user=request.user)
+    if request.method == 'POST':
+        cancelled = cancel_series(series)
+        if cancelled:
+            messages.info(request, f"Terminy serii oczekujące na anulowanie: {cancelled}. Administrator musi je zatwierdzić.")
+        else:
+            messages.error(request, "Ta seria nie ma już terminów do anulowania.")
+    return redirect('my_reservations')
 
 
 @login_required
@@ -493,16 +777,33 @@ def user_messages(request):
 
     return render(request, 'user_messages.html', {'messages': messages})
 @login_required
-def cancel_reservation_request(request, reservation_id):
-    reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
-
-    if reservation.status != 'pending cancellation':
-        reservation.status = 'pending cancellation'
-        reservation.save()
+def request_change_date(request, reservation_id):
+    """Prośba o zmianę terminu; zatwierdza ją administrator (akcja approve_modification)."""
+    reservation = get_object_or_404(Reservation.objects.select_related('service'), id=reservation_id, user=request.user)
+    if request.method != 'POST':
+        return redirect('my_reservations')
 
-        messages.info(request, "Twoja rezerwacja została oznaczona jako oczekująca na anulowanie. Administrator musi ją zatwierdzić.")
+    try:
+        new_start = make_aware(datetime.strptime(request.POST.get('new_start_datetime', ''), '%Y-%m-%dT%H:%M'))
+        new_end = request.POST.get('new_end_datetime')
+        new_end = make_aware(datetime.strptime(new_end, '%Y-%m-%dT%H:%M')) if new_end else None
+    except ValueError:
+        messages.error(request, "Nieprawidłowy format daty i godziny.")
+        return redirect('my_reservations')
+
+    if new_start < now():
+        messages.error(request, "Nie można przenieść rezerwacji na termin w przeszłości.")
+    elif new_end is None and reservation.end_datetime is not None:
+        messages.error(request, "Proszę podać nową datę zakończenia.")
+    elif new_end is not None and new_end <= new_start:
+        messages.error(request, "Data zakończenia musi być późniejsza niż data rozpoczęcia.")
+    elif reservation.slot_id is not None or (reservation.service and uses_slots(reservation.service.type)):
+        # Termin z siatki godzin zmienia się przez anulowanie i nową rezerwację
+        messages.error(request, "Aby zmienić godzinę, anuluj rezerwację i wybierz nowy termin z listy.")
+    elif request_modification(reservation, new_start, new_end):
+        messages.info(request, "Prośba o zmianę terminu została wysłana. Administrator musi ją zatwierdzić.")
     else:
-        messages.error(request, "Ta rezerwacja jest już w trakcie anulowania.")
+        messages.error(request, "Termin tej rezerwacji nie może być teraz zmieniony.")
 
     return redirect('my_reservations')
 
@@ -514,24 +815,19 @@ def confirm_reservation_cancellation(request, reservation_id):
 
     reservation = get_object_or_404(Reservation, id=reservation_id)
 
-    if reservation.status == 'pending cancellation':
-        try:
-            with transaction.atomic():
-                reservation.status = 'cancelled'
-                reservation.save()
-
-                refund_points = reservation.price / 2  # zwrot 50% kosztu
-                reservation.user.balance += refund_points
-                reservation.user.save()
-
-                messages.success(
-                    request,
-                    f"Rezerwacja została anulowana. Zwrocono połowę kosztu rezerwacji: {refund_points:.2f} punktów."
-                )
-        except Exception as e:
-            messages.error(request, f"Wystąpił błąd podczas anulowania: {str(e)}")
+    # Zwrot tylko wtedy, gdy to wywołanie zmieniło status (zob. transitions.py)
+    try:
+        refund = cancel(reservation, reservation.price / 2, expected=[PENDING_CANCELLATION])  # zwrot 50% kosztu
+    except Exception as e:
+        messages.error(request, f"Wystąpił błąd podczas anulowania: {str(e)}")
     else:
-        messages.error(request, "Rezerwacja nie jest w stanie oczekującym na anulowanie.")
+        if refund is None:
+            messages.error(request, "Rezerwacja nie jest w stanie oczekującym na anulowanie.")
+        else:
+            messages.success(
+                request,
+                f"Rezerwacja została anulowana. Zwrocono połowę kosztu rezerwacji: {refund.amount:.2f} punktów."
+            )
 
     return redirect('admin_reservations')
 
@@ -549,8 +845,7 @@ def delete_review(request, review_id):
         redirect_to = request.POST.get('redirect_to', 'service_detail')
         review.delete()
 
-        request.user.balance -= 1000
-        request.user.save()
+        apply_points(request.user, -1000, PointsTransaction.REVIEW_REWARD, description="Usunięcie opinii")
 
         if redirect_to == 'my_reviews':
             messages.success(request, "Opinia została pomyślnie usunięta. Zostało ci zabrane 1000 punktów")
@@ -585,13 +880,13 @@ def admin_reply(request, message_id):
 def cancel_reservation_request(request, reservation_id):
     reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
 
-    if reservation.status != 'pending cancellation':  # Upewnij się, że nie zmieniamy statusu dwa razy
-        reservation.status = 'pending cancellation'
-        reservation.save()  # Zapisz zmieniony status w bazie danych
-
+    # Warunkowy UPDATE: dwa kliknięcia nie zmieniają statusu dwa razy
+    if transition(reservation, PENDING_CANCELLATION):
         messages.info(request, "Twoja rezerwacja została oznaczona jako oczekująca na anulowanie. Administrator musi ją zatwierdzić.")
-    else:
+    elif reservation.status == PENDING_CANCELLATION:
         messages.error(request, "Ta rezerwacja jest już w trakcie anulowania.")
+    else:
+        messages.error(request, "Tej rezerwacji nie można już anulować.")
 
     return redirect('my_reservations')
 
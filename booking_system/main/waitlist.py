@@ -0,0 +1,118 @@
+"""Lista oczekujących na zajęte opcje.
+
+Gdy miejsce się zwalnia (anulowanie rezerwacji, zob. transitions.py), po
+zatwierdzeniu transakcji ``promote`` pobiera jednym zapytaniem po indeksie
+(option, status, created_at) kilku pierwszych oczekujących, których termin
+nachodzi na zwolniony, i rezerwuje dla nich miejsce w kolejności zgłoszeń przez
+``book_option`` (ta sama kontrola dostępności i obciążenie salda co w formularzu).
+Zgłoszenie jest oznaczane warunkowym UPDATE w tej samej transakcji co
+rezerwacja, więc równoległe zwolnienia nie przydzielą go dwa razy.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .booking import BookingError, book_option, line_price
+from .broadcast import create_messages
+from .models import Message, WaitlistEntry, overlap_condition
+from .slots import find_slot, uses_slots
+
+
+class AlreadyPromoted(Exception):
+    pass
+
+
+def get_batch_size():
+    return getattr(settings, 'WAITLIST_PROMOTION_BATCH', 10)
+
+
+def join(user, option, start, end=None):
+    """Zapisuje użytkownika na listę; zwraca (zgłoszenie, czy nowe)."""
+    entry = WaitlistEntry.objects.filter(
+        user=user, option=option, start_datetime=start, end_datetime=end, status=WaitlistEntry.WAITING,
+    ).first()
+    if entry is not None:
+        return entry, False
+    return WaitlistEntry.objects.create(user=user, option=option, start_datetime=start, end_datetime=end), True
+
+
+def leave(user, entry_id):
+    return WaitlistEntry.objects.filter(
+        pk=entry_id, user=user, status=WaitlistEntry.WAITING,
+    ).update(status=WaitlistEntry.LEFT) == 1
+
+
+def expire_past(option_id=None):
+    """Zamyka zgłoszenia, których termin już się rozpoczął; zwraca ich liczbę."""
+    entries = WaitlistEntry.objects.filter(status=WaitlistEntry.WAITING, start_datetime__lt=timezone.now())
+    if option_id is not None:
+        entries = entries.filter(option_id=option_id)
+    return entries.update(status=WaitlistEntry.EXPIRED)
+
+
+def candidates(option_id, start, end=None):
+    """Pierwsi oczekujący na opcję, których (jeszcze nierozpoczęty) termin nachodzi na zwolniony przedział [start, end)."""
+    return list(
+        WaitlistEntry.objects.select_related('user', 'option__service')
+        .filter(
+            overlap_condition(start, end), option_id=option_id, status=WaitlistEntry.WAITING,
+            start_datetime__gte=timezone.now(),
+        )
+        .order_by('created_at', 'pk')[:get_batch_size()]
+    )
+
+
+def book_entry(entry):
+    option = entry.option
+    slot = find_slot(option, entry.start_datetime) if uses_slots(option.service.type) else None
+    with transaction.atomic():
+        reservation = book_option(
+            entry.user, option, entry.start_datetime, entry.end_datetime,
+            line_price(option, entry.start_datetime, entry.end_datetime), slot=slot,
+        )
+        promoted = WaitlistEntry.objects.filter(pk=entry.pk, status=WaitlistEntry.WAITING).update(
+            status=WaitlistEntry.PROMOTED, reservation=reservation, promoted_at=timezone.now(),
+        )
+        if not promoted:
+            # Zgłoszenie obsłużyło równoległe zwolnienie miejsca; wycofuje rezerwację i obciążenie
+            raise AlreadyPromoted()
+    return reservation
+
+
+def notify(entry, reservation):
+    # bulk_create pomija Message.save, które wiązałoby wiadomość z pierwszą rezerwacją użytkownika
+    message, = create_messages([Message(
+        user=entry.user,
+        subject="Zwolniło się miejsce z listy oczekujących",
+        content=(
+            f"Zarezerwowaliśmy dla Ciebie {entry.option.service.name} ({entry.option.name}) od "
+            f"{timezone.localtime(reservation.start_datetime):%d.%m.%Y %H:%M}. "
+            f"Z salda pobrano {reservation.price} punktów."
+        ),
+        sender='admin',
+    )])
+    message.reservations.add(reservation)
+
+
+def promote(option_id, start, end=None):
+    """Rezerwuje zwolnione miejsce dla oczekujących (FIFO); zwraca utworzone rezerwacje.
+
+    Oczekujący, dla którego rezerwacja się nie udała (np. brak środków albo termin
+    wciąż zajęty), zostaje na liście, a miejsce przechodzi na następnego.
+    """
+    expire_past(option_id)
+    reservations = []
+    for entry in candidates(option_id, start, end):
+        try:
+            reservation = book_entry(entry)
+        except (BookingError, AlreadyPromoted):
+            continue
+        notify(entry, reservation)
+        reservations.append(reservation)
+    return reservations
+
+
+def promote_on_commit(option_id, start, end=None):
+    """Uruchamia ``promote`` po zatwierdzeniu bieżącej transakcji (zwolnienie musi być już widoczne)."""
+    if option_id is not None:
+        transaction.on_commit(lambda: promote(option_id, start, end))